@@ -7,7 +7,8 @@ def read_requirements(filename: str) -> list:
     """Read requirements from file"""
     reqs_path = Path(__file__).parent / filename
     with open(reqs_path, 'r', encoding='utf-8') as f:
-        reqs = [line.strip() for line in f if line.strip() and not line.startswith('#')]
+        # Skip pip options such as the editable install of ../../wca-client
+        reqs = [line.strip() for line in f if line.strip() and not line.startswith(('#', '-'))]
     return reqs
 
 setup(
@@ -15,7 +16,7 @@ setup(
     version="0.1.0",
     packages=find_packages(include=['wca_i18n', 'wca_i18n.*']),
     python_requires=">=3.8",
-    install_requires=read_requirements('requirements.txt'),
+    install_requires=read_requirements('requirements.txt') + ['wca-client'],
     extras_require={
         'dev': [
             'pytest>=6.2.5',
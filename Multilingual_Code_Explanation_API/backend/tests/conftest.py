@@ -4,6 +4,10 @@ import shutil
 from pathlib import Path
 from dotenv import load_dotenv
 
+# Fail WCA calls that cannot connect at once instead of after the client's
+# connect backoff; read when wca_client is first imported
+os.environ.setdefault("WCA_CONNECT_RETRIES", "0")
+
 @pytest.fixture(scope="session")
 def test_data_dir():
     """Create and clean up test data directory"""
@@ -54,4 +58,11 @@ def setup_test_env():
     yield
     
     # Clean up
-    os.environ.pop("TESTING", None) 
\ No newline at end of file
+    os.environ.pop("TESTING", None)
+
+
+@pytest.fixture(autouse=True)
+def fresh_explanation_cache(monkeypatch):
+    """Give each test an empty in-memory explanation cache."""
+    from backend import wca_i18n
+    monkeypatch.setattr(wca_i18n, "explanation_cache", wca_i18n.ExplanationCache())
@@ -85,6 +85,299 @@ def test_nonexistent_endpoint():
     response = client.get("/nonexistent")
     assert response.status_code == 404
 
+def test_explain_code_over_prompt_budget():
+    """Test that code over the prompt token budget is refused with 413 before calling WCA"""
+    request = CodeExplainRequest(code="x = 1\n" * 20000)
+    response = client.post("/explain/english", json=request.model_dump())
+    assert response.status_code == 413
+    assert "prompt budget" in response.json()["detail"]
+
+def test_explain_requests_overlap_up_to_the_limit(monkeypatch):
+    """Test that concurrent explanations do not block each other, up to WCA_EXPLAIN_CONCURRENCY"""
+    import asyncio
+    import time
+    import httpx
+    import backend.wca_i18n as wca_i18n
+
+    active = peak = 0
+
+    async def slow_explain(source_file, prompt, api_key=None, client=None):
+        nonlocal active, peak
+        active += 1
+        peak = max(peak, active)
+        await asyncio.sleep(0.2)
+        active -= 1
+        return "explained"
+
+    monkeypatch.setattr(wca_i18n.wca, "aexplain", slow_explain)
+    monkeypatch.setattr(wca_i18n, "EXPLAIN_CONCURRENCY", 4)
+
+    async def run():
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as http:
+            start = time.perf_counter()
+            responses = await asyncio.gather(*(
+                http.post("/explain/english", json={"code": f"x = {n}"}) for n in range(8)
+            ))
+            return responses, time.perf_counter() - start
+
+    responses, elapsed = asyncio.run(run())
+    assert [response.json()["explanation"] for response in responses] == ["explained"] * 8
+    assert peak == 4
+    assert elapsed < 0.8  # two rounds of four, not eight one after another
+
+def test_explain_wca_requests_bounded_by_explain_concurrency(monkeypatch):
+    """Test that WCA_EXPLAIN_CONCURRENCY, not the CLIs' WCA_CONCURRENCY, bounds requests sent through AsyncWCAClient"""
+    import asyncio
+    import json
+    import time
+    import httpx
+    import backend.wca_i18n as wca_i18n
+
+    active = peak = 0
+
+    async def chat(request):
+        nonlocal active, peak
+        active += 1
+        peak = max(peak, active)
+        await asyncio.sleep(0.05)
+        active -= 1
+        return httpx.Response(200, content=json.dumps({"response": {"message": {"content": "explained"}}}) + "\n")
+
+    async def afetch(apikey):
+        return "token", time.time() + 3600
+
+    monkeypatch.setattr(wca_i18n, "EXPLAIN_CONCURRENCY", 8)
+
+    async def run():
+        client = wca_i18n.explain_client()
+        client.client = httpx.AsyncClient(transport=httpx.MockTransport(chat))
+        client.token_cache = wca_i18n.wca_client.TokenCache(fetch=None, afetch=afetch)
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as http:
+            responses = await asyncio.gather(*(
+                http.post("/explain/english", json={"code": f"y = {n}"}) for n in range(12)
+            ))
+        await client.aclose()
+        return client, responses
+
+    explainer, responses = asyncio.run(run())
+    assert [response.json()["explanation"] for response in responses] == ["explained"] * 12
+    assert explainer.limiter.max_limit == 8
+    assert peak == 8  # the module limiter would have held it at WCA_CONCURRENCY (4)
+
+def test_lifespan_authenticates_once_and_refreshes_in_background(monkeypatch):
+    """Test that auth is checked at startup, a token refresher runs until shutdown, and requests skip the check"""
+    import asyncio
+    import backend.wca_i18n as wca_i18n
+
+    calls = []
+
+    async def check_auth(api_key):
+        calls.append("auth")
+        return True
+
+    async def keep_token_fresh(api_key):
+        calls.append("refresher")
+        try:
+            await asyncio.Event().wait()
+        finally:
+            calls.append("stopped")
+
+    async def explain(source_file, prompt, api_key=None, client=None):
+        return "explained"
+
+    monkeypatch.setattr(wca_i18n.wca, "acheck_auth", check_auth)
+    monkeypatch.setattr(wca_i18n.wca_client, "akeep_token_fresh", keep_token_fresh)
+    monkeypatch.setattr(wca_i18n.wca, "aexplain", explain)
+    with TestClient(app) as lifespan_client:
+        for _ in range(3):
+            response = lifespan_client.post("/explain/english", json={"code": "x = 1"})
+            assert response.json()["explanation"] == "explained"
+    assert calls == ["auth", "refresher", "stopped"]
+
+def test_explain_stream_sends_deltas_then_summary(monkeypatch):
+    """Test that /explain/{language}/stream forwards each delta as an SSE event and ends with a summary"""
+    import json
+    import backend.wca_i18n as wca_i18n
+
+    async def fake_stream(source_file, prompt, api_key=None, client=None):
+        yield "Hello"
+        yield " world"
+
+    monkeypatch.setattr(wca_i18n.wca, "aexplain_stream", fake_stream)
+    response = client.post("/explain/english/stream", json={"code": "x = 1"})
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/event-stream")
+    events = [
+        (block.split("\n")[0].removeprefix("event: "), json.loads(block.split("\n")[1].removeprefix("data: ")))
+        for block in response.text.strip().split("\n\n")
+    ]
+    assert events[:2] == [("delta", {"content": "Hello"}), ("delta", {"content": " world"})]
+    assert events[2][0] == "done"
+    assert events[2][1]["deltas"] == 2 and events[2][1]["characters"] == 11
+
+    assert client.post("/explain/korean/stream", json={"code": " "}).status_code == 400
+    assert client.post("/explain/english/stream", json={"code": "x = 1\n" * 20000}).status_code == 413
+
+def test_explain_stream_disconnect_closes_upstream(monkeypatch):
+    """Test that closing the event stream early closes the WCA stream, and that errors end it with an error event"""
+    import asyncio
+    import backend.wca_i18n as wca_i18n
+
+    closed = []
+
+    async def fake_stream(source_file, prompt, api_key=None, client=None):
+        try:
+            yield "Hello"
+            yield " world"
+            raise RuntimeError("upstream failed")
+        finally:
+            closed.append(True)
+
+    monkeypatch.setattr(wca_i18n.wca, "aexplain_stream", fake_stream)
+
+    async def first_event_then_disconnect():
+        events = wca_i18n.stream_explanation("x = 1", "prompt", "english", "key")
+        first = await events.__anext__()
+        await events.aclose()
+        return first
+
+    assert asyncio.run(first_event_then_disconnect()).startswith("event: delta")
+    assert closed == [True]
+
+    async def all_events():
+        return [event async for event in wca_i18n.stream_explanation("x = 1", "prompt", "english", "key")]
+
+    events = asyncio.run(all_events())
+    assert len(events) == 3 and events[-1].startswith("event: error")
+    assert "upstream failed" in events[-1]
+
+def test_explanation_cache_lru_and_shared_tier(tmp_path):
+    """Test that the memory tier evicts by bytes and refills from the shared SQLite tier"""
+    import backend.wca_i18n as wca_i18n
+
+    disk = wca_i18n.wca_client.ResponseCache(str(tmp_path / "explanations.sqlite3"))
+    cache = wca_i18n.ExplanationCache(max_bytes=10, disk=disk)
+    cache.put("a", "aaaa")
+    cache.put("b", "bbbb")
+    assert cache.get("a") == "aaaa"  # a is now the most recently used
+    cache.put("c", "cccc")
+    assert cache.stats()["evictions"] == 1 and cache.bytes == 8
+    assert cache.get("b") == "bbbb"  # evicted from memory, still on disk
+    assert cache.get("missing") is None
+    stats = cache.stats()
+    assert (stats["hits"], stats["disk_hits"], stats["misses"]) == (1, 1, 1)
+
+    other_worker = wca_i18n.ExplanationCache(disk=disk)
+    assert other_worker.get("c") == "cccc"
+    cache.clear()
+    assert cache.get("c") is None and cache.bytes == 0
+
+def test_explanation_cache_async_tier_runs_off_the_event_loop(tmp_path):
+    """Test that aget/aput/aclear reach the SQLite tier from the thread pool, not the event loop"""
+    import asyncio
+    import threading
+    import backend.wca_i18n as wca_i18n
+
+    disk = wca_i18n.wca_client.ResponseCache(str(tmp_path / "explanations.sqlite3"))
+    threads = []
+
+    def on_thread(method):
+        def call(*args):
+            threads.append(threading.get_ident())
+            return method(*args)
+        return call
+
+    for name in ("get", "put", "clear"):
+        setattr(disk, name, on_thread(getattr(disk, name)))
+    cache = wca_i18n.ExplanationCache(disk=disk)
+
+    async def run():
+        await cache.aput("a", "aaaa")
+        memory = await cache.aget("a")
+        other_worker = wca_i18n.ExplanationCache(disk=disk)
+        shared = await other_worker.aget("a")
+        await cache.aclear()
+        return memory, shared, await cache.aget("a"), threading.get_ident()
+
+    memory, shared, cleared, loop_thread = asyncio.run(run())
+    assert (memory, shared, cleared) == ("aaaa", "aaaa", None)
+    assert len(threads) == 4 and loop_thread not in threads  # put, other worker's get, clear, get
+
+def test_explanation_key_normalizes_code():
+    """Test that the cache key ignores line endings and trailing whitespace but not language"""
+    from backend.wca_i18n import explanation_key
+
+    key = explanation_key("def f():\n    return 1\n", "korean")
+    assert explanation_key("\r\ndef f():  \r\n    return 1\r\n\r\n", "korean") == key
+    assert explanation_key("def f():\n  return 1\n", "korean") != key
+    assert explanation_key("def f():\n    return 1\n", "thai") != key
+    assert explanation_key("x = 1", "klingon") == explanation_key("x = 1", "english")
+
+def test_explain_serves_repeats_from_cache_with_etag(monkeypatch):
+    """Test that repeat explanations skip WCA, carry ETag/Cache-Control and honour If-None-Match"""
+    import backend.wca_i18n as wca_i18n
+
+    calls = []
+
+    async def explain(source_file, prompt, api_key=None, client=None):
+        calls.append(source_file)
+        if source_file.startswith("fail"):
+            raise RuntimeError("upstream failed")
+        return " explained "
+
+    monkeypatch.setattr(wca_i18n.wca, "aexplain", explain)
+    first = client.post("/explain/english", json={"code": "x = 1\n"})
+    second = client.post("/explain/english", json={"code": "x = 1  \r\n"})
+    assert first.json() == second.json() == {"explanation": "explained", "analysis": []}
+    assert len(calls) == 1
+    assert first.headers["etag"] == second.headers["etag"]
+    assert "max-age=" in first.headers["cache-control"]
+
+    not_modified = client.post("/explain/english", json={"code": "x = 1"}, headers={"If-None-Match": first.headers["etag"]})
+    assert not_modified.status_code == 304 and not_modified.headers["etag"] == first.headers["etag"]
+
+    streamed = client.post("/explain/english/stream", json={"code": "x = 1"})
+    assert '"cached": true' in streamed.text and "explained" in streamed.text
+    assert len(calls) == 1
+
+    # Errors are reported but never cached
+    for _ in range(2):
+        failed = client.post("/explain/english", json={"code": "fail = 1"})
+        assert failed.status_code == 502 and "upstream failed" in failed.json()["detail"]
+        assert "etag" not in failed.headers
+    assert len(calls) == 3
+
+    stats = client.get("/admin/cache").json()
+    assert (stats["hits"], stats["misses"], stats["entries"]) == (3, 3, 1)
+
+def test_explain_maps_wca_failures_to_error_statuses(monkeypatch):
+    """Test that refused credentials give 401, WCA failures 502 and a missing API key 500"""
+    import httpx
+    import wca_client
+    import backend.wca_i18n as wca_i18n
+
+    async def explain(source_file, prompt, api_key=None, client=None):
+        if source_file.startswith("iam"):
+            raise wca_client.AuthenticationError("Status code: 400, Error: invalid apikey")
+        if source_file.startswith("revoked"):
+            request = httpx.Request("POST", "https://wca.example/chat")
+            raise httpx.HTTPStatusError("forbidden", request=request, response=httpx.Response(403, request=request))
+        raise ConnectionError("WCA unreachable")
+
+    monkeypatch.setattr(wca_i18n.wca, "aexplain", explain)
+    monkeypatch.setenv("API_KEY", "test-key")
+    assert client.post("/explain/english", json={"code": "iam = 1"}).status_code == 401
+    assert client.post("/explain/english", json={"code": "revoked = 1"}).status_code == 401
+    down = client.post("/explain/english", json={"code": "down = 1"})
+    assert down.status_code == 502 and "WCA unreachable" in down.json()["detail"]
+    assert client.post("/chat", json={"message": "explain", "code": "iam = 2"}).status_code == 401
+
+    monkeypatch.delenv("API_KEY")
+    assert client.post("/explain/english", json={"code": "down = 2"}).status_code == 500
+    monkeypatch.setattr(wca_i18n, "ADMIN_TOKEN", "secret")
+    assert client.delete("/admin/cache").status_code == 403
+    assert client.delete("/admin/cache", headers={"X-Admin-Token": "secret"}).json()["entries"] == 0
+
 @pytest.mark.asyncio
 async def test_explain_code_traditional_chinese():
     """Test code explanation in Traditional Chinese"""
@@ -526,4 +819,17 @@ class Stack:
                 found = True
                 break
         assert found, f"Expected one of {term_group} in explanation. Found terms: {matched_terms}"
-        
\ No newline at end of file
+        
+def test_language_prompt_context_fits_the_sent_message():
+    """Test that context is trimmed so the message actually sent to WCA stays within the prompt budget"""
+    import wca_client
+    import backend.wca_i18n as wca_i18n
+
+    code = "x = 1\n" * 1500
+    # Seven-character lines leave the estimate no rounding slack
+    context = ["abcdef"] * 20000
+    for language in ("english", "korean", "thai"):
+        prompt = wca_i18n.get_language_prompt(language, code, context)
+        assert "abcdef" in prompt
+        message = wca_i18n.wca.explain_text(code, prompt)
+        assert wca_client.estimate_tokens(message) <= wca_client.PROMPT_TOKEN_LIMIT
@@ -1,8 +1,19 @@
 import os
+import json
+import time
+import hmac
+import asyncio
+import hashlib
 import logging
-from fastapi import FastAPI, HTTPException
+import weakref
+import contextlib
+from collections import OrderedDict
+from fastapi import FastAPI, Header, HTTPException, Request, Response
+from fastapi.responses import StreamingResponse
+from starlette.concurrency import run_in_threadpool
 from pydantic import BaseModel
 from typing import List, Optional
+import wca_client
 import wca_backend as wca
 import tempfile
 
@@ -10,11 +21,32 @@ import tempfile
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# Initialize FastAPI without lifespan
+@contextlib.asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Authenticate once at startup, then keep the IAM token fresh in the background.
+
+    Request handlers use the cached token; a bad API key shows up as a
+    failure of the WCA call itself.
+    """
+    api_key = os.getenv("API_KEY")
+    refresher = None
+    if not api_key:
+        logger.error("API key not found in environment variables")
+    else:
+        if await wca.acheck_auth(api_key):
+            logger.info("Authenticated with IBM Cloud IAM")
+        refresher = asyncio.create_task(wca_client.akeep_token_fresh(api_key))
+    yield
+    if refresher is not None:
+        refresher.cancel()
+        with contextlib.suppress(asyncio.CancelledError):
+            await refresher
+
 app = FastAPI(
     title="Code Explanation API",
     description="API for explaining code in multiple languages",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
 class ChatRequest(BaseModel):
@@ -33,8 +65,210 @@ class CodeExplainResponse(BaseModel):
     explanation: str
     analysis: List[str] = []
 
+# Bump whenever the language prompts change, so cached explanations from the
+# old prompts are no longer served
+PROMPT_VERSION = "1"
+SUPPORTED_LANGUAGES = (
+    "traditional_chinese", "simplified_chinese", "english", "korean", "thai", "indonesian", "vietnamese"
+)
+
+# Explanation cache: an in-process LRU of up to WCA_EXPLAIN_CACHE_MB per worker,
+# in front of an optional SQLite tier shared by all workers (WCA_EXPLAIN_CACHE:
+# a file path, or 1 for the default location)
+EXPLAIN_CACHE_ENV = "WCA_EXPLAIN_CACHE"
+DEFAULT_EXPLAIN_CACHE_FILE = os.path.join(os.path.expanduser("~"), ".cache", "wca", "explanations.sqlite3")
+EXPLAIN_CACHE_MAX_BYTES = int(float(os.getenv("WCA_EXPLAIN_CACHE_MB", "64")) * 1024 * 1024)
+EXPLAIN_CACHE_TTL = float(os.getenv("WCA_EXPLAIN_CACHE_TTL", str(wca_client.RESPONSE_CACHE_TTL)))
+
+# When set, the /admin endpoints require it in the X-Admin-Token header
+ADMIN_TOKEN = os.getenv("WCA_ADMIN_TOKEN")
+
+# Explanations in flight per worker; further requests wait for a slot. The
+# API's WCA client has its own limiter of this size (see explain_client), so
+# this is the bound, not the CLIs' WCA_CONCURRENCY/WCA_MAX_IN_FLIGHT; it only
+# drops below it while WCA throttles. The default matches the client's
+# connection pool, beyond which requests would only queue for a connection
+EXPLAIN_CONCURRENCY = int(os.getenv("WCA_EXPLAIN_CONCURRENCY", str(wca_client.DEFAULT_POOL_SIZE)))
+
+# asyncio primitives belong to one event loop, like the WCA clients
+_explain_slots = weakref.WeakKeyDictionary()
+_explain_clients = weakref.WeakKeyDictionary()
+
+def explain_slots() -> asyncio.Semaphore:
+    """Return the semaphore bounding concurrent explanations on the running event loop."""
+    loop = asyncio.get_running_loop()
+    slots = _explain_slots.get(loop)
+    if slots is None:
+        slots = _explain_slots[loop] = asyncio.Semaphore(EXPLAIN_CONCURRENCY)
+    return slots
+
+def explain_client() -> wca_client.AsyncWCAClient:
+    """Return the WCA client explanations use on the running event loop.
+
+    Its adaptive limiter starts at and is capped by EXPLAIN_CONCURRENCY.
+    """
+    loop = asyncio.get_running_loop()
+    client = _explain_clients.get(loop)
+    if client is None:
+        limiter = wca_client.AdaptiveLimiter(initial=EXPLAIN_CONCURRENCY, max_limit=EXPLAIN_CONCURRENCY)
+        client = _explain_clients[loop] = wca_client.AsyncWCAClient(limiter=limiter)
+    return client
+
+class ExplanationCache:
+    """Two-tier cache of finished explanations.
+
+    The in-process LRU holds at most ``max_bytes`` of explanation text and
+    answers repeats without I/O. The optional ``disk`` tier, a
+    wca_client.ResponseCache, is shared by the workers; its hits are copied into
+    memory. The memory tier is used from the event loop only; the endpoints
+    call ``aget``/``aput``/``aclear``, which run the SQLite tier in the
+    thread pool so a slow disk or a locked database does not stall the loop.
+    """
+
+    def __init__(self, max_bytes=EXPLAIN_CACHE_MAX_BYTES, ttl=EXPLAIN_CACHE_TTL, disk=None):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.disk = disk
+        self.bytes = 0
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()  # key -> (text, size, created)
+
+    def get(self, key: str) -> Optional[str]:
+        """Return the cached explanation for ``key``, or None on a miss."""
+        text = self._get_memory(key)
+        if text is None:
+            text = self._from_disk(key, self.disk.get(key) if self.disk is not None else None)
+        return text
+
+    async def aget(self, key: str) -> Optional[str]:
+        """Like get, with the disk lookup run in the thread pool."""
+        text = self._get_memory(key)
+        if text is None:
+            disk = await run_in_threadpool(self.disk.get, key) if self.disk is not None else None
+            text = self._from_disk(key, disk)
+        return text
+
+    def put(self, key: str, text: str):
+        """Store an explanation in both tiers."""
+        self._store(key, text)
+        if self.disk is not None:
+            self.disk.put(key, text)
+
+    async def aput(self, key: str, text: str):
+        """Like put, with the disk write run in the thread pool."""
+        self._store(key, text)
+        if self.disk is not None:
+            await run_in_threadpool(self.disk.put, key, text)
+
+    def _get_memory(self, key):
+        entry = self._entries.get(key)
+        if entry is not None:
+            if time.time() - entry[2] <= self.ttl:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+            self._remove(key)
+        return None
+
+    def _from_disk(self, key, text):
+        if text is None:
+            self.misses += 1
+            return None
+        self.disk_hits += 1
+        self._store(key, text)
+        return text
+
+    def _store(self, key, text):
+        size = len(text.encode("utf-8"))
+        if key in self._entries:
+            self._remove(key)
+        if size > self.max_bytes:
+            return
+        self._entries[key] = (text, size, time.time())
+        self.bytes += size
+        while self.bytes > self.max_bytes:
+            _, (_, evicted, _) = self._entries.popitem(last=False)
+            self.bytes -= evicted
+            self.evictions += 1
+
+    def _remove(self, key):
+        self.bytes -= self._entries.pop(key)[1]
+
+    def clear(self):
+        """Drop every entry from both tiers."""
+        self._entries.clear()
+        self.bytes = 0
+        if self.disk is not None:
+            self.disk.clear()
+
+    async def aclear(self):
+        """Like clear, with the disk tier cleared in the thread pool."""
+        self._entries.clear()
+        self.bytes = 0
+        if self.disk is not None:
+            await run_in_threadpool(self.disk.clear)
+
+    def stats(self) -> dict:
+        """Return hit rate, size and eviction counters for this worker."""
+        lookups = self.hits + self.disk_hits + self.misses
+        return {
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_rate": (self.hits + self.disk_hits) / lookups if lookups else 0.0,
+            "entries": len(self._entries),
+            "bytes": self.bytes,
+            "max_bytes": self.max_bytes,
+            "evictions": self.evictions,
+            "disk": self.disk.stats() if self.disk is not None else None,
+        }
+
+def _explain_cache_path():
+    value = os.getenv(EXPLAIN_CACHE_ENV, "")
+    if not value or value.lower() in ("0", "false", "no"):
+        return None
+    if value.lower() in ("1", "true", "yes"):
+        return DEFAULT_EXPLAIN_CACHE_FILE
+    return os.path.expanduser(value)
+
+def _make_explanation_cache():
+    path = _explain_cache_path()
+    return ExplanationCache(disk=wca_client.ResponseCache(path, ttl=EXPLAIN_CACHE_TTL) if path else None)
+
+explanation_cache = _make_explanation_cache()
+
+def normalize_code(code: str) -> str:
+    """Normalize line endings, trailing whitespace and surrounding blank lines."""
+    lines = code.replace("\r\n", "\n").replace("\r", "\n").split("\n")
+    return "\n".join(line.rstrip() for line in lines).strip("\n")
+
+def explanation_key(code: str, language: str) -> str:
+    """Cache key for an explanation: prompt version, language and normalized code hash."""
+    if language not in SUPPORTED_LANGUAGES:
+        language = "english"  # the prompt unsupported languages fall back to
+    digest = hashlib.sha256(normalize_code(code).encode("utf-8")).hexdigest()
+    return f"explain:v{PROMPT_VERSION}:{language}:{digest}"
+
+def explanation_etag(explanation: str) -> str:
+    return '"' + hashlib.sha256(explanation.encode("utf-8")).hexdigest()[:32] + '"'
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """Whether an If-None-Match header matches ``etag`` (weak comparison)."""
+    if not if_none_match:
+        return False
+    tags = [tag.strip() for tag in if_none_match.split(",")]
+    tags = [tag[2:] if tag.startswith("W/") else tag for tag in tags]
+    return "*" in tags or etag in tags
+
 def get_language_prompt(language: str, code: str, context: list) -> str:
     """Get language-specific prompt."""
+    if context:
+        # Context gets what the message sent without it leaves of the prompt budget
+        budget = wca_client.prompt_budget(wca.explain_text(code, get_language_prompt(language, code, [])))
+        context = [wca_client.trim_to_budget(chr(10).join(context), max(budget, 0))]
     prompts = {
         "traditional_chinese": f"""請用繁體中文詳細解釋以下程式碼：
 要求：
@@ -172,71 +406,76 @@ Giải thích chi tiết bằng tiếng Việt:
     }
     return prompts.get(language, prompts["english"])
 
+def build_prompt(code: str, language: str) -> str:
+    """Build the explanation prompt; raises PromptTooLarge over the budget."""
+    prompt = get_language_prompt(language, code, [])
+    if not prompt:
+        logger.warning(f"Unsupported language: {language}, falling back to English")
+        prompt = get_language_prompt("english", code, [])
+    # Refuse code over the prompt budget before authenticating
+    wca.explain_payload(code, prompt)
+    return prompt
+
+def upstream_error(error: Exception) -> HTTPException:
+    """Map a failed WCA call to 401 (credentials refused) or 502 (WCA failed)."""
+    status = getattr(getattr(error, "response", None), "status_code", None)
+    if isinstance(error, wca_client.AuthenticationError) or status in (401, 403):
+        return HTTPException(status_code=401, detail="Authentication failed. Please check your API key.")
+    return HTTPException(status_code=502, detail=f"An error occurred while calling the WCA API: {str(error)}")
+
 async def explain_code(code: str, language: str) -> dict:
-    """Explain code in specified language."""
-    try:
-        prompt = get_language_prompt(language, code, [])
-        if not prompt:
-            logger.warning(f"Unsupported language: {language}, falling back to English")
-            prompt = get_language_prompt("english", code, [])
+    """Explain code in specified language.
+
+    Successful explanations are cached and carry an ``etag``. Failures raise
+    an HTTPException: 500 when the API key is not configured, 401 when it is
+    refused and 502 when the WCA call fails; PromptTooLarge propagates.
+    """
+    key = explanation_key(code, language)
+    cached = await explanation_cache.aget(key)
+    if cached is not None:
+        logger.info(f"Explanation in {language} served from cache")
+        return {"explanation": cached, "analysis": [], "etag": explanation_etag(cached)}
+
+    # Token counting is CPU work that grows with the code: keep it off the event loop
+    prompt = await run_in_threadpool(build_prompt, code, language)
+
+    api_key = os.getenv("API_KEY")
+    if not api_key:
+        logger.error("API key not found in environment variables")
+        raise HTTPException(status_code=500, detail="Error setting up API call. Please check your configuration.")
+
+    async with explain_slots():
+        logger.info(f"Calling WCA API with language: {language}")
+        # Whole prompts and responses only at debug level: writing them
+        # out on every request holds up the event loop
+        logger.debug(f"Prompt: {prompt}")
 
         try:
-            api_key = os.getenv("API_KEY")
-            if not api_key:
-                logger.error("API key not found in environment variables")
-                raise ValueError("API key not found in environment variables")
-            
-            # Check authentication first
-            if not wca.check_auth(api_key):
-                logger.error("Authentication failed")
-                return {
-                    "explanation": "Authentication failed. Please check your API key.",
-                    "analysis": []
-                }
-            
-            logger.info(f"Calling WCA API with language: {language}")
-            logger.info(f"Prompt: {prompt}")
-            
-            try:
-                # Call explain function with the prompt
-                response = wca.explain(
-                    source_file=code,  # Pass code directly
-                    prompt=prompt,
-                    api_key=api_key
-                )
-                
-                if not response:
-                    raise ValueError("Empty response from WCA API")
-
-                logger.info(f"Processed Response: {response.strip()}")
-                logger.info(f"Language: {language}")
-                logger.info(f"Prompt:\n{prompt}")
-                logger.info(f"Response:\n{response}")
-
-                return {
-                    "explanation": response.strip(),
-                    "analysis": []
-                }
-            except Exception as api_error:
-                logger.error(f"WCA API call error: {str(api_error)}")
-                return {
-                    "explanation": f"An error occurred while processing your request: {str(api_error)}",
-                    "analysis": []
-                }
-
-        except Exception as e:
-            logger.error(f"WCA API setup error: {str(e)}")
-            return {
-                "explanation": "Error setting up API call. Please check your configuration.",
-                "analysis": []
-            }
+            # Call explain function with the prompt
+            response = await wca.aexplain(
+                source_file=code,  # Pass code directly
+                prompt=prompt,
+                api_key=api_key,
+                client=explain_client()
+            )
+            if not response:
+                raise ValueError("Empty response from WCA API")
+        except wca_client.PromptTooLarge:
+            raise
+        except Exception as api_error:
+            logger.error(f"WCA API call error: {str(api_error)}")
+            raise upstream_error(api_error)
 
-    except Exception as e:
-        logger.error(f"General error explaining code: {str(e)}")
-        return {
-            "explanation": "An unexpected error occurred. Please try again later.",
-            "analysis": []
-        }
+    logger.info(f"Explained code in {language} ({len(response)} characters)")
+    logger.debug(f"Response:\n{response}")
+
+    explanation = response.strip()
+    await explanation_cache.aput(key, explanation)
+    return {
+        "explanation": explanation,
+        "analysis": [],
+        "etag": explanation_etag(explanation)
+    }
 
 async def process_chat(chat_data: dict) -> dict:
     """Process chat messages and return response."""
@@ -283,38 +522,165 @@ async def chat(request: ChatRequest):
     
     try:
         return await process_chat(request.model_dump())
+    except wca_client.PromptTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(
             status_code=500,
             detail=f"Error processing chat: {str(e)}"
         )
 
+EMPTY_CODE_MESSAGES = {
+    "traditional_chinese": "程式碼不能為空",
+    "simplified_chinese": "代码不能为空",
+    "korean": "코드가 비어있습니다",
+    "thai": "โค้ดต้องไม่ว่างเปล่า",
+    "indonesian": "Kode tidak boleh kosong",
+    "vietnamese": "Mã không được để trống",
+    "english": "Code cannot be empty"
+}
+
 @app.post("/explain/{language}", response_model=CodeExplainResponse)
-async def explain_code_endpoint(language: str, request: CodeExplainRequest):
+async def explain_code_endpoint(language: str, request: CodeExplainRequest, http_request: Request, response: Response):
     """Analyze and explain code in specified language."""
     if not request.code.strip():
-        error_messages = {
-            "traditional_chinese": "程式碼不能為空",
-            "simplified_chinese": "代码不能为空",
-            "korean": "코드가 비어있습니다",
-            "thai": "โค้ดต้องไม่ว่างเปล่า",
-            "indonesian": "Kode tidak boleh kosong",
-            "vietnamese": "Mã không được để trống",
-            "english": "Code cannot be empty"
-        }
         raise HTTPException(
             status_code=400, 
-            detail=error_messages.get(language, "Code cannot be empty")
+            detail=EMPTY_CODE_MESSAGES.get(language, "Code cannot be empty")
         )
     
     try:
-        return await explain_code(request.code, language)
+        result = await explain_code(request.code, language)
+        etag = result.pop("etag", None)
+        if etag is not None:
+            headers = {"ETag": etag, "Cache-Control": f"private, max-age={int(EXPLAIN_CACHE_TTL)}"}
+            if etag_matches(http_request.headers.get("if-none-match"), etag):
+                return Response(status_code=304, headers=headers)
+            response.headers.update(headers)
+        return result
+    except wca_client.PromptTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(
             status_code=500,
             detail=f"Error processing code: {str(e)}"
         )
 
+def sse_event(event: str, data: dict) -> str:
+    """Format one Server-Sent Event with a JSON payload."""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+async def stream_explanation(code: str, prompt: str, language: str, api_key: str, key: Optional[str] = None):
+    """Yield an explanation as Server-Sent Events.
+
+    Each content delta from WCA is sent as a ``delta`` event as soon as it
+    arrives, followed by a ``done`` event with a summary, or an ``error``
+    event. If the client disconnects, the generator is cancelled or closed,
+    which closes the upstream WCA stream. A complete explanation is cached
+    under ``key``.
+    """
+    start = time.perf_counter()
+    ttft = None
+    deltas = characters = 0
+    parts = []
+    try:
+        async with explain_slots():
+            stream = wca.aexplain_stream(code, prompt, api_key=api_key, client=explain_client())
+            try:
+                async for content in stream:
+                    if ttft is None:
+                        ttft = time.perf_counter() - start
+                    deltas += 1
+                    characters += len(content)
+                    parts.append(content)
+                    yield sse_event("delta", {"content": content})
+            finally:
+                # Close the upstream stream now, not when the generator is collected
+                await stream.aclose()
+    except (asyncio.CancelledError, GeneratorExit):
+        logger.info(f"Client disconnected after {deltas} deltas; cancelled the WCA request")
+        raise
+    except Exception as e:
+        logger.error(f"WCA API streaming error: {str(e)}")
+        yield sse_event("error", {"detail": f"An error occurred while processing your request: {str(e)}"})
+        return
+    elapsed = time.perf_counter() - start
+    logger.info(f"Streamed explanation in {language} ({characters} characters)")
+    explanation = "".join(parts).strip()
+    if key is not None and explanation:
+        await explanation_cache.aput(key, explanation)
+    yield sse_event("done", {
+        "language": language,
+        "deltas": deltas,
+        "characters": characters,
+        "ttft_ms": None if ttft is None else round(ttft * 1000, 1),
+        "elapsed_ms": round(elapsed * 1000, 1),
+        "cached": False,
+    })
+
+async def replay_explanation(explanation: str, language: str):
+    """Yield a cached explanation as one ``delta`` event and its ``done`` event."""
+    yield sse_event("delta", {"content": explanation})
+    yield sse_event("done", {
+        "language": language,
+        "deltas": 1,
+        "characters": len(explanation),
+        "ttft_ms": 0.0,
+        "elapsed_ms": 0.0,
+        "cached": True,
+    })
+
+@app.post("/explain/{language}/stream")
+async def explain_code_stream_endpoint(language: str, request: CodeExplainRequest):
+    """Explain code in specified language, streamed as Server-Sent Events."""
+    if not request.code.strip():
+        raise HTTPException(
+            status_code=400,
+            detail=EMPTY_CODE_MESSAGES.get(language, "Code cannot be empty")
+        )
+    # Keep proxies from buffering the stream
+    headers = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    key = explanation_key(request.code, language)
+    cached = await explanation_cache.aget(key)
+    if cached is not None:
+        logger.info(f"Explanation in {language} served from cache")
+        return StreamingResponse(replay_explanation(cached, language), media_type="text/event-stream", headers=headers)
+    api_key = os.getenv("API_KEY")
+    if not api_key:
+        logger.error("API key not found in environment variables")
+        raise HTTPException(status_code=500, detail="Error setting up API call. Please check your configuration.")
+    # Errors found before the stream starts still get a proper status code
+    try:
+        prompt = await run_in_threadpool(build_prompt, request.code, language)
+    except wca_client.PromptTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    return StreamingResponse(
+        stream_explanation(request.code, prompt, language, api_key, key),
+        media_type="text/event-stream",
+        headers=headers,
+    )
+
+def check_admin_token(token: Optional[str]):
+    if ADMIN_TOKEN and not hmac.compare_digest(token or "", ADMIN_TOKEN):
+        raise HTTPException(status_code=403, detail="Invalid admin token")
+
+@app.get("/admin/cache")
+async def explanation_cache_stats(x_admin_token: Optional[str] = Header(None)):
+    """Explanation cache hit rate, size and evictions for this worker."""
+    check_admin_token(x_admin_token)
+    return explanation_cache.stats()
+
+@app.delete("/admin/cache")
+async def clear_explanation_cache(x_admin_token: Optional[str] = Header(None)):
+    """Drop all cached explanations: this worker's memory tier and the shared tier."""
+    check_admin_token(x_admin_token)
+    await explanation_cache.aclear()
+    return explanation_cache.stats()
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
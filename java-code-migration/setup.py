@@ -7,6 +7,7 @@ setup(
     install_requires=[
         "typer",
         "rich",
-        "python-dotenv"
+        "python-dotenv",
+        "wca-client[cli]",
     ],
 ) 
\ No newline at end of file
@@ -1,7 +1,7 @@
 from rich.console import Console
-from rich.markdown import Markdown
 import typer
-from wca_backend import call_wca_api, stream_response
+from wca_client import call_wca_api, stream_response, call_many, configure_response_cache, configure_output, configure_budget, is_dry_run, check_prompt, chunk_to_budget, prompt_budget, print_cache_stats, print_limiter_stats, print_pool_stats, print_token_usage
+from wca_client.cli import daemon
 from pathlib import Path
 from typing import Optional
 from dotenv import load_dotenv
@@ -12,10 +12,26 @@ load_dotenv()
 console = Console()
 app = typer.Typer(help="Java code review and upgrade tool")
 
+@app.callback()
+def main(
+    ctx: typer.Context,
+    no_cache: bool = typer.Option(False, "--no-cache", help="Do not read or write the WCA response cache"),
+    refresh: bool = typer.Option(False, "--refresh", help="Ignore cached WCA responses but store fresh ones"),
+    quiet: bool = typer.Option(False, "--quiet", "-q", help="Do not show the spinner or streamed WCA output (for batch jobs)"),
+    dry_run: bool = typer.Option(False, "--dry-run", help="Build the prompts and report estimated tokens and cost without calling WCA")
+):
+    configure_response_cache(enabled=False if no_cache else None, refresh=refresh)
+    configure_output(quiet=quiet or None)
+    configure_budget(dry_run=dry_run or None)
+    ctx.call_on_close(print_cache_stats)
+    ctx.call_on_close(print_limiter_stats)
+    ctx.call_on_close(print_pool_stats)
+    ctx.call_on_close(print_token_usage)
+
 def check_api_key():
     """Check if IBM Cloud API key is set"""
     api_key = os.getenv("IAM_APIKEY")
-    if not api_key:
+    if not api_key and not is_dry_run():
         console.print("[red]Error: IAM_APIKEY not found in environment variables[/red]")
         console.print("Please set your IBM Cloud API key in .env file:")
         console.print("IAM_APIKEY=your_api_key_here")
@@ -49,39 +65,42 @@ def review_java(java: str) -> str:
         console.print(f"[yellow]Warning: Error parsing Java code into sections: {str(e)}[/yellow]")
         sections = [("Main", java)]
     
+    # Sections too large for one prompt are reviewed in parts, budgeted with
+    # room for the "(part i/n)" suffix their names get
+    parts = []
+    for section_name, section_content in sections:
+        budget = prompt_budget(section_review_prompt(f"{section_name} (part 999/999)", ""))
+        chunks = chunk_to_budget(section_content, budget)
+        if len(chunks) == 1:
+            parts.append((section_name, section_content))
+        else:
+            parts.extend((f"{section_name} (part {i}/{len(chunks)})", chunk) for i, chunk in enumerate(chunks, 1))
+    sections = parts
+
     all_reviews = []
+    payloads = []
+    for section_name, section_content in sections:
+        prompt = section_review_prompt(section_name, section_content)
+        
+        payloads.append({
+            "message_payload": {
+                "messages": [{"content": prompt, "role": "USER"}]
+            }
+        })
     
+    # Review all sections concurrently; results come back in section order
     with console.status("[bold blue]Reviewing Java code...", spinner="dots") as status:
-        for section_name, section_content in sections:
-            status.update(f"[bold blue]Processing {section_name}...")
-            
-            prompt = f"""Review this Java code section for modernization and migration:
-- Identify upgrade opportunities
-- Check for deprecated APIs and patterns
-- Suggest modern alternatives
-- Review for design patterns and best practices
-<<SYS>>
-section: {section_name}
-code: `{section_content}`
-<</SYS>>
-Generate review in table format with columns: Component, Current Implementation, Recommended Changes, Priority (High/Medium/Low)."""
-            
-            payload = {
-                "message_payload": {
-                    "messages": [{"content": prompt, "role": "USER"}]
-                }
-            }
-            
-            try:
-                response = call_wca_api(payload)
-                section_review = stream_response(response, action=f"Processing {section_name}")
-                
-                if section_review:
-                    all_reviews.append(f"## {section_name}\n\n{section_review}\n")
-                
-            except Exception as e:
-                console.print(f"[red]Error processing {section_name}: {str(e)}[/red]")
-                all_reviews.append(f"## {section_name}\n\n*Error processing this section: {str(e)}*\n")
+        results = call_many(
+            payloads,
+            on_progress=lambda done, total, result: status.update(f"[bold blue]Reviewed {done}/{total} sections...")
+        )
+    
+    for (section_name, _), result in zip(sections, results):
+        if not result.ok:
+            console.print(f"[red]Error processing {section_name}: {str(result.error)}[/red]")
+            all_reviews.append(f"## {section_name}\n\n*Error processing this section: {str(result.error)}*\n")
+        elif result.text:
+            all_reviews.append(f"## {section_name}\n\n{result.text}\n")
     
     final_review = "# Java Code Review\n\n" + "\n".join(all_reviews)
     
@@ -112,6 +131,18 @@ Generate summary in table format with columns: Category, Recommendations, Priori
     
     return final_review
 
+def section_review_prompt(section_name: str, section_content: str) -> str:
+    return f"""Review this Java code section for modernization and migration:
+- Identify upgrade opportunities
+- Check for deprecated APIs and patterns
+- Suggest modern alternatives
+- Review for design patterns and best practices
+<<SYS>>
+section: {section_name}
+code: `{section_content}`
+<</SYS>>
+Generate review in table format with columns: Component, Current Implementation, Recommended Changes, Priority (High/Medium/Low)."""
+
 def upgrade_java(java: str) -> str:
     """Upgrade Java code to modern Java"""
     prompt = f"""Upgrade this Java code to modern Java:
@@ -124,6 +155,7 @@ java: `{java}`
 <</SYS>>
 Generate Java code implementation with comments explaining key business logic.
 """
+    check_prompt(prompt, what="upgrade prompt")
 
     payload = {
         "message_payload": {
@@ -150,7 +182,8 @@ def review(
     """Review Java code and provide Java conversion suggestions"""
     try:
         api_key = check_api_key()
-        console.print(f"[green]API key found: {api_key[:4]}...{api_key[-4:]}[/green]")
+        if api_key:
+            console.print(f"[green]API key found: {api_key[:4]}...{api_key[-4:]}[/green]")
         
         console.print(f"[yellow]Reading Java file: {java_file}[/yellow]")
         java = read_java_file(java_file)
@@ -167,6 +200,7 @@ def review(
             output.write_text(result)
             console.print(f"[green]Review saved to {output}[/green]")
         else:
+            from rich.markdown import Markdown
             console.print("\n[bold]Review Result:[/bold]")
             console.print(Markdown(result))
             
@@ -464,7 +498,7 @@ def handle_command(command_name, parameters, context):
     return None
 
 def create_jaxws_migration_prompt(source_code):
-    return f"""Convert this JAX-RPC web service to JAX-WS following these specific steps:
+    return check_prompt(f"""Convert this JAX-RPC web service to JAX-WS following these specific steps:
 1. Update imports:
     - Remove javax.xml.rpc.* imports
     - Add javax.jws.WebService
@@ -487,10 +521,10 @@ Original code:
 `{source_code}`
 <</SYS>>
 Generate complete JAX-WS implementation maintaining the same business logic.
-"""
+""", what="JAX-WS migration prompt")
 
 def create_j2ssh_migration_prompt(source_code):
-    return f"""Convert this JSch SFTP implementation to J2SSH Maverick following these steps:
+    return check_prompt(f"""Convert this JSch SFTP implementation to J2SSH Maverick following these steps:
 1. Update imports:
     - Remove com.jcraft.jsch.*
     - Add com.sshtools.j2ssh.*
@@ -515,10 +549,10 @@ Original code:
 `{source_code}`
 <</SYS>>
 Generate complete J2SSH implementation with equivalent functionality.
-"""
+""", what="J2SSH migration prompt")
 
 def create_liberty_migration_prompt(source_code):
-    return f"""you are a senior java developer. Migrate this WebSphere scheduler to Liberty following these steps:
+    return check_prompt(f"""you are a senior java developer. Migrate this WebSphere scheduler to Liberty following these steps:
 - DONT be lazy, please generate all the code, dont skip implementation.
 
 1. java Imports:
@@ -546,10 +580,10 @@ Original code:
 `{source_code}`
 <</SYS>>
 Generate complete Liberty scheduler implementation maintaining the same functionality.
-"""
+""", what="Liberty migration prompt")
 
 def create_pojo_migration_prompt(source_code):
-    return f"""You are a senior Java developer. Convert this EJB code to POJO following these specific steps:
+    return check_prompt(f"""You are a senior Java developer. Convert this EJB code to POJO following these specific steps:
 1. Remove EJB-specific code:
     - Remove EJB interfaces (Home, Remote, Local)
     - Remove EJB lifecycle methods (ejbCreate, ejbActivate, etc.)
@@ -599,10 +633,10 @@ Generate complete POJO implementation following these requirements:
 6. Maintain proper package structure
 
 Respond only with the complete Java code implementation.
-"""
+""", what="POJO migration prompt")
 
 def create_maven_migration_prompt(source_code):
-    return f"""You are a senior Java developer. Convert this Gradle build file to Maven pom.xml following these steps:
+    return check_prompt(f"""You are a senior Java developer. Convert this Gradle build file to Maven pom.xml following these steps:
 1. Project Information:
 - Extract group, artifact, and version info
 - Set appropriate packaging type
@@ -646,7 +680,7 @@ Generate complete Maven pom.xml following these requirements:
 5. Add appropriate comments
 
 Respond only with the complete pom.xml content.
-"""
+""", what="Maven migration prompt")
 
 def handle_java_api_migration(parameters, context):
     source_api = parameters["source_api"]
@@ -743,5 +777,7 @@ def handle_java_api_migration(parameters, context):
     
     return result
 
+app.command()(daemon)
+
 if __name__ == "__main__":
     app()
\ No newline at end of file
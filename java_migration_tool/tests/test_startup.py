@@ -0,0 +1,27 @@
+import re
+import subprocess
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).parent.parent
+HTTP_MODULES = ("requests", "urllib3", "httpx", "github")
+
+def import_times(*args):
+    """Run python -X importtime with args; return {module: cumulative microseconds}."""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", *args],
+        cwd=ROOT, capture_output=True, text=True, timeout=60,
+    )
+    assert result.returncode == 0, result.stderr[-2000:]
+    times = {}
+    for line in result.stderr.splitlines():
+        match = re.match(r"import time:\s+\d+ \|\s+(\d+) \| ( *)(\S+)", line)
+        if match:
+            times[match.group(3)] = int(match.group(1))
+    return times
+
+def test_help_does_not_import_http_stack():
+    """Test that --help on the CLI never loads requests, urllib3 or httpx"""
+    times = import_times("wca_springboot.py", "--help")
+    assert "wca_client" in times
+    assert not [module for module in HTTP_MODULES if module in times]
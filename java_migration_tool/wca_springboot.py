@@ -1,7 +1,7 @@
 from rich.console import Console
-from rich.markdown import Markdown
 import typer
-from wca_backend import call_wca_api, stream_response
+from wca_client import call_wca_api, stream_response, call_many, call_units, content_hash, JobJournal, StopAtCodeBlock, configure_response_cache, configure_output, configure_budget, is_dry_run, check_prompt, chunk_to_budget, prompt_budget, print_cache_stats, print_limiter_stats, print_pool_stats, print_token_usage
+from wca_client.cli import daemon
 from pathlib import Path
 from typing import Optional
 from dotenv import load_dotenv
@@ -13,10 +13,26 @@ load_dotenv()
 console = Console()
 app = typer.Typer(help="Java code review and upgrade tool")
 
+@app.callback()
+def main(
+    ctx: typer.Context,
+    no_cache: bool = typer.Option(False, "--no-cache", help="Do not read or write the WCA response cache"),
+    refresh: bool = typer.Option(False, "--refresh", help="Ignore cached WCA responses but store fresh ones"),
+    quiet: bool = typer.Option(False, "--quiet", "-q", help="Do not show the spinner or streamed WCA output (for batch jobs)"),
+    dry_run: bool = typer.Option(False, "--dry-run", help="Build the prompts and report estimated tokens and cost without calling WCA")
+):
+    configure_response_cache(enabled=False if no_cache else None, refresh=refresh)
+    configure_output(quiet=quiet or None)
+    configure_budget(dry_run=dry_run or None)
+    ctx.call_on_close(print_cache_stats)
+    ctx.call_on_close(print_limiter_stats)
+    ctx.call_on_close(print_pool_stats)
+    ctx.call_on_close(print_token_usage)
+
 def check_api_key():
     """Check if IBM Cloud API key is set"""
     api_key = os.getenv("IAM_APIKEY")
-    if not api_key:
+    if not api_key and not is_dry_run():
         console.print("[red]Error: IAM_APIKEY not found in environment variables[/red]")
         console.print("Please set your IBM Cloud API key in .env file:")
         console.print("IAM_APIKEY=your_api_key_here")
@@ -50,39 +66,42 @@ def review_java(java: str) -> str:
         console.print(f"[yellow]Warning: Error parsing Java code into sections: {str(e)}[/yellow]")
         sections = [("Main", java)]
     
+    # Sections too large for one prompt are reviewed in parts, budgeted with
+    # room for the "(part i/n)" suffix their names get
+    parts = []
+    for section_name, section_content in sections:
+        budget = prompt_budget(section_review_prompt(f"{section_name} (part 999/999)", ""))
+        chunks = chunk_to_budget(section_content, budget)
+        if len(chunks) == 1:
+            parts.append((section_name, section_content))
+        else:
+            parts.extend((f"{section_name} (part {i}/{len(chunks)})", chunk) for i, chunk in enumerate(chunks, 1))
+    sections = parts
+
     all_reviews = []
+    payloads = []
+    for section_name, section_content in sections:
+        prompt = section_review_prompt(section_name, section_content)
+        
+        payloads.append({
+            "message_payload": {
+                "messages": [{"content": prompt, "role": "USER"}]
+            }
+        })
     
+    # Review all sections concurrently; results come back in section order
     with console.status("[bold blue]Reviewing Java code...", spinner="dots") as status:
-        for section_name, section_content in sections:
-            status.update(f"[bold blue]Processing {section_name}...")
-            
-            prompt = f"""Review this Java code section for modernization and migration:
-- Identify upgrade opportunities
-- Check for deprecated APIs and patterns
-- Suggest modern alternatives
-- Review for design patterns and best practices
-<<SYS>>
-section: {section_name}
-code: `{section_content}`
-<</SYS>>
-Generate review in table format with columns: Component, Current Implementation, Recommended Changes, Priority (High/Medium/Low)."""
-            
-            payload = {
-                "message_payload": {
-                    "messages": [{"content": prompt, "role": "USER"}]
-                }
-            }
-            
-            try:
-                response = call_wca_api(payload)
-                section_review = stream_response(response, action=f"Processing {section_name}")
-                
-                if section_review:
-                    all_reviews.append(f"## {section_name}\n\n{section_review}\n")
-                
-            except Exception as e:
-                console.print(f"[red]Error processing {section_name}: {str(e)}[/red]")
-                all_reviews.append(f"## {section_name}\n\n*Error processing this section: {str(e)}*\n")
+        results = call_many(
+            payloads,
+            on_progress=lambda done, total, result: status.update(f"[bold blue]Reviewed {done}/{total} sections...")
+        )
+    
+    for (section_name, _), result in zip(sections, results):
+        if not result.ok:
+            console.print(f"[red]Error processing {section_name}: {str(result.error)}[/red]")
+            all_reviews.append(f"## {section_name}\n\n*Error processing this section: {str(result.error)}*\n")
+        elif result.text:
+            all_reviews.append(f"## {section_name}\n\n{result.text}\n")
     
     final_review = "# Java Code Review\n\n" + "\n".join(all_reviews)
     
@@ -113,6 +132,18 @@ Generate summary in table format with columns: Category, Recommendations, Priori
     
     return final_review
 
+def section_review_prompt(section_name: str, section_content: str) -> str:
+    return f"""Review this Java code section for modernization and migration:
+- Identify upgrade opportunities
+- Check for deprecated APIs and patterns
+- Suggest modern alternatives
+- Review for design patterns and best practices
+<<SYS>>
+section: {section_name}
+code: `{section_content}`
+<</SYS>>
+Generate review in table format with columns: Component, Current Implementation, Recommended Changes, Priority (High/Medium/Low)."""
+
 def upgrade_java(java: str) -> str:
     """Upgrade Java code to modern Java"""
     prompt = f"""Upgrade this Java code to modern Java:
@@ -125,6 +156,7 @@ java: `{java}`
 <</SYS>>
 Generate Java code implementation with comments explaining key business logic.
 """
+    check_prompt(prompt, what="upgrade prompt")
 
     payload = {
         "message_payload": {
@@ -151,7 +183,8 @@ def review(
     """Review Java code and provide Java conversion suggestions"""
     try:
         api_key = check_api_key()
-        console.print(f"[green]API key found: {api_key[:4]}...{api_key[-4:]}[/green]")
+        if api_key:
+            console.print(f"[green]API key found: {api_key[:4]}...{api_key[-4:]}[/green]")
         
         console.print(f"[yellow]Reading Java file: {java_file}[/yellow]")
         java = read_java_file(java_file)
@@ -168,6 +201,7 @@ def review(
             output.write_text(result)
             console.print(f"[green]Review saved to {output}[/green]")
         else:
+            from rich.markdown import Markdown
             console.print("\n[bold]Review Result:[/bold]")
             console.print(Markdown(result))
             
@@ -357,7 +391,7 @@ def handle_command(command_name, parameters, context):
     return None
 
 def create_pojo_migration_prompt(source_code):
-    return f"""You are a senior Java developer. Convert this EJB code to POJO following these specific steps:
+    return check_prompt(f"""You are a senior Java developer. Convert this EJB code to POJO following these specific steps:
 1. Remove EJB-specific code:
     - Remove EJB interfaces (Home, Remote, Local)
     - Remove EJB lifecycle methods (ejbCreate, ejbActivate, etc.)
@@ -407,10 +441,10 @@ Generate complete POJO implementation following these requirements:
 6. Maintain proper package structure
 
 Respond only with the complete Java code implementation.
-"""
+""", what="POJO migration prompt")
 
 def create_maven_migration_prompt(source_code):
-    return f"""You are a senior Java developer. Convert this Gradle build file to Maven pom.xml following these steps:
+    return check_prompt(f"""You are a senior Java developer. Convert this Gradle build file to Maven pom.xml following these steps:
 1. Project Information:
 - Extract group, artifact, and version info
 - Set appropriate packaging type
@@ -454,7 +488,7 @@ Generate complete Maven pom.xml following these requirements:
 5. Add appropriate comments
 
 Respond only with the complete pom.xml content.
-"""
+""", what="Maven migration prompt")
 
 @app.command()
 def migrate_structs(
@@ -464,9 +498,11 @@ def migrate_structs(
         "--output", 
         "-o", 
         help="Output directory for Spring Boot application"
-    )
+    ),
+    resume: bool = typer.Option(False, "--resume", help="Skip files an interrupted run already converted (see the journal in the output directory)")
 ):
     """Migrate Struts application to SpringBoot"""
+    journal = None
     try:
         console.print("[blue]Starting Struts to SpringBoot migration...[/blue]")
         
@@ -491,6 +527,7 @@ def migrate_structs(
             (output_path / "src/main/resources").mkdir(parents=True, exist_ok=True)
             
             console.print(f"[yellow]Output directory: {output_path}[/yellow]")
+            journal = JobJournal(output_path, resume=resume)
         except Exception as e:
             console.print(f"[red]Error creating directory structure: {str(e)}[/red]")
             raise typer.Exit(code=1)
@@ -505,7 +542,7 @@ def migrate_structs(
         
         try:
             # 3. Convert Struts Actions to Controllers
-            convert_actions_to_controllers(source_path, output_path)
+            convert_actions_to_controllers(source_path, output_path, journal)
             console.print("[green]Converted Actions to Controllers[/green]")
         except Exception as e:
             console.print(f"[red]Error converting Actions to Controllers: {str(e)}[/red]")
@@ -513,7 +550,7 @@ def migrate_structs(
         
         try:
             # 4. Migrate form beans and DTOs
-            migrate_form_beans(source_path, output_path)
+            migrate_form_beans(source_path, output_path, journal)
             console.print("[green]Migrated Form beans and DTOs[/green]")
         except Exception as e:
             console.print(f"[red]Error migrating Form beans: {str(e)}[/red]")
@@ -521,7 +558,7 @@ def migrate_structs(
         
         try:
             # 5. Migrate service layer
-            migrate_service_layer(source_path, output_path)
+            migrate_service_layer(source_path, output_path, journal)
             console.print("[green]Migrated Service layer[/green]")
         except Exception as e:
             console.print(f"[red]Error migrating Service layer: {str(e)}[/red]")
@@ -529,7 +566,7 @@ def migrate_structs(
         
         try:
             # 6. Migrate model classes
-            migrate_model_classes(source_path, output_path)
+            migrate_model_classes(source_path, output_path, journal)
             console.print("[green]Migrated Model classes[/green]")
         except Exception as e:
             console.print(f"[red]Error migrating Model classes: {str(e)}[/red]")
@@ -545,13 +582,15 @@ def migrate_structs(
         
         try:
             # 8. Migrate JSP pages to Thymeleaf
-            migrate_jsp_to_thymeleaf(source_path, output_path)
+            migrate_jsp_to_thymeleaf(source_path, output_path, journal)
             console.print("[green]Migrated JSP pages to Thymeleaf[/green]")
         except Exception as e:
             console.print(f"[red]Error migrating JSP to Thymeleaf: {str(e)}\nTraceback: {e.__traceback__}[/red]")
             raise typer.Exit(code=1)
         
         console.print("[green]Struts to SpringBoot migration completed successfully![/green]")
+        if journal.skipped:
+            console.print(f"[blue]Resumed: {journal.skipped} file(s) converted by an earlier run were skipped[/blue]")
         console.print(f"[blue]Migration output saved to: {output_path}[/blue]")
         
         return output_path  # Return the output path for testing
@@ -564,6 +603,9 @@ def migrate_structs(
         console.print(f"[red]Error message: {str(e)}[/red]")
         console.print(f"[red]Traceback: {e.__traceback__}[/red]")
         raise typer.Exit(code=1)
+    finally:
+        if journal:
+            journal.close()
 
 def create_spring_structure(output_dir: Path):
     """Create basic SpringBoot project structure"""
@@ -591,14 +633,45 @@ def extract_java_code(response: str) -> str:
     
     return code
 
-def convert_actions_to_controllers(source_dir: Path, output_dir: Path):
+def run_units(files: list, prompt_for, save, action: str, root: Path, journal=None, pack=False, stop=None) -> list:
+    """Convert files concurrently, one prompt each, saving each result as it arrives
+
+    ``save(file, text)`` writes the converted file and returns its path. With
+    ``pack``, ``prompt_for`` must take ``packed`` (see call_packed). Files
+    the journal lists as converted by an earlier run are skipped. ``stop``
+    ends each reply early; only pass one for prompts that ask for exactly one
+    code block. Returns the names of the files that failed.
+    """
+    units = [(file.relative_to(root).as_posix(), file.read_text()) for file in files]
+    with console.status(f"[bold blue]{action}...", spinner="dots") as status:
+        results = call_units(
+            units,
+            prompt_for,
+            lambda index, text: save(files[index], text),
+            journal=journal,
+            pack=pack,
+            stop=stop,
+            scope=action,
+            on_progress=lambda done, total, result: status.update(f"[bold blue]{action} ({done}/{total})...")
+        )
+    failures = []
+    for file, result in zip(files, results):
+        if result is not None and not result.ok:
+            console.print(f"[red]Error converting {file.name}: {str(result.error)}[/red]")
+            failures.append(file.name)
+    return failures
+
+def raise_for_failures(failures: list, action: str):
+    """Raise once a batch has finished if any of its files failed"""
+    if failures:
+        raise RuntimeError(f"{action} failed for {len(failures)} file(s): {', '.join(failures)}")
+
+def convert_actions_to_controllers(source_dir: Path, output_dir: Path, journal=None):
     """Convert Struts Actions to Spring Controllers"""
-    action_files = source_dir.glob("**/action/*.java")
+    action_files = list(source_dir.glob("**/action/*.java"))
     
-    for action_file in action_files:
-        content = action_file.read_text()
-        
-        prompt = f"""Convert this Struts Action to a Spring Boot REST Controller.
+    def controller_prompt(content):
+        return f"""Convert this Struts Action to a Spring Boot REST Controller.
 
 Requirements:
 1. Package and imports:
@@ -634,11 +707,8 @@ Original Struts Action:
 
 Generate a complete Spring Boot Controller that follows REST principles and includes proper error handling."""
 
-        # Call WCA API
-        payload = {"message_payload": {"messages": [{"content": prompt, "role": "USER"}]}}
-        response = call_wca_api(payload)
-        response_content = stream_response(response, action="Converting Action to Controller")
-        controller_content = extract_java_code(response_content)
+    def save_controller(action_file, text):
+        controller_content = extract_java_code(text)
         
         # Force package declaration if not present
         if not controller_content.strip().startswith("package"):
@@ -649,17 +719,23 @@ Generate a complete Spring Boot Controller that follows REST principles and incl
         controller_path = output_dir / f"src/main/java/com/example/application/controller/{controller_name}.java"
         controller_path.parent.mkdir(parents=True, exist_ok=True)
         controller_path.write_text(controller_content)
+        return controller_path
+    
+    # Call WCA API for all actions concurrently
+    failures = run_units(action_files, controller_prompt, save_controller, "Converting Actions to Controllers", source_dir, journal)
+    raise_for_failures(failures, "Converting Actions to Controllers")
 
-def migrate_form_beans(source_dir: Path, output_dir: Path):
+def migrate_form_beans(source_dir: Path, output_dir: Path, journal=None):
     """Migrate Struts form beans and DTOs to Spring DTOs"""
     # Migrate form beans
     form_files = source_dir.glob("**/form/*.java")
     dto_files = source_dir.glob("**/dto/*.java")
+    files = list(form_files) + list(dto_files)
     
-    for file in list(form_files) + list(dto_files):
-        content = file.read_text()
-        
-        prompt = f"""Convert this Struts Form/DTO to a Spring Boot DTO.
+    def dto_prompt(content, packed=False):
+        # A packed prompt gets one reply section per file instead of a single block
+        reply = "" if packed else "Reply with the DTO class in a single ```java code block.\n"
+        return f"""Convert this Struts Form/DTO to a Spring Boot DTO.
 Requirements:
 1. Package and imports:
    - Use package com.example.application.model
@@ -686,13 +762,10 @@ Original Form/DTO:
 <</SYS>>
 
 Generate a complete DTO with all fields and validations from the original form/model.
-"""
+{reply}"""
 
-        # Call WCA API
-        payload = {"message_payload": {"messages": [{"content": prompt, "role": "USER"}]}}
-        response = call_wca_api(payload)
-        response_content = stream_response(response, action="Converting to DTO")
-        dto_content = extract_java_code(response_content)
+    def save_dto(file, text):
+        dto_content = extract_java_code(text)
         
         # Force package declaration if not present
         if not dto_content.strip().startswith("package"):
@@ -711,8 +784,16 @@ Generate a complete DTO with all fields and validations from the original form/m
             
         dto_path = output_dir / "src/main/java/com/example/application/model" / dto_name
         dto_path.write_text(dto_content)
-
-def migrate_service_layer(source_dir: Path, output_dir: Path):
+        return dto_path
+    
+    # Call WCA API for all forms/DTOs concurrently, several small ones per request.
+    # The reply is one class: stop at the end of its code block instead of
+    # streaming the explanation that usually follows
+    failures = run_units(files, dto_prompt, save_dto, "Converting to DTO", source_dir, journal, pack=True,
+                         stop=StopAtCodeBlock("java"))
+    raise_for_failures(failures, "Converting to DTO")
+
+def migrate_service_layer(source_dir: Path, output_dir: Path, journal=None):
     """Migrate service layer to Spring Boot"""
     # Look for service classes in multiple possible locations
     service_patterns = [
@@ -722,12 +803,10 @@ def migrate_service_layer(source_dir: Path, output_dir: Path):
         "**/action/*Action.java"  # Actions often contain business logic
     ]
     
-    for pattern in service_patterns:
-        service_files = source_dir.glob(pattern)
-        for service_file in service_files:
-            content = service_file.read_text()
-            
-            prompt = f"""Extract and convert business logic to a Spring Boot service.
+    service_files = [f for pattern in service_patterns for f in source_dir.glob(pattern)]
+    
+    def service_prompt(content):
+        return f"""Extract and convert business logic to a Spring Boot service.
 Requirements:
 1. Package and structure:
    - Use package com.example.application.service
@@ -767,28 +846,30 @@ Original Struts class:
 
 Generate a Spring Service that encapsulates all the business logic from the original class."""
 
-            # Call WCA API
-            payload = {"message_payload": {"messages": [{"content": prompt, "role": "USER"}]}}
-            response = call_wca_api(payload)
-            response_content = stream_response(response, action="Converting Service")
-            service_content = extract_java_code(response_content)
-            
-            # Force package declaration if not present
-            if not service_content.strip().startswith("package"):
-                service_content = "//" + service_content
-            
-            # Create new service file
-            service_path = output_dir / "src/main/java/com/example/application/service" / service_file.name
-            service_path.write_text(service_content)
+    def save_service(service_file, text):
+        service_content = extract_java_code(text)
+        
+        # Force package declaration if not present
+        if not service_content.strip().startswith("package"):
+            service_content = "//" + service_content
+        
+        # Create new service file
+        service_path = output_dir / "src/main/java/com/example/application/service" / service_file.name
+        service_path.write_text(service_content)
+        return service_path
+    
+    # Call WCA API for all service candidates concurrently
+    failures = run_units(service_files, service_prompt, save_service, "Converting Service", source_dir, journal)
+    raise_for_failures(failures, "Converting Service")
 
-def migrate_model_classes(source_dir: Path, output_dir: Path):
+def migrate_model_classes(source_dir: Path, output_dir: Path, journal=None):
     """Migrate model classes to Spring Boot entities"""
-    model_files = source_dir.glob("**/model/*.java")
-    for model_file in model_files:
-        content = model_file.read_text()
-        
-        # Create prompt for model conversion
-        prompt = f"""Convert this model class to a Spring Boot entity:
+    model_files = list(source_dir.glob("**/model/*.java"))
+    
+    def model_prompt(content, packed=False):
+        # A packed prompt gets one reply section per file instead of a single block
+        reply = "" if packed else "Reply with the entity class in a single ```java code block.\n"
+        return f"""Convert this model class to a Spring Boot entity:
 - Add proper JPA annotations if needed
 - Add validation annotations
 - Maintain all fields and methods
@@ -801,17 +882,20 @@ Original model:
 <</SYS>>
 
 Generate complete Spring entity implementation.
-"""
+{reply}"""
 
-        # Call WCA API
-        payload = {"message_payload": {"messages": [{"content": prompt, "role": "USER"}]}}
-        response = call_wca_api(payload)
-        response_content = stream_response(response, action="Converting Model")
-        model_content = extract_java_code(response_content)
+    def save_model(model_file, text):
+        model_content = extract_java_code(text)
         
         # Create new model file
         model_path = output_dir / "src/main/java/com/example/application/model" / model_file.name
         model_path.write_text(model_content)
+        return model_path
+    
+    # Call WCA API for all models concurrently, several small ones per request
+    failures = run_units(model_files, model_prompt, save_model, "Converting Model", source_dir, journal, pack=True,
+                         stop=StopAtCodeBlock("java"))
+    raise_for_failures(failures, "Converting Model")
 
 def update_pom_dependencies(source_dir: Path, output_dir: Path):
     """Update pom.xml with Spring Boot dependencies"""
@@ -843,12 +927,13 @@ def update_pom_dependencies(source_dir: Path, output_dir: Path):
     pom_path = output_dir / "pom.xml"
     pom_path.write_text(pom_template)
 
-def migrate_jsp_to_html(source_dir: Path, output_dir: Path):
+def migrate_jsp_to_html(source_dir: Path, output_dir: Path, journal=None):
     """Convert JSP files to HTML templates"""
     jsp_files = source_dir.glob("**/webapp/pages/**/*.jsp")
     
     for jsp_file in jsp_files:
         content = jsp_file.read_text()
+        relative_path = jsp_file.relative_to(source_dir / "src/main/webapp/pages")
         
         prompt = f"""Convert this JSP page to a modern HTML template.
 Requirements:
@@ -867,20 +952,25 @@ Original JSP:
 ```
 <</SYS>>
 
-Generate only the HTML template, no explanations.
+Generate only the HTML template, no explanations, in a single ```html code block.
 """
+        unit = f"Converting JSP to HTML:{relative_path.as_posix()}"
+        hashes = (content_hash(content), content_hash(prompt))
+        if journal and journal.completed(unit, *hashes):
+            continue
 
         # Call WCA API
         payload = {"message_payload": {"messages": [{"content": prompt, "role": "USER"}]}}
-        response = call_wca_api(payload)
+        response = call_wca_api(payload, stop=StopAtCodeBlock("html"))
         response_content = stream_response(response, action="Converting JSP to HTML")
         html_content = extract_html_code(response_content)
         
         # Create new HTML file
-        relative_path = jsp_file.relative_to(source_dir / "src/main/webapp/pages")
         html_path = output_dir / "src/main/resources/templates" / relative_path.with_suffix(".html")
         html_path.parent.mkdir(parents=True, exist_ok=True)
         html_path.write_text(html_content)
+        if journal:
+            journal.record(unit, *hashes, "done", html_path)
 
 def extract_html_code(response: str) -> str:
     """Extract HTML code from WCA API response"""
@@ -892,10 +982,10 @@ def extract_html_code(response: str) -> str:
     
     return code
 
-def migrate_jsp_to_thymeleaf(source_dir: Path, output_dir: Path):
+def migrate_jsp_to_thymeleaf(source_dir: Path, output_dir: Path, journal=None):
     """Migrate JSP pages to Thymeleaf templates"""
     # First convert JSP to HTML
-    migrate_jsp_to_html(source_dir, output_dir)
+    migrate_jsp_to_html(source_dir, output_dir, journal)
     
     # Then convert HTML to Thymeleaf
     html_files = list(output_dir.glob("**/templates/**/*.html"))
@@ -915,6 +1005,12 @@ def migrate_jsp_to_thymeleaf(source_dir: Path, output_dir: Path):
             # Determine template type based on path/filename
             template_type = "list" if "list" in html_file.stem else "form"
             
+            # The template is converted in place, so a finished unit is one
+            # whose file still holds the Thymeleaf output recorded for it
+            unit = f"Converting to Thymeleaf:{relative_path.as_posix()}"
+            if journal and journal.completed(unit, content_hash(content), content_hash(template_type)):
+                continue
+            
             if template_type == "list":
                 prompt = create_list_template_prompt(content)
             else:
@@ -922,12 +1018,14 @@ def migrate_jsp_to_thymeleaf(source_dir: Path, output_dir: Path):
 
             # Call WCA API
             payload = {"message_payload": {"messages": [{"content": prompt, "role": "USER"}]}}
-            response = call_wca_api(payload)
+            response = call_wca_api(payload, stop=StopAtCodeBlock("html"))
             response_content = stream_response(response, action=f"Converting {relative_path} to Thymeleaf")
             template_content = extract_html_code(response_content)
             
             # Update the file with Thymeleaf content
             html_file.write_text(template_content)
+            if journal:
+                journal.record(unit, content_hash(template_content), content_hash(template_type), "done", html_file)
             console.print(f"[green]Successfully converted {relative_path}[/green]")
             
         except Exception as e:
@@ -960,7 +1058,7 @@ Original HTML:
 ```
 <</SYS>>
 
-Generate a complete Thymeleaf list template.
+Generate a complete Thymeleaf list template in a single ```html code block.
 """
 
 def create_form_template_prompt(content: str) -> str:
@@ -989,8 +1087,10 @@ Original HTML:
 ```
 <</SYS>>
 
-Generate a complete Thymeleaf form template.
+Generate a complete Thymeleaf form template in a single ```html code block.
 """
 
+app.command()(daemon)
+
 if __name__ == "__main__":
     app()
\ No newline at end of file
@@ -1,7 +1,8 @@
 from rich.console import Console
-from rich.markdown import Markdown
 import typer
-from wca_backend import call_wca_api, stream_response
+from wca_client import call_wca_api, call_units, JobJournal, StopAtJsonObject, configure_response_cache, configure_output, configure_budget, is_dry_run, print_cache_stats, print_limiter_stats, print_pool_stats, print_token_usage
+from wca_client.cli import daemon
+from wca_backend import stream_response
 from pathlib import Path
 from typing import Optional
 from dotenv import load_dotenv
@@ -13,10 +14,26 @@ load_dotenv()
 console = Console()
 app = typer.Typer(help=".NET Code Analysis and Generation Tool")
 
+@app.callback()
+def main(
+    ctx: typer.Context,
+    no_cache: bool = typer.Option(False, "--no-cache", help="Do not read or write the WCA response cache"),
+    refresh: bool = typer.Option(False, "--refresh", help="Ignore cached WCA responses but store fresh ones"),
+    quiet: bool = typer.Option(False, "--quiet", "-q", help="Do not show the spinner or streamed WCA output (for batch jobs)"),
+    dry_run: bool = typer.Option(False, "--dry-run", help="Build the prompts and report estimated tokens and cost without calling WCA")
+):
+    configure_response_cache(enabled=False if no_cache else None, refresh=refresh)
+    configure_output(quiet=quiet or None)
+    configure_budget(dry_run=dry_run or None)
+    ctx.call_on_close(print_cache_stats)
+    ctx.call_on_close(print_limiter_stats)
+    ctx.call_on_close(print_pool_stats)
+    ctx.call_on_close(print_token_usage)
+
 def check_api_key():
     """Check if IBM Cloud API key is set"""
     api_key = os.getenv("IAM_APIKEY")
-    if not api_key:
+    if not api_key and not is_dry_run():
         console.print("[red]Error: IAM_APIKEY not found in environment variables[/red]")
         console.print("Please set your IBM Cloud API key in .env file:")
         console.print("IAM_APIKEY=your_api_key_here")
@@ -56,9 +73,9 @@ def unfold_code_blocks(content: str) -> str:
     
     return '\n'.join(result)
 
-def generate_unit_tests(code: str, test_framework: str = "xunit") -> str:
-    """Generate unit tests for .NET code"""
-    test_prompt = f"""Analyze this .NET code and generate unit tests:
+def unit_test_prompt(code: str, test_framework: str = "xunit") -> str:
+    """Build the prompt asking for unit tests for .NET code"""
+    return f"""Analyze this .NET code and generate unit tests:
 - Use {test_framework} test framework
 - Include test cases for:
   * Happy path scenarios
@@ -88,20 +105,28 @@ Return the test code in a code block with the path format:
 [Your test code here]
 ```"""
 
-    try:
-        test_payload = {
-            "message_payload": {
-                "messages": [{"content": test_prompt, "role": "USER"}]
-            }
+def unit_test_payload(code: str, test_framework: str = "xunit") -> dict:
+    """Build the WCA payload asking for unit tests for .NET code"""
+    return {
+        "message_payload": {
+            "messages": [{"content": unit_test_prompt(code, test_framework), "role": "USER"}]
         }
-        test_response = call_wca_api(test_payload)
+    }
+
+def wrap_unit_tests(tests: str) -> str:
+    """Give generated tests a default file path if the response has none"""
+    if not (tests.startswith("```") and ":" in tests.splitlines()[0]):
+        tests = f"```csharp:Tests/GeneratedTests.cs\n{tests}\n```"
+    return tests
+
+def generate_unit_tests(code: str, test_framework: str = "xunit") -> str:
+    """Generate unit tests for .NET code"""
+    try:
+        test_response = call_wca_api(unit_test_payload(code, test_framework))
         tests = stream_response(test_response, action="Generating unit tests")
         
         # If response doesn't include file path, wrap it with default path
-        if not (tests.startswith("```") and ":" in tests.splitlines()[0]):
-            tests = f"```csharp:Tests/GeneratedTests.cs\n{tests}\n```"
-            
-        return tests
+        return wrap_unit_tests(tests)
     except Exception as e:
         console.print(f"[red]Error generating unit tests: {str(e)}[/red]")
         return ""
@@ -123,9 +148,11 @@ def unittest(
     source_path: Path = typer.Argument(..., help=".NET source file or directory to generate tests for", exists=True),
     framework: str = typer.Option("xunit", "--framework", "-f", help="Test framework to use (xunit/nunit/mstest)"),
     output_dir: Optional[Path] = typer.Option(None, "--output", "-o", help="Output directory for test project"),
-    verbose: bool = typer.Option(False, "--verbose", "-v", help="Show detailed progress")
+    verbose: bool = typer.Option(False, "--verbose", "-v", help="Show detailed progress"),
+    resume: bool = typer.Option(False, "--resume", help="Skip files an interrupted run already generated tests for (see the journal in the output directory)")
 ):
     """Generate unit tests for .NET code"""
+    journal = None
     try:
         check_api_key()
         
@@ -144,82 +171,98 @@ def unittest(
         total_files = len(source_files)
         console.print(f"[green]Found {total_files} .NET source files[/green]")
         
-        # Process each source file
+        def save_tests(index, text):
+            source_file = source_files[index]
+            if verbose:
+                console.print(f"\n[yellow]Processing: {source_file}[/yellow]")
+            
+            result = wrap_unit_tests(text)
+            
+            # Parse the generated code to extract file structure
+            files = parse_generated_code(result)
+            
+            # Determine source project structure
+            try:
+                # Try to find src directory
+                src_dir = source_file.parent
+                while src_dir.name and not (src_dir / "src").exists():
+                    src_dir = src_dir.parent
+                    if src_dir == src_dir.parent:  # Reached root
+                        break
+
+                if (src_dir / "src").exists():
+                    # Standard src/project structure
+                    relative_path = source_file.relative_to(src_dir / "src")
+                    project_name = relative_path.parts[0]  # First folder after src is project name
+                    sub_path = Path(*relative_path.parts[1:])  # Path after project name
+                else:
+                    # Try to find by namespace structure
+                    project_name = source_file.parent.name
+                    while project_name.endswith(".API") or project_name.endswith(".Core") or project_name.endswith(".Infrastructure"):
+                        project_name = project_name.rsplit(".", 1)[0]
+                    sub_path = source_file.relative_to(source_file.parent.parent)
+
+            except ValueError:
+                # Fallback if not in standard structure
+                project_name = source_file.parent.name
+                sub_path = source_file.name
+
+            # Create test project directory in output folder
+            test_project_dir = output_dir / f"{project_name}.UnitTests"
+            test_project_dir.mkdir(parents=True, exist_ok=True)
+
+            # Save test file maintaining source structure
+            test_file_name = source_file.stem + "Tests.cs"
+            if sub_path.parent != Path("."):
+                test_file_path = test_project_dir / sub_path.parent / test_file_name
+            else:
+                test_file_path = test_project_dir / test_file_name
+
+            test_file_path.parent.mkdir(parents=True, exist_ok=True)
+
+            # Combine all test content into one file
+            all_test_content = []
+            for content in files.values():
+                # Remove any remaining markdown or code block markers
+                clean_content = unfold_code_blocks(content)
+                all_test_content.append(clean_content)
+
+            final_test_content = "\n\n".join(all_test_content)
+
+            # Save test file
+            test_file_path.write_text(final_test_content)
+            if verbose:
+                console.print(f"[green]Unit tests saved to {test_file_path}[/green]")
+            return test_file_path
+        
+        # Generate tests for all files concurrently, several small files per request,
+        # saving each file's tests as soon as they arrive
+        root = source_path if source_path.is_dir() else source_path.parent
+        sources = [(source_file.relative_to(root).as_posix(), read_file(source_file)) for source_file in source_files]
+        journal = JobJournal(output_dir, resume=resume)
         with console.status("[bold blue]Generating unit tests...") as status:
-            for index, source_file in enumerate(source_files, 1):
-                try:
-                    status.update(f"[bold blue]Processing file {index}/{total_files} ({(index/total_files)*100:.1f}%)")
-                    
-                    if verbose:
-                        console.print(f"\n[yellow]Processing: {source_file}[/yellow]")
-                    
-                    code = read_file(source_file)
-                    result = generate_unit_tests(code, framework)
-                    
-                    # Parse the generated code to extract file structure
-                    files = parse_generated_code(result)
-                    
-                    # Determine source project structure
-                    try:
-                        # Try to find src directory
-                        src_dir = source_file.parent
-                        while src_dir.name and not (src_dir / "src").exists():
-                            src_dir = src_dir.parent
-                            if src_dir == src_dir.parent:  # Reached root
-                                break
-                        
-                        if (src_dir / "src").exists():
-                            # Standard src/project structure
-                            relative_path = source_file.relative_to(src_dir / "src")
-                            project_name = relative_path.parts[0]  # First folder after src is project name
-                            sub_path = Path(*relative_path.parts[1:])  # Path after project name
-                        else:
-                            # Try to find by namespace structure
-                            project_name = source_file.parent.name
-                            while project_name.endswith(".API") or project_name.endswith(".Core") or project_name.endswith(".Infrastructure"):
-                                project_name = project_name.rsplit(".", 1)[0]
-                            sub_path = source_file.relative_to(source_file.parent.parent)
-                    
-                    except ValueError:
-                        # Fallback if not in standard structure
-                        project_name = source_file.parent.name
-                        sub_path = source_file.name
-                    
-                    # Create test project directory in output folder
-                    test_project_dir = output_dir / f"{project_name}.UnitTests"
-                    test_project_dir.mkdir(parents=True, exist_ok=True)
-                    
-                    # Save test file maintaining source structure
-                    test_file_name = source_file.stem + "Tests.cs"
-                    if sub_path.parent != Path("."):
-                        test_file_path = test_project_dir / sub_path.parent / test_file_name
-                    else:
-                        test_file_path = test_project_dir / test_file_name
-                        
-                    test_file_path.parent.mkdir(parents=True, exist_ok=True)
-                    
-                    # Combine all test content into one file
-                    all_test_content = []
-                    for content in files.values():
-                        # Remove any remaining markdown or code block markers
-                        clean_content = unfold_code_blocks(content)
-                        all_test_content.append(clean_content)
-                    
-                    final_test_content = "\n\n".join(all_test_content)
-                    
-                    # Save test file
-                    test_file_path.write_text(final_test_content)
-                    if verbose:
-                        console.print(f"[green]Unit tests saved to {test_file_path}[/green]")
-                    
-                except Exception as e:
-                    console.print(f"[red]Error processing {source_file.name}: {str(e)}[/red]")
-                    if verbose:
-                        import traceback
-                        console.print("[red]Traceback:[/red]")
-                        console.print(traceback.format_exc())
-                    continue
+            results = call_units(
+                sources,
+                lambda code, packed=False: unit_test_prompt(code, framework),
+                save_tests,
+                journal=journal,
+                pack=True,
+                on_progress=lambda done, total, result: status.update(
+                    f"[bold blue]Processed file {done}/{total} ({(done/total)*100:.1f}%)"
+                )
+            )
         
+        for source_file, test_result in zip(source_files, results):
+            if test_result is not None and not test_result.ok:
+                console.print(f"[red]Error processing {source_file.name}: {str(test_result.error)}[/red]")
+                if verbose:
+                    import traceback
+                    console.print("[red]Traceback:[/red]")
+                    error = test_result.error
+                    console.print("".join(traceback.format_exception(type(error), error, error.__traceback__)))
+        if journal.skipped:
+            console.print(f"[blue]Resumed: {journal.skipped} file(s) with tests from an earlier run were skipped[/blue]")
+    
         console.print(f"\n[bold green]✓ Generated unit tests for {total_files} files in {output_dir}[/bold green]")
             
     except Exception as e:
@@ -229,6 +272,9 @@ def unittest(
             console.print("[red]Traceback:[/red]")
             console.print(traceback.format_exc())
         raise typer.Exit(1)
+    finally:
+        if journal:
+            journal.close()
 
 def analyze_requirements(spec: str) -> dict:
     """Analyze the specification to determine what needs to be generated"""
@@ -278,7 +324,8 @@ Return a JSON structure like:
                 "messages": [{"content": analysis_prompt, "role": "USER"}]
             }
         }
-        response = call_wca_api(payload)
+        # Only the JSON object is parsed; stop as soon as it is complete
+        response = call_wca_api(payload, stop=StopAtJsonObject())
         analysis = stream_response(response, action="Analyzing requirements")
         
         # Extract JSON from response
@@ -616,5 +663,7 @@ def parse_generated_code(result: str) -> dict[str, str]:
     
     return files
 
+app.command()(daemon)
+
 if __name__ == "__main__":
     app()
\ No newline at end of file
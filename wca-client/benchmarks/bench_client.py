@@ -0,0 +1,75 @@
+"""Benchmark: pooled WCAClient vs. the old per-call requests.post path.
+
+Starts a local stub that speaks the IAM token and WCA chat contracts, then
+times N sequential chat calls both ways:
+
+- baseline: fetch a new IAM token and open a new connection for every call
+  (what call_wca_api did before WCAClient)
+- pooled:   WCAClient with a keep-alive session and cached token
+
+Usage:
+    python benchmarks/bench_client.py --requests 200
+
+The stub serves plain HTTP, so the saving shown here is TCP setup plus the IAM
+round trip; against the real HTTPS endpoints the TLS handshake widens the gap.
+"""
+import argparse
+import json
+import statistics
+import sys
+import time
+from pathlib import Path
+
+import requests
+
+sys.path.append(str(Path(__file__).parent.parent))
+
+from wca_client import TokenCache, WCAClient
+from wca_client.auth import _request_iam_token
+from wca_client.stream import _iter_content
+from wca_stub import start_stub
+
+def baseline_call(stub, payload):
+    # Equivalent of the pre-WCAClient call_wca_api: IAM round trip + new connection
+    token_response = requests.post(stub.iam_url, data={"apikey": "bench"}, timeout=30)
+    headers = {"Authorization": f"Bearer {token_response.json()['access_token']}", "Accept": "text/event-stream"}
+    response = requests.post(stub.chat_url, headers=headers, files=[("message", (None, json.dumps(payload)))], timeout=180, stream=True)
+    return "".join(_iter_content(response))
+
+def time_calls(fn, count):
+    samples = []
+    for _ in range(count):
+        start = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - start) * 1000)
+    return samples
+
+def report(name, samples):
+    print(f"{name:<10} mean {statistics.mean(samples):7.2f} ms   "
+          f"p50 {statistics.median(samples):7.2f} ms   "
+          f"p99 {sorted(samples)[int(len(samples) * 0.99) - 1]:7.2f} ms")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=200, help="Number of chat calls per mode")
+    args = parser.parse_args()
+
+    stub = start_stub(ttft=0, tokens_per_sec=0, response="Hello from the stub")
+    payload = {"message_payload": {"messages": [{"content": "hi", "role": "USER"}]}}
+    try:
+        baseline = time_calls(lambda: baseline_call(stub, payload), args.requests)
+
+        cache = TokenCache(fetch=lambda key: _request_iam_token(key, iam_url=stub.iam_url))
+        # Identical payloads would otherwise be coalesced or cached
+        with WCAClient(url=stub.chat_url, apikey="bench", token_cache=cache, coalesce=False) as client:
+            pooled = time_calls(lambda: "".join(client.stream(payload)), args.requests)
+    finally:
+        stub.shutdown()
+
+    report("baseline", baseline)
+    report("pooled", pooled)
+    saving = statistics.mean(baseline) - statistics.mean(pooled)
+    print(f"saving     {saving:7.2f} ms per request ({saving / statistics.mean(baseline):.0%})")
+
+if __name__ == "__main__":
+    main()
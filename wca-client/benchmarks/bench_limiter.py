@@ -0,0 +1,54 @@
+"""Benchmark: adaptive concurrency limit vs. fixed worker counts under a quota.
+
+Starts a local stub whose chat endpoint admits at most --quota concurrent
+requests and answers the rest with 429 + Retry-After, then runs the same
+call_many batch with:
+
+- fixed-N: the limit pinned at N (what tuning WCA_CONCURRENCY by hand gives)
+- adaptive: AdaptiveLimiter starting at WCA_CONCURRENCY's default
+
+and reports sustained throughput and how often the stub pushed back.
+
+Usage:
+    python benchmarks/bench_limiter.py --requests 200 --quota 6
+"""
+import argparse
+import sys
+import time
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).parent.parent))
+
+from wca_client import AdaptiveLimiter, TokenCache, WCAClient, call_many, MAX_IN_FLIGHT
+from wca_stub import start_stub
+
+def run(url, limiter, count):
+    payloads = [{"message_payload": {"messages": [{"content": f"item {n}", "role": "USER"}]}} for n in range(count)]
+    token_cache = TokenCache(fetch=lambda key: ("stub-token", time.time() + 3600))
+    with WCAClient(url=url, apikey="bench", token_cache=token_cache, limiter=limiter, max_retries=20) as client:
+        start = time.perf_counter()
+        results = call_many(payloads, client=client)
+        elapsed = time.perf_counter() - start
+    failed = sum(not result.ok for result in results)
+    return count / elapsed, limiter.stats(), failed
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=200, help="Chat calls per run")
+    parser.add_argument("--quota", type=int, default=6, help="Concurrent requests the stub admits")
+    args = parser.parse_args()
+
+    stub = start_stub(ttft=0.05, tokens_per_sec=0, response="ok", max_concurrency=args.quota, retry_after=0.2)
+
+    runs = [(f"fixed-{n}", AdaptiveLimiter(initial=n, min_limit=n, max_limit=n)) for n in (2, MAX_IN_FLIGHT)]
+    runs.append(("adaptive", AdaptiveLimiter()))
+    try:
+        for name, limiter in runs:
+            rate, stats, failed = run(stub.chat_url, limiter, args.requests)
+            print(f"{name:<10} {rate:7.1f} req/s   429s {stats['throttled']:4}   "
+                  f"final limit {stats['limit']:3}   failed {failed}")
+    finally:
+        stub.shutdown()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+"""Micro-benchmark: StreamDecoder vs. the old per-line stream parsing.
+
+Decodes a recorded (or synthesized) WCA chat stream of ~50k tokens and
+reports parse throughput in MB/s for:
+
+- old:     iter_lines() + json.loads per line + ``buffer += content``
+           (what stream_response did before StreamDecoder)
+- decoder: iter_content() byte chunks through StreamDecoder + "".join
+
+Usage:
+    python benchmarks/bench_stream_parser.py                 # synthesized NDJSON stream
+    python benchmarks/bench_stream_parser.py --sse           # synthesized SSE stream
+    python benchmarks/bench_stream_parser.py --input body.txt  # a recorded response body
+"""
+import argparse
+import io
+import json
+import random
+import sys
+import time
+from pathlib import Path
+
+import requests
+
+sys.path.append(str(Path(__file__).parent.parent))
+
+from wca_client import StreamDecoder, iter_events, DELTA
+
+WORDS = ["public", " class", " Customer", "Controller", " {", "\n    ", "@Autowired", " private",
+         " final", " CustomerService", " service", ";", "\n", "    return", " ResponseEntity", ".ok(", ")"]
+
+def synthesize(tokens, sse):
+    """Build a WCA-shaped stream body with one delta per token"""
+    rng = random.Random(42)
+    frames = []
+    for index in range(tokens):
+        message = {
+            "response": {"message": {"role": "ASSISTANT", "content": rng.choice(WORDS)}},
+            "metadata": {"request_id": "bench", "index": index},
+        }
+        line = json.dumps(message)
+        frames.append(f"data: {line}\n\n" if sse else line + "\n")
+    if sse:
+        frames.append("data: [DONE]\n\n")
+    return "".join(frames).encode("utf-8")
+
+def make_response(body):
+    response = requests.Response()
+    response.status_code = 200
+    response.raw = io.BytesIO(body)
+    return response
+
+def parse_old(body):
+    buffer = ""
+    for chunk in make_response(body).iter_lines():
+        if chunk:
+            try:
+                chunk_data = json.loads(chunk.decode("utf-8"))
+                if "response" in chunk_data and "message" in chunk_data["response"]:
+                    content = chunk_data["response"]["message"].get("content", "")
+                    if content:
+                        buffer += content
+            except json.JSONDecodeError:
+                continue
+    return buffer
+
+def parse_decoder(body):
+    return "".join(event.content for event in iter_events(make_response(body)) if event.type == DELTA)
+
+def parse_decoder_small_chunks(body):
+    # Worst case for framing: the network hands us 64-byte pieces
+    decoder = StreamDecoder()
+    parts = []
+    for start in range(0, len(body), 64):
+        parts.extend(e.content for e in decoder.feed(body[start:start + 64]) if e.type == DELTA)
+    parts.extend(e.content for e in decoder.flush() if e.type == DELTA)
+    return "".join(parts)
+
+def bench(name, fn, body, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn(body)
+        best = min(best, time.perf_counter() - start)
+    print(f"{name:<22} {len(body) / best / 1e6:8.1f} MB/s   ({best * 1000:7.1f} ms, {len(result)} chars)")
+    return result
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--tokens", type=int, default=50_000, help="Tokens in the synthesized stream")
+    parser.add_argument("--sse", action="store_true", help="Use SSE data: framing")
+    parser.add_argument("--input", type=Path, help="Recorded response body to decode instead")
+    parser.add_argument("--repeat", type=int, default=5, help="Runs per parser (best is reported)")
+    args = parser.parse_args()
+
+    body = args.input.read_bytes() if args.input else synthesize(args.tokens, args.sse)
+    print(f"stream: {len(body) / 1e6:.2f} MB")
+
+    if not args.sse:
+        old = bench("old (iter_lines)", parse_old, body, args.repeat)
+    new = bench("decoder (iter_content)", parse_decoder, body, args.repeat)
+    bench("decoder (64 B chunks)", parse_decoder_small_chunks, body, args.repeat)
+    if not args.sse:
+        assert old == new, "parsers disagree"
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,19 @@
+from setuptools import setup, find_packages
+
+setup(
+    name="wca-client",
+    version="0.1.0",
+    packages=find_packages(include=["wca_client", "wca_client.*"]),
+    python_requires=">=3.8",
+    install_requires=[
+        "rich>=13.0.0",
+        "requests>=2.31.0",
+        "httpx>=0.24.0",
+    ],
+    extras_require={
+        # wca_client.cli (the shared daemon command)
+        "cli": ["typer>=0.9.0"],
+        # exact token counts with WCA_TOKENIZER
+        "tokenizer": ["tokenizers"],
+    },
+)
@@ -0,0 +1,33 @@
+import os
+import re
+import subprocess
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).parent.parent
+# Cumulative import time allowed for wca_client (rich.console included)
+IMPORT_BUDGET_MS = float(os.getenv("WCA_IMPORT_BUDGET_MS", "200"))
+HTTP_MODULES = ("requests", "urllib3", "httpx", "github")
+HEAVY_MODULES = HTTP_MODULES + ("asyncio", "rich.markdown", "typer")
+
+def import_times(*args):
+    """Run python -X importtime with args; return {module: cumulative microseconds}."""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", *args],
+        cwd=ROOT, capture_output=True, text=True, timeout=60,
+    )
+    assert result.returncode == 0, result.stderr[-2000:]
+    times = {}
+    for line in result.stderr.splitlines():
+        match = re.match(r"import time:\s+\d+ \|\s+(\d+) \| ( *)(\S+)", line)
+        if match:
+            times[match.group(3)] = int(match.group(1))
+    return times
+
+def test_client_import_is_lazy_and_within_budget():
+    """Test that importing wca_client defers the HTTP stack and stays within the startup budget"""
+    # Best of three, so a cold disk cache on the first run does not fail the budget
+    runs = [import_times("-c", "import wca_client") for _ in range(3)]
+    assert not [module for module in HEAVY_MODULES if module in runs[0]]
+    best = min(run["wca_client"] for run in runs) / 1000
+    assert best <= IMPORT_BUDGET_MS, f"import wca_client took {best:.0f} ms (budget {IMPORT_BUDGET_MS:.0f} ms)"
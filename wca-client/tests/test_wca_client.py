@@ -0,0 +1,922 @@
+import asyncio
+import base64
+import json
+import time
+import threading
+import pytest
+import requests
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+import sys
+
+# Add parent directory to Python path
+sys.path.append(str(Path(__file__).parent.parent))
+
+import wca_client
+from wca_client import TokenCache, WCAClient, AsyncWCAClient, call_many, ResponseCache, response_cache_key, AdaptiveLimiter, HedgePolicy
+from wca_client.stream import _iter_content
+
+class FakeIAM:
+    """Stand-in for the IAM token endpoint that counts fetches"""
+    def __init__(self, lifetime=3600):
+        self.lifetime = lifetime
+        self.calls = 0
+        self.lock = threading.Lock()
+
+    def __call__(self, apikey):
+        with self.lock:
+            self.calls += 1
+            return f"token-{apikey}-{self.calls}", time.time() + self.lifetime
+
+def test_token_cache_reuses_token():
+    """Test that a valid token is fetched once and then served from memory"""
+    iam = FakeIAM()
+    cache = TokenCache(fetch=iam)
+
+    assert cache.get("key") == "token-key-1"
+    assert cache.get("key") == "token-key-1"
+    assert cache.get("other") == "token-other-2"
+    assert iam.calls == 2
+
+def test_token_cache_refreshes_ahead_of_expiry():
+    """Test that a token inside the refresh margin is served while a new one is fetched"""
+    iam = FakeIAM(lifetime=120)
+    cache = TokenCache(fetch=iam, refresh_margin=300)
+
+    assert cache.get("key") == "token-key-1"
+    # Still valid, so the caller gets it immediately while refresh runs in background
+    assert cache.get("key") == "token-key-1"
+    deadline = time.time() + 5
+    while iam.calls < 2 and time.time() < deadline:
+        time.sleep(0.01)
+    assert iam.calls >= 2
+
+def test_token_cache_concurrent_misses_fetch_once():
+    """Test that concurrent callers share a single IAM round trip"""
+    iam = FakeIAM()
+    cache = TokenCache(fetch=iam)
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(cache.get("key"))) for _ in range(16)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert iam.calls == 1
+    assert set(results) == {"token-key-1"}
+
+def test_token_cache_persists_to_disk(tmp_path):
+    """Test that two caches sharing a file (e.g. two CLI runs) share one token"""
+    iam = FakeIAM()
+    path = str(tmp_path / "tokens.json")
+
+    assert TokenCache(fetch=iam, path=path).get("key") == "token-key-1"
+    assert TokenCache(fetch=iam, path=path).get("key") == "token-key-1"
+    assert iam.calls == 1
+    # The raw API key must never be written to disk
+    assert "key" not in Path(path).read_text().replace("token-key", "")
+
+def test_token_cache_invalidate(tmp_path):
+    """Test that an invalidated token is fetched again"""
+    iam = FakeIAM()
+    cache = TokenCache(fetch=iam, path=str(tmp_path / "tokens.json"))
+    cache.get("key")
+    cache.invalidate("key")
+
+    assert cache.get("key") == "token-key-2"
+
+def test_get_bearer_token_requires_key(monkeypatch):
+    """Test that a missing API key is reported before any network call"""
+    monkeypatch.delenv("IAM_APIKEY", raising=False)
+    with pytest.raises(ValueError):
+        wca_client.get_bearer_token()
+
+def test_keep_token_fresh_refreshes_ahead_of_expiry():
+    """Test that the background refresher keeps a valid token cached, so callers never fetch"""
+    iam = FakeIAM(lifetime=0.2)
+
+    async def afetch(apikey):
+        return iam(apikey)
+
+    async def run():
+        cache = TokenCache(fetch=None, afetch=afetch, refresh_margin=0.1)
+        async with AsyncWCAClient(url="http://127.0.0.1:9/chat", apikey="key", token_cache=cache) as client:
+            refresher = asyncio.create_task(client.keep_token_fresh())
+            await asyncio.sleep(0.15)
+            fetched = iam.calls
+            token = await client._token()
+            refresher.cancel()
+            return fetched, token
+
+    fetched, token = asyncio.run(run())
+    assert fetched == 2  # at startup and once inside the refresh margin
+    assert token == "token-key-2" and iam.calls == 2
+
+class ChatHandler(BaseHTTPRequestHandler):
+    """Minimal WCA chat endpoint that records which connection served each request"""
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+    connections = []
+
+    def log_message(self, *args):
+        pass
+
+    throttle = 0
+    stall = 0
+    stall_seconds = 1
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        self.connections.append(self.client_address)
+        if len(self.connections) <= self.throttle:
+            body = b'{"error": "rate limited"}'
+            self.send_response(429)
+            self.send_header("Retry-After", "0")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+            return
+        if len(self.connections) <= self.stall:
+            time.sleep(self.stall_seconds)
+        chunks = [{"response": {"message": {"content": word}}} for word in ["Hello", " world"]]
+        body = "".join(json.dumps(chunk) + "\n" for chunk in chunks).encode()
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+@pytest.fixture
+def chat_server():
+    ChatHandler.connections = []
+    ChatHandler.throttle = 0
+    ChatHandler.stall = 0
+    ChatHandler.stall_seconds = 1
+    server = ThreadingHTTPServer(("127.0.0.1", 0), ChatHandler)
+    # A short poll interval keeps shutdown() from adding half a second per test
+    threading.Thread(target=server.serve_forever, kwargs={"poll_interval": 0.05}, daemon=True).start()
+    yield f"http://127.0.0.1:{server.server_port}"
+    server.shutdown()
+
+def test_client_streams_over_one_connection(chat_server):
+    """Test that WCAClient yields deltas and reuses its keep-alive connection"""
+    cache = TokenCache(fetch=FakeIAM())
+    payload = {"message_payload": {"messages": [{"content": "hi", "role": "USER"}]}}
+    with WCAClient(url=chat_server, apikey="key", token_cache=cache) as client:
+        assert list(client.stream(payload)) == ["Hello", " world"]
+        assert "".join(client.stream(payload)) == "Hello world"
+
+    assert len(ChatHandler.connections) == 2
+    assert len(set(ChatHandler.connections)) == 1
+
+def test_async_client_streams_deltas(chat_server):
+    """Test that AsyncWCAClient.astream yields deltas and fetches tokens asynchronously"""
+    iam = FakeIAM()
+
+    async def afetch(apikey):
+        return iam(apikey)
+
+    cache = TokenCache(fetch=None, afetch=afetch)
+    payload = {"message_payload": {"messages": [{"content": "hi", "role": "USER"}]}}
+
+    async def run():
+        async with AsyncWCAClient(url=chat_server, apikey="key", token_cache=cache) as client:
+            deltas = [content async for content in client.astream(payload)]
+            results = await asyncio.gather(*(client.achat(payload) for _ in range(5)))
+            return deltas, results
+
+    deltas, results = asyncio.run(run())
+    assert deltas == ["Hello", " world"]
+    assert results == ["Hello world"] * 5
+    assert iam.calls == 1
+
+def test_async_client_uses_blocking_token_fetch(chat_server):
+    """Test that AsyncWCAClient honours a TokenCache with only a blocking fetch instead of calling IAM"""
+    iam = FakeIAM()
+    payload = {"message_payload": {"messages": [{"content": "hi", "role": "USER"}]}}
+
+    async def run():
+        async with AsyncWCAClient(url=chat_server, apikey="key", token_cache=TokenCache(fetch=iam)) as client:
+            return await client.achat(payload)
+
+    assert asyncio.run(run()) == "Hello world"
+    assert iam.calls == 1
+
+class SlowClient:
+    """Fake WCAClient that tracks how many calls run at once"""
+    def __init__(self):
+        self.active = 0
+        self.peak = 0
+        self.lock = threading.Lock()
+
+    def complete(self, payload, files=()):
+        with self.lock:
+            self.active += 1
+            self.peak = max(self.peak, self.active)
+        try:
+            time.sleep(0.02 * (3 - payload["n"] % 3))
+            if payload["n"] == 2:
+                raise RuntimeError("boom")
+            return f"result {payload['n']}"
+        finally:
+            with self.lock:
+                self.active -= 1
+
+def test_call_many_ordered_results_and_errors():
+    """Test that call_many keeps input order, isolates failures and reports progress"""
+    client = SlowClient()
+    progress = []
+    results = call_many(
+        [{"n": n} for n in range(8)],
+        max_concurrency=3,
+        on_progress=lambda done, total, result: progress.append((done, total)),
+        client=client
+    )
+
+    assert [r.index for r in results] == list(range(8))
+    assert results[0].text == "result 0"
+    assert not results[2].ok and "boom" in str(results[2].error)
+    assert all(r.ok for r in results if r.index != 2)
+    assert progress == [(done, 8) for done in range(1, 9)]
+    assert client.peak <= 3
+
+def test_call_many_interrupt_drops_queued_jobs():
+    """Test that Ctrl-C during a batch returns at once and queued requests never start"""
+    release = threading.Event()
+    started = []
+
+    class BlockingClient:
+        def complete(self, payload, files=()):
+            started.append(payload["n"])
+            if payload["n"]:
+                release.wait(5)
+            return "done"
+
+    def interrupt(done, total, result):
+        raise KeyboardInterrupt
+
+    start = time.time()
+    with pytest.raises(KeyboardInterrupt):
+        call_many([{"n": n} for n in range(6)], max_concurrency=2, on_progress=interrupt, client=BlockingClient())
+    assert time.time() - start < 2
+    release.set()
+    time.sleep(0.1)
+    # The worker freed by job 0 may have taken job 2 before the interrupt; nothing later starts
+    assert set(started) <= {0, 1, 2}
+
+class PackingClient:
+    """Fake WCAClient answering packed prompts section by section, skipping one file"""
+    def __init__(self, skip):
+        self.skip = skip
+        self.prompts = []
+
+    def complete(self, payload, files=(), stop=None):
+        prompt = payload["message_payload"]["messages"][0]["content"]
+        self.prompts.append(prompt)
+        names = [line[len("--- file: "):-len(" ---")] for line in prompt.splitlines() if line.startswith("--- file: ")]
+        if not names:
+            return "```java\nconverted " + prompt.split("SOURCE:", 1)[1].strip() + "\n```"
+        return "\n".join(f"--- file: {name} ---\n```java\nconverted {name}\n```" for name in names if name != self.skip)
+
+def test_call_packed_groups_small_files_and_falls_back():
+    """Test that small files share requests, results map back per file and missing sections are retried"""
+    files = [(f"model/M{n}.java", f"M{n}") for n in range(5)] + [("model/Big.java", "x" * 400)]
+    assert wca_client.pack_files(files, budget=100, max_files=3) == [[0, 1, 2], [3, 4], [5]]
+
+    def prompt_for(content, packed=False):
+        reply = "" if packed else " Reply with a single code block."
+        return f"Convert this.{reply}\nSOURCE:\n{content}"
+
+    client = PackingClient(skip="model/M1.java")
+    progress = []
+    results = wca_client.call_packed(
+        files, prompt_for, budget=100, max_files=3, client=client,
+        on_progress=lambda done, total, result: progress.append(done),
+    )
+    assert [r.text for r in results[:5]] == [f"```java\nconverted model/M{n}.java\n```" if n != 1 else "```java\nconverted M1\n```"
+                                             for n in range(5)]
+    assert results[5].text == "```java\nconverted " + "x" * 400 + "\n```"
+    # Two packs, the big file alone, and M1 retried on its own
+    assert len(client.prompts) == 4
+    assert sorted(progress) == list(range(1, 7))
+    packed = [prompt for prompt in client.prompts if "--- file: " in prompt]
+    assert len(packed) == 2 and not [prompt for prompt in packed if "single code block" in prompt]
+
+class FailingPackClient(PackingClient):
+    """PackingClient whose packed requests fail"""
+    def complete(self, payload, files=(), stop=None):
+        if "--- file: " in payload["message_payload"]["messages"][0]["content"]:
+            self.prompts.append("pack")
+            raise RuntimeError("quota exceeded")
+        return super().complete(payload, files, stop)
+
+def test_call_packed_reports_a_failed_pack_per_file():
+    """Test that a failed packed request is each file's error, not a silent retry of every file"""
+    files = [(f"model/M{n}.java", f"M{n}") for n in range(3)]
+    client = FailingPackClient(skip=None)
+    results = wca_client.call_packed(files, lambda content, packed=False: f"SOURCE:\n{content}", client=client)
+    assert [str(r.error) for r in results] == ["quota exceeded"] * 3
+    assert client.prompts == ["pack"]
+
+class ConvertingClient:
+    """Fake WCAClient that converts each prompt, failing while ``fail`` is in it"""
+    def __init__(self, fail=None):
+        self.fail = fail
+        self.prompts = []
+
+    def complete(self, payload, files=()):
+        prompt = payload["message_payload"]["messages"][0]["content"]
+        self.prompts.append(prompt)
+        if self.fail and self.fail in prompt:
+            raise RuntimeError("boom")
+        return prompt.upper()
+
+def test_call_units_journal_resumes(tmp_path):
+    """Test that units are saved and journaled as they finish, and only unfinished or changed ones rerun"""
+    def save(index, text):
+        path = tmp_path / units[index][0]
+        path.write_text(text)
+        return path
+
+    units = [("a.java", "class A"), ("b.java", "class B"), ("c.java", "class C")]
+    prompt_for = lambda content: f"convert {content}"
+    client = ConvertingClient(fail="B")
+    with wca_client.JobJournal(tmp_path, resume=True) as journal:
+        results = wca_client.call_units(units, prompt_for, save, journal=journal, client=client)
+    assert [r.ok for r in results] == [True, False, True]
+    assert (tmp_path / "a.java").read_text() == "CONVERT CLASS A"
+    lines = sorted((json.loads(line) for line in (tmp_path / wca_client.config.JOURNAL_FILE).read_text().splitlines()),
+                   key=lambda line: line["unit"])
+    assert [(line["unit"], line["status"]) for line in lines] == [("a.java", "done"), ("b.java", "failed"), ("c.java", "done")]
+
+    # A crash can leave a torn last line; a changed input reruns even though it was done
+    with open(tmp_path / wca_client.config.JOURNAL_FILE, "a") as file:
+        file.write('{"unit": "a.ja')
+    units[2] = ("c.java", "class C2")
+    client = ConvertingClient()
+    with wca_client.JobJournal(tmp_path, resume=True) as journal:
+        results = wca_client.call_units(units, prompt_for, save, journal=journal, client=client)
+        assert journal.skipped == 1
+    assert results[0] is None and results[1].ok and results[2].ok
+    assert sorted(client.prompts) == ["convert class B", "convert class C2"]
+
+    with wca_client.JobJournal(tmp_path, resume=False) as journal:
+        assert not journal.completed("a.java", lines[0]["input"], lines[0]["prompt"])
+
+def test_call_units_scope_keys_the_journal_not_the_pack_headers(tmp_path):
+    """Test that a scope prefixes journal entries while packed prompts name units by path only"""
+    units = [("model/A.java", "A"), ("model/B.java", "B")]
+    client = PackingClient(skip=None)
+    with wca_client.JobJournal(tmp_path) as journal:
+        results = wca_client.call_units(units, lambda content, packed=False: f"Convert this.\nSOURCE:\n{content}",
+                                         lambda index, text: None, journal=journal, pack=True, client=client,
+                                         scope="Converting Model")
+        assert sorted(journal.entries) == ["Converting Model:model/A.java", "Converting Model:model/B.java"]
+    assert [r.text for r in results] == ["```java\nconverted model/A.java\n```", "```java\nconverted model/B.java\n```"]
+    assert "--- file: model/A.java ---" in client.prompts[0] and "Converting Model" not in client.prompts[0]
+
+def test_response_cache_ttl_and_lru(tmp_path):
+    """Test that cached responses expire and the least recently used are evicted"""
+    cache = ResponseCache(str(tmp_path / "cache.sqlite3"), ttl=3600, max_bytes=10)
+    cache.put("a", "12345")
+    time.sleep(0.01)
+    cache.put("b", "12345")
+    time.sleep(0.01)
+    assert cache.get("a") == "12345"  # a is now more recently used than b
+    time.sleep(0.01)
+    cache.put("c", "12345")
+
+    assert cache.get("b") is None
+    assert cache.get("a") == "12345"
+    assert cache.get("c") == "12345"
+    assert cache.evictions == 1
+
+    cache.ttl = -1
+    assert cache.get("a") is None
+    assert cache.stats()["hits"] == 3
+
+def test_response_cache_key_covers_files(tmp_path):
+    """Test that the cache key changes with the endpoint, payload and attached bytes"""
+    source = tmp_path / "A.java"
+    source.write_text("class A {}")
+    payload = {"message_payload": {"messages": [{"content": "hi", "role": "USER"}]}}
+    key = response_cache_key("http://wca", payload, [str(source)])
+
+    assert key == response_cache_key("http://wca", dict(payload), [str(source)])
+    assert key != response_cache_key("http://other", payload, [str(source)])
+    source.write_text("class A { int x; }")
+    assert key != response_cache_key("http://wca", payload, [str(source)])
+
+def test_client_serves_repeat_requests_from_cache(chat_server, tmp_path, monkeypatch):
+    """Test that a cached response is replayed without another network call"""
+    monkeypatch.setattr(wca_client.cache, "_response_cache", ResponseCache(str(tmp_path / "cache.sqlite3")))
+    monkeypatch.setattr(wca_client.cache, "_response_cache_enabled", None)
+    payload = {"message_payload": {"messages": [{"content": "hi", "role": "USER"}]}}
+    with WCAClient(url=chat_server, apikey="key", token_cache=TokenCache(fetch=FakeIAM())) as client:
+        assert client.complete(payload) == "Hello world"
+        assert client.complete(payload) == "Hello world"
+        wca_client.configure_response_cache(refresh=True)
+        assert client.complete(payload) == "Hello world"
+
+    assert len(ChatHandler.connections) == 2
+    assert wca_client.cache._response_cache.stats()["hits"] == 1
+
+def test_stream_decoder_frames_split_chunks():
+    """Test that SSE and NDJSON frames split across arbitrary chunks decode the same"""
+    messages = [{"response": {"message": {"content": word}}} for word in ["Hé", "llo", " wörld"]]
+    ndjson = "".join(json.dumps(m, ensure_ascii=False) + "\n" for m in messages).encode()
+    sse = ("".join(f": keep-alive\nevent: delta\ndata: {json.dumps(m)}\n\n" for m in messages) + "data: [DONE]\n\n").encode()
+
+    for body in (ndjson, sse):
+        for size in (1, 3, 7, len(body)):
+            decoder = wca_client.StreamDecoder()
+            events = []
+            for start in range(0, len(body), size):
+                events.extend(decoder.feed(body[start:start + size]))
+            events.extend(decoder.flush())
+            assert "".join(e.content for e in events if e.type == wca_client.DELTA) == "Héllo wörld"
+            assert decoder.invalid == 0
+    assert events[-1].type == wca_client.DONE
+
+def test_stream_decoder_counts_invalid_frames():
+    """Test that malformed frames are reported instead of silently dropped"""
+    decoder = wca_client.StreamDecoder()
+    events = decoder.feed(b'{"response": {"message": {"content": "ok"}}}\n{"trunc\n{"metadata": {}}\n')
+    events += decoder.flush()
+
+    assert [e.type for e in events] == [wca_client.DELTA, wca_client.INVALID, wca_client.MESSAGE]
+    assert decoder.invalid == 1
+
+def test_limiter_grows_while_stable_and_cuts_on_throttle():
+    """Test AIMD: additive growth at stable latency, one multiplicative cut per overload"""
+    limiter = AdaptiveLimiter(initial=2, max_limit=8)
+    for _ in range(20):
+        with limiter, limiter:
+            limiter.on_success(0.1)
+    assert limiter.stats()["limit"] > 2
+
+    before = limiter.limit
+    limiter.on_throttle(retry_after=0.05)
+    limiter.on_throttle()  # same overload reported by another request in flight
+    assert limiter.limit == before / 2
+    assert limiter.pause_remaining() > 0
+    assert limiter.stats()["throttled"] == 2
+
+def test_client_retries_after_429(chat_server, monkeypatch):
+    """Test that a 429 with Retry-After is retried and cuts the concurrency limit"""
+    ChatHandler.throttle = 2
+    monkeypatch.setattr(wca_client.limiter, "BACKOFF_BASE", 0.01)  # the jitter added to Retry-After
+    limiter = AdaptiveLimiter(initial=4)
+    payload = {"message_payload": {"messages": [{"content": "hi", "role": "USER"}]}}
+    with WCAClient(url=chat_server, apikey="key", token_cache=TokenCache(fetch=FakeIAM()), limiter=limiter) as client:
+        assert client.complete(payload) == "Hello world"
+
+    stats = limiter.stats()
+    assert stats["throttled"] == 2 and stats["retries"] == 2
+    assert stats["limit"] < 4
+    assert stats["in_flight"] == 0
+
+def test_endpoint_pool_balances_ejects_and_probes():
+    """Test least-outstanding routing, throttle pauses, ejection and the probe back in"""
+    a, b = wca_client.Endpoint("http://a/chat", "ka"), wca_client.Endpoint("http://b/chat", "kb")
+    pool = wca_client.EndpointPool([a, b], eject_after=2, eject_seconds=0.2)
+    first, second = pool.acquire(), pool.acquire()
+    assert {first.endpoint, second.endpoint} == {a, b}
+    first.succeeded(0.1)
+    first.release()
+    third = pool.acquire()
+    assert third.endpoint is first.endpoint  # the one with no outstanding request
+    second.release()
+    third.release()
+
+    pool.acquire(exclude={b}).failed(throttled=True, retry_after=0.1)
+    other = pool.acquire()
+    assert other.endpoint is b  # a is paused until its Retry-After
+    other.release()
+    for _ in range(2):
+        pool.acquire(exclude={b}).failed()
+    assert a.ejections == 1 and not pool.available(exclude={b})
+
+    time.sleep(0.25)
+    probe = pool.acquire()
+    assert probe.endpoint is a and not pool.available(exclude={b})  # one probe at a time
+    probe.failed()
+    assert a.ejections == 2 and a.ejected_until - time.monotonic() > 0.3  # ejected for twice as long
+
+    fast, slow = wca_client.Endpoint("http://fast/chat"), wca_client.Endpoint("http://slow/chat")
+    fast.latency, slow.latency = 0.5, 2.0
+    ewma = wca_client.EndpointPool([slow, fast], strategy="ewma")
+    assert [ewma.acquire().endpoint for _ in range(4)] == [fast, fast, fast, slow]  # 0.5*4 > 2.0*1
+
+def test_endpoint_pool_waits_out_throttled_endpoints():
+    """Test that acquire sleeps until a paused or ejected endpoint is ready instead of sending to it"""
+    a, b = wca_client.Endpoint("http://a/chat"), wca_client.Endpoint("http://b/chat")
+    pool = wca_client.EndpointPool([a, b], eject_after=1, eject_seconds=0.3)
+    pool.acquire(exclude={b}).failed(throttled=True, retry_after=0.2)
+    pool.acquire(exclude={a}).failed()
+    assert 0.1 < pool.wait_remaining() <= 0.2
+
+    start = time.monotonic()
+    lease = pool.acquire()
+    assert lease.endpoint is a and time.monotonic() - start >= 0.15
+    lease.release()
+
+    pool.acquire(exclude={b}).failed(throttled=True, retry_after=0.2)
+
+    async def run():
+        start = time.monotonic()
+        lease = await pool.aacquire(exclude={a})
+        return lease, time.monotonic() - start
+
+    lease, elapsed = asyncio.run(run())
+    assert lease.endpoint is b and lease.endpoint.probing and elapsed >= 0.05
+
+def test_client_fails_over_across_pool(chat_server):
+    """Test that a pooled client retries on a healthy endpoint and reports per-endpoint stats"""
+    dead = wca_client.Endpoint("http://127.0.0.1:9/chat", "key", name="dead")
+    live = wca_client.Endpoint(chat_server, "key", name="live")
+    pool = wca_client.EndpointPool([dead, live], eject_after=2)
+    payload = {"message_payload": {"messages": [{"content": "hi", "role": "USER"}]}}
+    with WCAClient(pool=pool, token_cache=TokenCache(fetch=FakeIAM()), session=requests.Session(),
+                   coalesce=False) as client:
+        assert [client.complete(payload) for _ in range(4)] == ["Hello world"] * 4
+
+    assert len(ChatHandler.connections) == 4
+    assert dead.errors == 2 and dead.ejections == 1
+    stats = pool.stats()
+    assert [e["requests"] for e in stats["endpoints"]] == [2, 4]
+    assert stats["tokens"] == 8 and all(e["outstanding"] == 0 for e in stats["endpoints"])
+
+    iam = FakeIAM()
+
+    async def afetch(apikey):
+        return iam(apikey)
+
+    pool = wca_client.EndpointPool([wca_client.Endpoint(dead.url, "key"), wca_client.Endpoint(chat_server, "key")])
+
+    async def run():
+        async with AsyncWCAClient(pool=pool, token_cache=TokenCache(fetch=None, afetch=afetch), coalesce=False,
+                                  connect_retries=0) as client:
+            return [await client.achat(payload) for _ in range(2)]
+
+    assert asyncio.run(run()) == ["Hello world"] * 2
+    assert [e["outstanding"] for e in pool.stats()["endpoints"]] == [0, 0]
+
+def test_hedge_policy_percentile_and_budget():
+    """Test that the hedge delay follows recent latencies and hedges stay within budget"""
+    policy = HedgePolicy(percentile=90, budget=0.1, min_samples=10, default_delay=5)
+    assert policy.begin() == 5
+    for ttft in range(1, 11):
+        policy.observe(ttft / 10)
+    assert policy.begin() == 1.0
+
+    for _ in range(8):
+        policy.begin()
+    assert policy.try_hedge()
+    assert not policy.try_hedge()
+    assert policy.stats() == {"requests": 10, "hedges": 1, "wins": 0}
+
+def test_async_client_hedges_stalled_request(chat_server):
+    """Test that a request stuck before its first token is overtaken by a hedge"""
+    ChatHandler.stall = 1
+    hedge = HedgePolicy(budget=1, default_delay=0.1)
+    iam = FakeIAM()
+
+    async def afetch(apikey):
+        return iam(apikey)
+
+    payload = {"message_payload": {"messages": [{"content": "hi", "role": "USER"}]}}
+
+    async def run():
+        cache = TokenCache(fetch=None, afetch=afetch)
+        async with AsyncWCAClient(url=chat_server, apikey="key", token_cache=cache, hedge=hedge,
+                                  coalesce=False) as client:
+            start = time.monotonic()
+            parts, in_flight = [], []
+            async for content in client.astream(payload):
+                # Only the winner holds a slot once the first token is in
+                in_flight.append(client.limiter.stats()["in_flight"])
+                parts.append(content)
+            return "".join(parts), time.monotonic() - start, in_flight[0]
+
+    records = []
+    wca_client.add_metrics_sink(records.append)
+    try:
+        text, elapsed, in_flight = asyncio.run(run())
+    finally:
+        wca_client.remove_metrics_sink(records.append)
+    assert text == "Hello world"
+    assert elapsed < 1
+    # The winning duplicate is reported on its own as well as through the call's record
+    assert sorted((record.source, record.error) for record in records) == [("hedge", None), ("network", None)]
+    assert in_flight == 1
+    assert hedge.stats() == {"requests": 1, "hedges": 1, "wins": 1}
+
+def test_hedge_duplicate_gets_its_own_metrics(chat_server):
+    """Test that the duplicate request of a hedge is reported, as cancelled when it loses"""
+    ChatHandler.stall = 2  # both requests stall; the earlier one wins
+    ChatHandler.stall_seconds = 0.3
+    hedge = HedgePolicy(budget=1, default_delay=0.1)
+    iam = FakeIAM()
+
+    async def afetch(apikey):
+        return iam(apikey)
+
+    payload = {"message_payload": {"messages": [{"content": "hi", "role": "USER"}]}}
+
+    async def run():
+        cache = TokenCache(fetch=None, afetch=afetch)
+        async with AsyncWCAClient(url=chat_server, apikey="key", token_cache=cache, hedge=hedge,
+                                  coalesce=False) as client:
+            text = await client.achat(payload, request_id="hedged")
+            return text, client.limiter.stats()["in_flight"]
+
+    records = []
+    wca_client.add_metrics_sink(records.append)
+    try:
+        text, in_flight = asyncio.run(run())
+    finally:
+        wca_client.remove_metrics_sink(records.append)
+    assert text == "Hello world" and in_flight == 0
+    assert hedge.stats() == {"requests": 1, "hedges": 1, "wins": 0}
+    by_source = {record.source: record for record in records}
+    assert sorted(by_source) == ["hedge", "network"] and len(records) == 2
+    assert by_source["hedge"].error == "hedge_cancelled" and by_source["hedge"].request_id == "hedged"
+    assert by_source["network"].error is None and by_source["network"].hedged
+
+def test_multipart_body_matches_requests_encoding(tmp_path):
+    """Test that the streamed body is byte-identical to the in-memory form requests builds"""
+    source = tmp_path / "plan.xml"
+    source.write_bytes(bytes(range(256)) * 1000)
+    empty = tmp_path / "empty.sql"
+    empty.write_bytes(b"")
+    payload = {"message_payload": {"messages": [{"content": "hi", "role": "USER"}]}}
+    body = wca_client.MultipartBody(payload, [str(source), str(empty)])
+
+    files = [("message", (None, json.dumps(payload)))]
+    for path in (source, empty):
+        files.append(("files", (path.name, base64.b64encode(path.read_bytes()).decode(), "text/plain")))
+    prepared = requests.Request("POST", "http://wca", files=files).prepare()
+    boundary = prepared.headers["Content-Type"].split("boundary=")[1]
+    expected = prepared.body.replace(boundary.encode(), body.boundary.encode())
+
+    assert b"".join(body) == expected
+    assert len(body) == len(expected)
+    assert b"".join(iter(lambda: body.read(1000), b"")) == expected
+    body.seek(0)
+    assert body.read() + body.read() + b"".join(iter(body.read, b"")) == expected
+
+def test_identical_concurrent_requests_share_one_call(chat_server):
+    """Test that concurrent identical prompts are coalesced and each caller gets the full text"""
+    ChatHandler.stall = 1
+    ChatHandler.stall_seconds = 0.2  # long enough for the other callers to join
+    payload = {"message_payload": {"messages": [{"content": "hi", "role": "USER"}]}}
+    with WCAClient(url=chat_server, apikey="key", token_cache=TokenCache(fetch=FakeIAM())) as client:
+        results = call_many([payload] * 4, max_concurrency=4, client=client)
+    assert [r.text for r in results] == ["Hello world"] * 4
+    assert len(ChatHandler.connections) == 1
+
+    iam = FakeIAM()
+
+    async def afetch(apikey):
+        return iam(apikey)
+
+    async def run():
+        cache = TokenCache(fetch=None, afetch=afetch)
+        async with AsyncWCAClient(url=chat_server, apikey="key", token_cache=cache) as client:
+            return await asyncio.gather(*(client.achat(payload) for _ in range(4)))
+
+    ChatHandler.stall = 2
+    assert asyncio.run(run()) == ["Hello world"] * 4
+    assert len(ChatHandler.connections) == 2
+
+def test_call_metrics_reach_sinks(chat_server, tmp_path):
+    """Test that each call is timed and reported to the JSONL, registry and Prometheus sinks"""
+    records = []
+    registry = wca_client.MetricsRegistry()
+    sinks = [records.append, registry, wca_client.JsonlSink(str(tmp_path / "calls.jsonl")),
+             wca_client.PrometheusTextfileSink(str(tmp_path / "wca.prom"), registry)]
+    for sink in sinks:
+        wca_client.add_metrics_sink(sink)
+    try:
+        payload = {"message_payload": {"messages": [{"content": "hi", "role": "USER"}]}}
+        with WCAClient(url=chat_server, apikey="key", token_cache=TokenCache(fetch=FakeIAM())) as client:
+            client.complete(payload, request_id="first")
+            client.complete(payload, request_id="second")
+    finally:
+        for sink in sinks:
+            wca_client.remove_metrics_sink(sink)
+
+    first, second = records
+    assert (first.request_id, first.status, first.source, first.error) == ("first", 200, "network", None)
+    assert first.deltas == 2 and first.chars == len("Hello world")
+    assert first.connect > 0 and second.connect == 0  # the second call reuses the connection
+    assert 0 < first.headers <= first.ttft <= first.total
+    assert first.bytes_up == len(wca_client.MultipartBody(payload))
+    assert first.gaps.count == 1
+
+    lines = [json.loads(line) for line in (tmp_path / "calls.jsonl").read_text().splitlines()]
+    assert [line["request_id"] for line in lines] == ["first", "second"]
+    prom = (tmp_path / "wca.prom").read_text()
+    assert 'wca_calls_total{source="network",status="200",outcome="ok"} 2' in prom
+    assert 'wca_ttft_seconds_bucket{le="+Inf"} 2' in prom
+    assert "wca_output_tokens_total 4" in prom
+
+def test_stop_truncates_within_a_chunk():
+    """Test that deltas after the stop point are dropped even when they arrive in the same chunk"""
+    lines = [{"response": {"message": {"content": text}}} for text in ["```java\nclass A {}\n", "```", "\nMore text"]]
+
+    class OneChunk:
+        closed = False
+
+        def iter_content(self, chunk_size=None):
+            yield "".join(json.dumps(line) + "\n" for line in lines).encode()
+
+        def close(self):
+            self.closed = True
+
+    upstream = OneChunk()
+    response = wca_client.RecordingResponse(upstream, None, None, stop=wca_client.StopAtCodeBlock())
+    assert "".join(_iter_content(response)) == "```java\nclass A {}\n```"
+    assert response.stopped and upstream.closed
+
+def test_stream_renderer_batches_deltas():
+    """Test that streamed deltas are drawn in a few frames and files are not flushed per delta"""
+    from rich.console import Console
+    import io
+
+    out = io.StringIO()
+    renderer = wca_client.StreamRenderer(Console(file=out, width=200), fps=1)
+    for _ in range(500):
+        renderer.write("tok [b] ")
+    renderer.flush()
+    assert out.getvalue() == "tok [b] " * 500
+    assert renderer.frames == 2
+
+    # A stalled stream still shows what has arrived, on the renderer's timer
+    out = io.StringIO()
+    with wca_client.StreamRenderer(Console(file=out, width=200), fps=20) as renderer:
+        renderer.write("first ")
+        renderer.write("partial line")
+        time.sleep(0.2)
+        assert out.getvalue() == "first partial line"
+    assert renderer.frames == 2
+
+    class CountingFile(io.StringIO):
+        flushed = 0
+
+        def flush(self):
+            self.flushed += 1
+
+    file = CountingFile()
+    writer = wca_client.BufferedFileWriter(file, interval=60, max_bytes=1000)
+    for _ in range(500):
+        writer.write("token ")
+    writer.flush()
+    assert file.getvalue() == "token " * 500
+    assert file.flushed == writer.flushes == 3  # two at the size threshold, one at the end
+
+def test_stream_response_quiet(capsys):
+    """Test that quiet mode returns the text without rendering anything"""
+    response = wca_client.ReplayResponse("Hello quiet world")
+    assert wca_client.stream_response(response, quiet=True) == "Hello quiet world"
+    assert capsys.readouterr().out == ""
+
+def test_token_estimate_and_budget_helpers(monkeypatch):
+    """Test the local token estimate and trimming, chunking and refusing prompts to a budget"""
+    monkeypatch.setattr(wca_client.budget, "_tokenizer", False)
+    estimate = wca_client.estimate_tokens
+    assert estimate("") == 0
+    assert estimate("x" * 35) == 10
+    assert estimate("設定檔案") == 4
+    assert estimate("ab設定") == 3
+
+    text = "".join(f"line {n}\n" for n in range(100))
+    trimmed = wca_client.trim_to_budget(text, 50)
+    assert trimmed.startswith("line 0\nline 1\n")
+    assert "more lines trimmed to fit the prompt budget" in trimmed
+    assert estimate(trimmed) <= 50
+    assert wca_client.trim_to_budget("short", 50) == "short"
+
+    chunks = wca_client.chunk_to_budget(text, 50)
+    assert len(chunks) > 1 and "".join(chunks) == text
+    assert all(estimate(chunk) <= 50 for chunk in chunks)
+    long_line = "x = 1; " * 200 + "\n" + "設定" * 80 + "\nend\n"
+    chunks = wca_client.chunk_to_budget(long_line, 50)
+    assert "".join(chunks) == long_line
+    assert all(estimate(chunk) <= 50 for chunk in chunks)
+
+    assert wca_client.check_prompt("small prompt", limit=10) == "small prompt"
+    with pytest.raises(wca_client.PromptTooLarge, match="over the 10-token prompt budget"):
+        wca_client.check_prompt("x" * 100, limit=10)
+
+def test_dry_run_counts_tokens_without_sending(chat_server, monkeypatch):
+    """Test that dry-run mode only estimates usage, and real calls add their output tokens"""
+    usage = wca_client.TokenUsage()
+    monkeypatch.setattr(wca_client.client, "token_usage", usage)
+    monkeypatch.setattr(wca_client.metrics, "_metrics_sinks", [usage])
+    monkeypatch.setattr(wca_client.budget, "_dry_run", True)
+    payload = {"message_payload": {"messages": [{"content": f"dry run {time.time()}", "role": "USER"}]}}
+    with WCAClient(url=chat_server, apikey="key", token_cache=TokenCache(fetch=FakeIAM()), coalesce=False) as client:
+        assert client.complete(payload) == ""
+        assert ChatHandler.connections == []
+        assert (usage.requests, usage.output_tokens) == (1, 0)
+        assert usage.prompt_tokens == wca_client.estimate_payload_tokens(payload)
+
+        wca_client.configure_budget(dry_run=False)
+        assert client.complete(payload) == "Hello world"
+    assert (usage.requests, usage.output_tokens) == (2, 2)
+    assert usage.prompt_tokens == 2 * wca_client.estimate_payload_tokens(payload)
+
+def test_daemon_client_retries_requests_dropped_before_output(chat_server, tmp_path):
+    """Test that a request the daemon drops before any output is sent again in-process, and later drops are not"""
+    import socket
+
+    path = str(tmp_path / "wca.sock")
+    header = json.dumps({"status": 200, "source": "network"}).encode() + b"\n"
+    delta = json.dumps({"delta": "Hello"}).encode() + b"\n"
+    # What the dying daemon sends before closing each connection
+    replies = [b"", header, header + delta, b"", header + delta]
+    listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    listener.bind(path)
+    listener.listen()
+
+    def serve():
+        for reply in replies:
+            conn, _ = listener.accept()
+            with conn, conn.makefile("rb") as reader:
+                reader.readline()
+                conn.sendall(reply)
+
+    threading.Thread(target=serve, daemon=True).start()
+    payload = {"message_payload": {"messages": [{"content": "hi", "role": "USER"}]}}
+    direct = WCAClient(url=chat_server, apikey="key", token_cache=TokenCache(fetch=FakeIAM()),
+                       session=requests.Session(), coalesce=False)
+    fallbacks = []
+
+    def fallback():
+        fallbacks.append(direct)
+        return direct
+
+    try:
+        with wca_client.DaemonClient(path, fallback=fallback) as remote:
+            assert remote.complete(payload) == "Hello world"  # closed before the header
+            remote.direct = None  # back to the daemon for the next case
+            assert remote.complete(payload) == "Hello world"  # closed after the header
+            remote.direct = None
+            with pytest.raises(wca_client.DaemonDropped):
+                remote.complete(payload)  # a delta already reached the caller
+        assert len(fallbacks) == 2 and len(ChatHandler.connections) == 2
+
+        remote = wca_client.DaemonClient(path)
+        for _ in range(2):
+            with pytest.raises(wca_client.DaemonDropped):
+                remote.complete(payload)
+    finally:
+        listener.close()
+
+def test_daemon_serves_clients_over_unix_socket(chat_server, tmp_path, monkeypatch):
+    """Test that DaemonClients share the daemon's client and limiter, including stops and errors"""
+    path = str(tmp_path / "wca.sock")
+    limiter = AdaptiveLimiter(initial=2)
+    client = WCAClient(url=chat_server, apikey="key", token_cache=TokenCache(fetch=FakeIAM()), limiter=limiter,
+                       session=requests.Session(), coalesce=False)
+    with wca_client.WCADaemon(path, client) as daemon:
+        threading.Thread(target=daemon.serve_forever, daemon=True).start()
+        remote = wca_client.DaemonClient(path)
+        payloads = [{"message_payload": {"messages": [{"content": f"hi {n}", "role": "USER"}]}} for n in range(4)]
+        assert list(remote.stream(payloads[0])) == ["Hello", " world"]
+        assert [r.text for r in call_many(payloads, max_concurrency=4, client=remote)] == ["Hello world"] * 4
+        assert remote.complete(payloads[0], stop=lambda text: "Hello" in text) == "Hello"
+
+        ChatHandler.throttle = len(ChatHandler.connections) + 1
+        client.max_retries = 0
+        with pytest.raises(wca_client.DaemonError) as error:
+            remote.complete(payloads[1])
+        assert error.value.status == 429
+
+        deadline = time.time() + 5
+        while wca_client.daemon_stats(path)["active"] and time.time() < deadline:
+            time.sleep(0.01)
+        stats = wca_client.daemon_stats(path)
+        assert stats["requests"] == 7 and stats["active"] == 0
+        assert stats["limiter"]["in_flight"] == 0
+
+        monkeypatch.setenv("WCA_DAEMON", path)
+        monkeypatch.setattr(wca_client.client, "_default_client", None)
+        assert isinstance(wca_client.get_client(), wca_client.DaemonClient)
+        with pytest.raises(RuntimeError, match="already listening"):
+            wca_client.WCADaemon(path)
+
+    assert wca_client.daemon_stats(path) is None
+    assert not Path(path).exists()
+
+    # Once the daemon is gone, requests go straight to WCA instead of failing
+    with pytest.raises(wca_client.DaemonError, match="No WCA daemon answering"):
+        remote.complete(payloads[0])
+    ChatHandler.throttle = 0
+    direct = WCAClient(url=chat_server, apikey="key", token_cache=TokenCache(fetch=FakeIAM()),
+                       session=requests.Session(), coalesce=False)
+    with wca_client.DaemonClient(path, fallback=lambda: direct) as remote:
+        assert remote.complete(payloads[0]) == "Hello world"
+        assert remote.direct is direct
+        assert list(remote.stream(payloads[1])) == ["Hello", " world"]
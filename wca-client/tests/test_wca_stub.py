@@ -0,0 +1,233 @@
+import asyncio
+import time
+import pytest
+import requests
+from pathlib import Path
+import sys
+
+# Add parent directory to Python path
+sys.path.append(str(Path(__file__).parent.parent))
+
+import wca_client
+from wca_client import WCAClient, TokenCache
+from wca_client.auth import _request_iam_token
+from wca_client.stream import _iter_content
+from wca_stub import start_stub
+
+PAYLOAD = {"message_payload": {"messages": [{"content": "Explain this code", "role": "USER"}]}}
+
+@pytest.fixture
+def stub():
+    server = start_stub(ttft=0, tokens_per_sec=0, echo=True)
+    yield server
+    server.shutdown()
+
+def test_stub_selected_through_environment(stub, monkeypatch):
+    """Test that BASE_URL and IAM_URL route both token and chat calls to the stub"""
+    monkeypatch.setenv("BASE_URL", stub.chat_url)
+    monkeypatch.setenv("IAM_URL", stub.iam_url)
+    with WCAClient(apikey="key", token_cache=TokenCache()) as client:
+        assert client.complete(PAYLOAD) == "Explain this code"
+        assert client.complete(PAYLOAD, request_id="again") == "Explain this code"
+
+    stats = requests.get(f"{stub.base_url}/stats").json()
+    assert stats["token_requests"] == 1
+    assert stats["chat_requests"] == 2
+
+def test_stub_ttft_and_sse(stub):
+    """Test that the configured time to first token and SSE framing reach the client"""
+    stub.ttft = 0.2
+    stub.sse = True
+    stub.echo = False
+    stub.response = "one two three"
+    records = []
+    wca_client.add_metrics_sink(records.append)
+    try:
+        with WCAClient(url=stub.chat_url, apikey="key", token_cache=TokenCache(fetch=lambda key: ("t", 1e12))) as client:
+            assert list(client.stream(PAYLOAD)) == ["one", " two", " three"]
+    finally:
+        wca_client.remove_metrics_sink(records.append)
+    assert records[0].ttft >= 0.2
+
+def test_stub_injects_errors(stub, monkeypatch):
+    """Test that injected 503s are retried and finally surfaced as HTTP errors"""
+    monkeypatch.setattr(wca_client.limiter, "BACKOFF_BASE", 0.01)  # the jitter added to Retry-After
+    stub.error_rate = 1
+    stub.errors = (503,)
+    stub.retry_after = 0
+    limiter = wca_client.AdaptiveLimiter()
+    with WCAClient(url=stub.chat_url, apikey="key", token_cache=TokenCache(fetch=lambda key: ("t", 1e12)),
+                   limiter=limiter, max_retries=1) as client:
+        with pytest.raises(requests.exceptions.HTTPError):
+            client.complete(PAYLOAD)
+
+    assert stub.stats["errors"] == 2
+    assert limiter.stats()["throttled"] == 2
+
+def test_cassette_records_and_replays_offline(stub, tmp_path):
+    """Test that a recorded session replays without the server, fast or at recorded speed"""
+    stub.tokens_per_sec = 20
+    path = str(tmp_path / "session.jsonl.gz")
+    recorder = wca_client.Cassette(path, "record")
+    cache = TokenCache(fetch=lambda key: _request_iam_token(key, iam_url=stub.iam_url))
+    with WCAClient(url=stub.chat_url, apikey="key", token_cache=cache, cassette=recorder) as client:
+        assert client.complete(PAYLOAD) == "Explain this code"
+    assert recorder.recorded == 1
+    stub.shutdown()
+
+    replay = wca_client.Cassette(path, "replay")
+    with WCAClient(url=stub.chat_url, apikey="key", token_cache=TokenCache(fetch=None), cassette=replay) as client:
+        start = time.monotonic()
+        assert client.complete(PAYLOAD) == "Explain this code"
+        assert time.monotonic() - start < 0.05
+        with pytest.raises(wca_client.CassetteMiss):
+            client.complete({"message_payload": {"messages": [{"content": "other", "role": "USER"}]}})
+
+    replay = wca_client.Cassette(path, "replay", speed=1)
+    with WCAClient(url=stub.chat_url, apikey="key", token_cache=TokenCache(fetch=None), cassette=replay) as client:
+        start = time.monotonic()
+        assert client.complete(PAYLOAD) == "Explain this code"
+        assert time.monotonic() - start >= 0.1  # three tokens at 20/s
+
+def test_cassette_skips_streams_closed_early(stub, tmp_path):
+    """Test that a stream stopped before its end is not recorded as a truncated answer"""
+    stub.tokens_per_sec = 50
+    path = str(tmp_path / "session.jsonl.gz")
+    recorder = wca_client.Cassette(path, "record")
+    with WCAClient(url=stub.chat_url, apikey="key", token_cache=TokenCache(fetch=lambda key: ("t", 1e12)),
+                   cassette=recorder) as client:
+        assert client.complete(PAYLOAD, stop=lambda text: "Explain" in text) == "Explain"
+        assert recorder.recorded == 0
+        assert client.complete(PAYLOAD) == "Explain this code"
+    assert recorder.recorded == 1
+
+    replay = wca_client.Cassette(path, "replay")
+    with WCAClient(url=stub.chat_url, apikey="key", token_cache=TokenCache(fetch=None), cassette=replay) as client:
+        assert client.complete(PAYLOAD) == "Explain this code"
+
+def test_stop_conditions_match_incrementally():
+    """Test that the built-in stop conditions fire on the delta that completes the artifact"""
+    def first_match(stop, deltas):
+        feed = stop.matcher()
+        return next((index for index, delta in enumerate(deltas) if feed(delta)), None)
+
+    deltas = ["Here you go:\n``", "`java\nclass A {}\n", "``", "`\n", "Explanation..."]
+    assert first_match(wca_client.StopAtCodeBlock(), deltas) == 3
+    assert first_match(wca_client.StopAtCodeBlock("html"), deltas) is None
+    assert first_match(wca_client.StopAtJsonObject(), ['Result: {"a": "}', '", "b": {"c": 1}', "} trailing"]) == 2
+    assert first_match(wca_client.as_stop_condition(lambda text: "END" in text), ["E", "N", "D"]) == 2
+
+def test_stop_condition_closes_stream_early(stub):
+    """Test that a matched stop condition drops the stream, for sync and async callers"""
+    stub.echo = False
+    stub.tokens_per_sec = 50
+    stub.response = "```java\nclass A {}\n```\n" + "Some long explanation. " * 50
+    cache = TokenCache(fetch=lambda key: _request_iam_token(key, iam_url=stub.iam_url))
+    stop = wca_client.StopAtCodeBlock("java")
+    with WCAClient(url=stub.chat_url, apikey="key", token_cache=cache) as client:
+        start = time.monotonic()
+        assert client.complete(PAYLOAD, stop=stop) == "```java\nclass A {}\n```"
+        assert time.monotonic() - start < 1
+
+    async def afetch(apikey):
+        return _request_iam_token(apikey, iam_url=stub.iam_url)
+
+    async def run():
+        async with wca_client.AsyncWCAClient(url=stub.chat_url, apikey="key",
+                                              token_cache=TokenCache(fetch=None, afetch=afetch)) as client:
+            return await client.achat(PAYLOAD, stop=stop)
+
+    assert asyncio.run(run()) == "```java\nclass A {}\n```"
+    time.sleep(0.2)
+    stats = requests.get(f"{stub.base_url}/stats").json()
+    assert stats["disconnects"] == 2
+    assert stats["tokens"] < 20
+
+def test_async_client_is_bounded_by_the_adaptive_limit(stub):
+    """Test that async requests take limiter slots, so the AIMD limit bounds them and grows with their successes"""
+    stub.ttft = 0.05
+    limiter = wca_client.AdaptiveLimiter(initial=2, max_limit=3)
+    peak = 0
+
+    async def run():
+        nonlocal peak
+
+        async def watch():
+            nonlocal peak
+            while True:
+                peak = max(peak, stub.active)
+                await asyncio.sleep(0.005)
+
+        async with wca_client.AsyncWCAClient(url=stub.chat_url, apikey="key", limiter=limiter, coalesce=False,
+                                              token_cache=TokenCache(fetch=lambda key: ("t", 1e12))) as client:
+            watcher = asyncio.create_task(watch())
+            texts = await asyncio.gather(*(
+                client.achat({"message_payload": {"messages": [{"content": f"n {n}", "role": "USER"}]}})
+                for n in range(12)
+            ))
+            watcher.cancel()
+            return texts
+
+    assert asyncio.run(run()) == [f"n {n}" for n in range(12)]
+    stats = limiter.stats()
+    assert 2 <= peak <= 3
+    assert stats["successes"] == 12 and stats["in_flight"] == 0
+    assert stats["limit"] == 3
+
+def test_coalesced_callers_outlive_the_leader(stub):
+    """Test that a coalesced request keeps streaming to followers after its leader leaves early"""
+    stub.echo = False
+    stub.ttft = 0.05
+    stub.tokens_per_sec = 100
+    stub.response = "one two three four five six seven eight"
+    token_cache = TokenCache(fetch=lambda key: ("t", 1e12))
+
+    with WCAClient(url=stub.chat_url, apikey="key", token_cache=token_cache) as client:
+        leader, follower = client.chat(PAYLOAD), client.chat(PAYLOAD)
+        deltas = _iter_content(leader)
+        assert next(deltas) == "one"
+        deltas.close()
+        leader.close()
+        assert "".join(_iter_content(follower)) == stub.response
+
+        # A leader response dropped unread still serves its followers
+        leader, follower = client.chat(PAYLOAD, request_id="again"), client.chat(PAYLOAD)
+        del leader
+        assert follower.text == stub.response
+    assert stub.stats["chat_requests"] == 2
+
+    async def run():
+        async with wca_client.AsyncWCAClient(url=stub.chat_url, apikey="key", token_cache=token_cache) as client:
+            first = asyncio.Event()
+
+            async def leave_after_first_delta():
+                async for _ in client.astream(PAYLOAD):
+                    first.set()
+                    await asyncio.sleep(10)
+
+            leader = asyncio.create_task(leave_after_first_delta())
+            follower = asyncio.create_task(client.achat(PAYLOAD))
+            await first.wait()
+            leader.cancel()
+            text = await follower
+
+            # With no one left the shared request is cancelled
+            alone = asyncio.create_task(leave_after_first_delta())
+            first.clear()
+            await first.wait()
+            alone.cancel()
+            await asyncio.sleep(0.1)
+            return text
+
+    assert asyncio.run(run()) == stub.response
+    assert stub.stats["chat_requests"] == 4
+    assert stub.stats["disconnects"] == 1
+
+def test_flight_replay_gives_up_without_progress():
+    """Test that followers of a leader that never reads fail instead of waiting forever"""
+    flight = wca_client.Flight(timeout=0.05)
+    flight.publish("partial")
+    replay = flight.replay()
+    assert next(replay) == "partial"
+    with pytest.raises(wca_client.FlightAbandoned, match="sent nothing"):
+        next(replay)
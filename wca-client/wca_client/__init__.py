@@ -0,0 +1,41 @@
+"""Client for the IBM watsonx Code Assistant (WCA) chat API, shared by the WCA tools.
+
+Importing the package is cheap: the HTTP stack (requests/urllib3, httpx),
+asyncio and rich.markdown are imported where they are first used, so the CLIs
+built on it start (and print --help) without loading them. The typer commands
+live in ``wca_client.cli`` and are only imported by the CLIs.
+"""
+from .config import (
+    DEFAULT_BASE_URL, DEFAULT_CONCURRENCY, DEFAULT_DAEMON_SOCKET, DEFAULT_POOL_SIZE, IAM_APIKEY,
+    MAX_IN_FLIGHT, PROMPT_TOKEN_LIMIT, RESPONSE_CACHE_TTL,
+)
+from .async_client import AsyncWCAClient, get_async_client
+from .auth import AuthenticationError, TokenCache, aget_bearer_token, akeep_token_fresh, get_bearer_token, invalidate_bearer_token
+from .batch import (
+    PACK_HEADER, PACK_INSTRUCTIONS, CallResult, call_many, call_packed, call_units, format_packed,
+    pack_files, split_packed,
+)
+from .budget import (
+    TRIM_MARKER, PromptTooLarge, TokenUsage, check_prompt, chunk_to_budget, configure_budget,
+    estimate_payload_tokens, estimate_tokens, is_dry_run, print_token_usage, prompt_budget,
+    token_usage, trim_to_budget,
+)
+from .cache import ResponseCache, configure_response_cache, get_response_cache, print_cache_stats, response_cache_key
+from .cassette import Cassette, CassetteMiss, CassetteRecorder, CassetteResponse, get_cassette
+from .client import WCAClient, call_wca_api, get_client
+from .daemon import DaemonClient, DaemonDropped, DaemonError, DaemonResponse, WCADaemon, daemon_socket, daemon_stats, serve_daemon
+from .hedge import HedgePolicy, get_hedge_policy
+from .journal import JobJournal, content_hash
+from .limiter import AdaptiveLimiter, get_limiter, print_limiter_stats
+from .metrics import (
+    CallMetrics, Histogram, JsonlSink, MetricsRegistry, PrometheusTextfileSink, add_metrics_sink,
+    metrics_registry, remove_metrics_sink,
+)
+from .pool import Endpoint, EndpointLease, EndpointPool, get_endpoint_pool, print_pool_stats
+from .render import BufferedFileWriter, StreamRenderer, configure_output, format_as_markdown, stream_response
+from .responses import AsyncFlight, Flight, FlightAbandoned, FlightResponse, RecordingResponse, ReplayResponse, SingleFlight
+from .stream import (
+    DELTA, DONE, INVALID, MESSAGE, StopAtCodeBlock, StopAtJsonObject, StopCondition, StopWhen,
+    StreamDecoder, StreamEvent, as_stop_condition, iter_events,
+)
+from .transport import MultipartBody, create_session, get_session
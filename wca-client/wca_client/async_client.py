@@ -0,0 +1,458 @@
+"""The asyncio WCA chat client."""
+import os
+import time
+import weakref
+from collections import namedtuple
+
+from .console import console
+from .config import (
+    COALESCE, DEFAULT_BASE_URL, DEFAULT_CONNECT_TIMEOUT, DEFAULT_MAX_RETRIES,
+    DEFAULT_POOL_SIZE, DEFAULT_READ_TIMEOUT, THROTTLE_RETRIES, THROTTLE_STATUSES,
+)
+from .auth import _arequest_iam_token, _request_iam_token, _resolve_apikey, _token_cache
+from .budget import is_dry_run, token_usage
+from .cache import response_cache_key
+from .cassette import _replay_cassette, get_cassette
+from .client import _sharing
+from .hedge import get_hedge_policy
+from .limiter import _limiter
+from .metrics import CallMetrics, _record_replay
+from .pool import _failover, get_endpoint_pool
+from .responses import AsyncFlight, SingleFlight
+from .stream import DELTA, StreamDecoder, as_stop_condition
+from .transport import MultipartBody, _chat_headers, _retry_after
+
+# An opened chat stream, read up to its first content delta
+_OpenStream = namedtuple('_OpenStream', ['response', 'decoder', 'chunks', 'first', 'ttft', 'metrics', 'lease'])
+
+class AsyncWCAClient:
+    """Asyncio counterpart of WCAClient built on ``httpx.AsyncClient``.
+
+    Use it from event-loop code (FastAPI handlers) so a slow generation only
+    suspends its own task. ``astream`` is an async generator of content deltas.
+    With a HedgePolicy (``hedge=`` or ``WCA_HEDGE=1``) a request that is slow
+    to produce its first token is raced against a duplicate, which an
+    EndpointPool (see WCAClient) sends to the least loaded endpoint.
+    """
+
+    def __init__(self, url=None, apikey=None, client=None, token_cache=None,
+                 timeout=(DEFAULT_CONNECT_TIMEOUT, DEFAULT_READ_TIMEOUT), pool_size=DEFAULT_POOL_SIZE,
+                 limiter=None, max_retries=THROTTLE_RETRIES, hedge=None, coalesce=COALESCE, cassette=None,
+                 pool=None, connect_retries=DEFAULT_MAX_RETRIES):
+        import httpx
+
+        if pool is None and url is None and apikey is None:
+            pool = get_endpoint_pool()
+        self.pool = pool
+        self.url = url or (pool.endpoints[0].url if pool else os.getenv("BASE_URL", DEFAULT_BASE_URL))
+        self.apikey = apikey
+        self.token_cache = token_cache or _token_cache
+        self.limiter = limiter or _limiter
+        self.max_retries = max_retries
+        self.hedge = hedge or get_hedge_policy()
+        # Per client, and so per event loop
+        self.flights = SingleFlight(AsyncFlight) if coalesce else None
+        self._pumps = set()
+        self.cassette = cassette or get_cassette()
+        connect_timeout, read_timeout = timeout
+        self.client = client or httpx.AsyncClient(
+            timeout=httpx.Timeout(read_timeout, connect=connect_timeout),
+            limits=httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size),
+            transport=httpx.AsyncHTTPTransport(retries=connect_retries),
+        )
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.aclose()
+
+    async def aclose(self):
+        """Close all pooled connections."""
+        await self.client.aclose()
+
+    def _afetch(self):
+        # A TokenCache built with its own blocking ``fetch`` keeps it: aget then
+        # runs it in a worker thread instead of calling IAM over httpx
+        if self.token_cache.afetch or self.token_cache._fetch is not _request_iam_token:
+            return self.token_cache.afetch
+        return lambda key: _arequest_iam_token(key, self.client)
+
+    async def _token(self, apikey=None):
+        apikey = _resolve_apikey(apikey or self.apikey)
+        return await self.token_cache.aget(apikey, afetch=self._afetch())
+
+    async def keep_token_fresh(self, apikey=None, retry=30.0):
+        """Refresh the bearer token ahead of expiry until cancelled.
+
+        Run it as a background task in a long-lived service: request handlers
+        then always find a valid token in the cache. A failed refresh is
+        retried after ``retry`` seconds.
+        """
+        import asyncio
+
+        apikey = _resolve_apikey(apikey or self.apikey)
+        afetch = self._afetch()
+        while True:
+            try:
+                expires_at = await self.token_cache.arefresh(apikey, afetch)
+                lifetime = expires_at - time.time()
+                # Half way through a token shorter-lived than the refresh margin
+                delay = max(lifetime - self.token_cache._refresh_margin, lifetime / 2)
+            except Exception as e:
+                console.print(f"[yellow]IAM token refresh failed: {e}; retrying in {retry:.0f}s[/yellow]")
+                delay = retry
+            await asyncio.sleep(delay)
+
+    async def _send(self, url, payload, files, request_id, apikey, metrics=None):
+        import asyncio
+        import httpx
+
+        metrics = metrics or CallMetrics(url, request_id)
+        if self.cassette is not None:
+            key = response_cache_key(url, payload, files)
+            if self.cassette.mode == 'replay':
+                return _replay_cassette(self.cassette, key, metrics)
+        pooled = self.pool is not None and url == self.url
+        target, credential = url, apikey
+        body = MultipartBody(payload, files)
+        metrics.bytes_up = len(body)
+        refreshed = False
+        attempt = 0
+        lease = None
+        tried = set()
+        while True:
+            pause = self.limiter.pause_remaining()
+            if pause:
+                await asyncio.sleep(pause)
+            if pooled:
+                lease = await self.pool.aacquire(exclude=tried)
+                target, credential = lease.endpoint.url, lease.endpoint.apikey or apikey
+                metrics.endpoint = lease.endpoint.name
+            try:
+                token_start = time.perf_counter()
+                headers = _chat_headers(await self._token(credential), request_id)
+                metrics.token += time.perf_counter() - token_start
+            except BaseException:
+                if lease:
+                    lease.release()
+                raise
+            headers['Content-Type'] = body.content_type
+            headers['Content-Length'] = str(len(body))
+            request = self.client.build_request('POST', target, headers=headers, content=body.aiter(),
+                                                extensions={'trace': metrics.atrace})
+            start = time.monotonic()
+            try:
+                response = await self.client.send(request, stream=True)
+            except httpx.TimeoutException:
+                if _failover(lease, tried) and attempt < self.max_retries:
+                    attempt += 1
+                    metrics.retries += 1
+                    continue
+                self.limiter.on_throttle(timeout=True)
+                if attempt >= self.max_retries:
+                    raise
+                await asyncio.sleep(self.limiter.retry_delay(attempt))
+                attempt += 1
+                metrics.retries += 1
+                continue
+            except httpx.TransportError:
+                if _failover(lease, tried) and attempt < self.max_retries:
+                    attempt += 1
+                    metrics.retries += 1
+                    continue
+                raise
+            except BaseException:
+                if lease:
+                    lease.release()
+                raise
+            metrics.status = response.status_code
+            if response.status_code == 401 and not refreshed:
+                # The cached token may have been revoked; retry once with a fresh one
+                if lease:
+                    lease.release()
+                await response.aclose()
+                self.token_cache.invalidate(_resolve_apikey(credential or self.apikey))
+                refreshed = True
+                continue
+            if response.status_code in THROTTLE_STATUSES:
+                retry_after = _retry_after(response.headers)
+                if attempt < self.max_retries and _failover(lease, tried, throttled=True, retry_after=retry_after):
+                    await response.aclose()
+                    attempt += 1
+                    metrics.retries += 1
+                    continue
+                self.limiter.on_throttle(retry_after)
+                if attempt < self.max_retries:
+                    await response.aclose()
+                    await asyncio.sleep(self.limiter.retry_delay(attempt, retry_after))
+                    attempt += 1
+                    metrics.retries += 1
+                    continue
+            break
+
+        if response.status_code >= 400:
+            if lease:
+                lease.rejected(response.status_code)
+            await response.aread()
+            await response.aclose()
+            console.print(f"[red]Error {response.status_code}: {response.text}[/red]")
+            response.raise_for_status()
+        self.limiter.on_success(time.monotonic() - start)
+        metrics.headers = metrics.elapsed()
+        if lease:
+            # Released when the call's metrics finish, after the stream
+            lease.succeeded(time.monotonic() - start)
+            metrics.lease = lease
+        if self.cassette is not None:
+            return self.cassette.recorder(response, key, url, start)
+        return response
+
+    async def astream(self, payload, files=(), url=None, request_id=None, apikey=None, stop=None):
+        """Send a chat request and asynchronously yield content deltas.
+
+        Concurrent identical requests share one upstream call; each caller
+        receives the full stream. With a ``stop`` condition the stream ends,
+        and the connection is dropped, at the delta where it matched. In
+        dry-run mode a miss only counts the request's tokens and yields nothing.
+        """
+        url = url or self.url
+        stop = as_stop_condition(stop)
+        metrics = CallMetrics(url, request_id)
+        cache, flights, key = _sharing(self.flights, url, payload, files, stop)
+        if cache is not None and not cache.refresh:
+            text = cache.get(key)
+            if text is not None:
+                _record_replay(metrics, text)
+                yield text
+                return
+        if is_dry_run():
+            token_usage.add_request(payload, files)
+            return
+
+        flight = None
+        leader = True
+        if flights is not None:
+            flight, leader = flights.join(key)
+        matches = None
+        if flight is None:
+            token_usage.add_request(payload, files)
+            deltas = self._stream_deltas((url, payload, files, request_id, apikey, metrics))
+            matches = stop.matcher() if stop is not None else None
+        elif leader:
+            # The pump task owns the upstream request and its metrics; this
+            # caller reads it like the others, so leaving early cancels nothing
+            flight.subscribe()
+            token_usage.add_request(payload, files)
+            self._pump(flight, (url, payload, files, request_id, apikey, metrics), stop, cache, key)
+            deltas = flight.areplay()
+        else:
+            metrics.source = 'coalesced'
+            deltas = flight.areplay()
+        own_metrics = flight is None or not leader
+
+        parts = []
+        try:
+            async for content in deltas:
+                if own_metrics:
+                    metrics.delta(content)
+                if flight is None:
+                    parts.append(content)
+                yield content
+                if matches is not None and matches(content):
+                    metrics.stopped = True
+                    break
+        except BaseException as e:
+            if own_metrics:
+                metrics.finish(e)
+            raise
+        finally:
+            await deltas.aclose()
+            if flight is not None:
+                flight.unsubscribe()
+        if not own_metrics:
+            return
+        if flight is not None:
+            metrics.status = 200
+        metrics.finish()
+        if flight is None and cache is not None and parts:
+            cache.put(key, "".join(parts))
+
+    def _pump(self, flight, args, stop, cache, key):
+        import asyncio
+
+        flight.pump = asyncio.ensure_future(self._run_pump(flight, args, stop, cache, key))
+        # The event loop only keeps weak references to tasks
+        self._pumps.add(flight.pump)
+        flight.pump.add_done_callback(self._pumps.discard)
+
+    async def _run_pump(self, flight, args, stop, cache, key):
+        """Read a coalesced request's stream into its flight.
+
+        Runs as its own task, so the request survives any one subscriber
+        being cancelled; it is cancelled when the last subscriber leaves.
+        """
+        metrics = args[-1]
+        matches = stop.matcher() if stop is not None else None
+        deltas = self._stream_deltas(args)
+        parts = []
+        try:
+            async for content in deltas:
+                metrics.delta(content)
+                parts.append(content)
+                flight.publish(content)
+                if matches is not None and matches(content):
+                    metrics.stopped = True
+                    break
+        except Exception as e:
+            # Delivered to the subscribers by the flight
+            flight.finish(e)
+            metrics.finish(e)
+            return
+        except BaseException as e:
+            flight.finish(e)
+            metrics.finish(e)
+            raise
+        finally:
+            await deltas.aclose()
+        metrics.finish()
+        flight.finish()
+        if cache is not None and parts:
+            cache.put(key, "".join(parts))
+
+    async def _stream_deltas(self, args):
+        if self.hedge is None:
+            stream = await self._open(*args)
+        else:
+            stream = await self._open_hedged(args)
+        decoder = stream.decoder
+        try:
+            for content in stream.first:
+                yield content
+            async for chunk in stream.chunks:
+                for event in decoder.feed(chunk):
+                    if event.type == DELTA:
+                        yield event.content
+            for event in decoder.flush():
+                if event.type == DELTA:
+                    yield event.content
+        finally:
+            await self._close_stream(stream)
+
+    async def _close_stream(self, stream):
+        try:
+            await stream.response.aclose()
+        finally:
+            self.limiter.release()
+
+    async def _open(self, url, payload, files, request_id, apikey, metrics=None):
+        """Send a chat request and read it up to the first content delta.
+
+        Takes a slot of the adaptive concurrency limit, held until the stream
+        is closed (see _close_stream).
+        """
+        start = time.monotonic()
+        metrics = metrics or CallMetrics(url, request_id)
+        await self.limiter.aacquire()
+        try:
+            response = await self._send(url, payload, files, request_id, apikey, metrics)
+        except BaseException:
+            self.limiter.release()
+            raise
+        lease = metrics.lease
+        decoder = StreamDecoder()
+        chunks = response.aiter_bytes()
+        first = []
+        try:
+            async for chunk in chunks:
+                first = [event.content for event in decoder.feed(chunk) if event.type == DELTA]
+                if first:
+                    break
+        except BaseException:
+            # Also on cancellation, when this request lost a hedge race
+            await response.aclose()
+            self.limiter.release()
+            if lease:
+                lease.release()
+            raise
+        return _OpenStream(response, decoder, chunks, first, time.monotonic() - start, metrics, lease)
+
+    async def _open_hedged(self, args):
+        """Open a stream, racing a duplicate if the first token is late.
+
+        The duplicate gets its own CallMetrics (source ``hedge``), finished when
+        the race ends: with ``hedge_cancelled`` when it lost, its error when it
+        failed, and without one when it won and its stream carries on under the
+        call's metrics.
+        """
+        import asyncio
+
+        primary = asyncio.ensure_future(self._open(*args))
+        done, _ = await asyncio.wait({primary}, timeout=self.hedge.begin())
+        if done or self.limiter.pause_remaining() or not self.hedge.try_hedge():
+            stream = await primary
+            self.hedge.observe(stream.ttft)
+            return stream
+
+        url, _, _, request_id, _, metrics = args
+        metrics.hedged = True
+        backup_metrics = CallMetrics(url, request_id, source='hedge')
+        backup = asyncio.ensure_future(self._open(*args[:-1], backup_metrics))
+        pending = {primary, backup}
+        error = winner = None
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is not None:
+                        error = task.exception()
+                        continue
+                    winner = task.result()
+                    for loser in done - {task}:
+                        if loser.exception() is None:
+                            await self._close_stream(loser.result())
+                            if loser.result().lease:
+                                loser.result().lease.release()
+                    self.hedge.observe(winner.ttft, hedged_won=task is backup)
+                    metrics.status = winner.response.status_code
+                    # The call's metrics release the winner's endpoint when the stream ends
+                    metrics.lease, metrics.endpoint = winner.lease, winner.metrics.endpoint
+                    return winner
+            raise error
+        finally:
+            for task in pending:
+                task.cancel()
+            # Let the losers close their responses; one may have opened just before the cancel
+            for loser in await asyncio.gather(*pending, return_exceptions=True):
+                if isinstance(loser, _OpenStream):
+                    await self._close_stream(loser)
+                    if loser.lease:
+                        loser.lease.release()
+            # Its lease was released above, or handed to the call's metrics
+            backup_metrics.lease = None
+            if winner is not None and winner.metrics is backup_metrics:
+                backup_metrics.finish()
+            elif backup.cancelled() or backup.exception() is None:
+                backup_metrics.finish('hedge_cancelled')
+            else:
+                backup_metrics.finish(backup.exception())
+
+    async def achat(self, payload, files=(), **kwargs):
+        """Send a chat request and return the complete response text."""
+        parts = []
+        async for content in self.astream(payload, files, **kwargs):
+            parts.append(content)
+        return "".join(parts).strip()
+
+# One AsyncWCAClient per event loop: httpx clients cannot be shared across loops
+_async_clients = weakref.WeakKeyDictionary()
+
+def get_async_client():
+    """Return the default AsyncWCAClient for the running event loop."""
+    import asyncio
+
+    loop = asyncio.get_running_loop()
+    client = _async_clients.get(loop)
+    if client is None:
+        client = _async_clients[loop] = AsyncWCAClient()
+    return client
@@ -0,0 +1,293 @@
+"""IAM bearer tokens: fetched once, refreshed ahead of expiry and shared between processes."""
+import os
+import json
+import time
+import hashlib
+import tempfile
+import threading
+import weakref
+
+try:
+    import fcntl
+except ImportError:  # Windows: fall back to in-process locking only
+    fcntl = None
+
+from .config import (
+    DEFAULT_IBM_IAM_URL, DEFAULT_TOKEN_CACHE_FILE, IAM_APIKEY, IAM_URL_ENV, TOKEN_CACHE_ENV,
+    TOKEN_MIN_VALIDITY, TOKEN_REFRESH_MARGIN,
+)
+from .transport import get_session
+
+def _iam_url():
+    return os.getenv(IAM_URL_ENV) or DEFAULT_IBM_IAM_URL
+
+class AuthenticationError(Exception):
+    """IAM refused to exchange the API key for a bearer token."""
+
+def _iam_error(response):
+    # A 4xx means the key itself was refused; an IAM outage is not an auth failure
+    error = AuthenticationError if response.status_code < 500 else Exception
+    return error(f'Status code: {response.status_code}, Error: {json.loads(response.content)}')
+
+def _request_iam_token(apikey, iam_url=None, session=None):
+    """Exchange an API key for an IAM bearer token; returns (token, expires_at)."""
+    headers = {'Content-Type': 'application/x-www-form-urlencoded'}
+    data = {'grant_type': 'urn:ibm:params:oauth:grant-type:apikey', 'apikey': apikey}
+    response = (session or get_session()).post(iam_url or _iam_url(), headers=headers, data=data, timeout=30)
+    
+    if not response.ok:
+        raise _iam_error(response)
+    token_data = response.json()
+    # Prefer the relative lifetime so local clock skew does not matter
+    if 'expires_in' in token_data:
+        expires_at = time.time() + float(token_data['expires_in'])
+    else:
+        expires_at = float(token_data.get('expiration', time.time()))
+    return token_data['access_token'], expires_at
+
+async def _arequest_iam_token(apikey, client, iam_url=None):
+    """Async variant of ``_request_iam_token`` using an ``httpx.AsyncClient``."""
+    headers = {'Content-Type': 'application/x-www-form-urlencoded'}
+    data = {'grant_type': 'urn:ibm:params:oauth:grant-type:apikey', 'apikey': apikey}
+    response = await client.post(iam_url or _iam_url(), headers=headers, data=data, timeout=30)
+
+    if response.status_code >= 400:
+        raise _iam_error(response)
+    token_data = response.json()
+    if 'expires_in' in token_data:
+        expires_at = time.time() + float(token_data['expires_in'])
+    else:
+        expires_at = float(token_data.get('expiration', time.time()))
+    return token_data['access_token'], expires_at
+
+class TokenCache:
+    """Process-wide, thread-safe cache of IAM bearer tokens keyed by API key.
+
+    Tokens are refreshed in a background thread once they are within
+    ``refresh_margin`` seconds of expiry. When ``path`` is set, tokens are also
+    persisted to a locked JSON file so short-lived CLI runs share one token.
+    """
+
+    def __init__(self, fetch=_request_iam_token, path=None, refresh_margin=TOKEN_REFRESH_MARGIN, afetch=None):
+        self._fetch = fetch
+        self.afetch = afetch
+        self._path = path
+        self._refresh_margin = refresh_margin
+        self._tokens = {}
+        self._lock = threading.Lock()
+        self._key_locks = {}
+        self._async_locks = weakref.WeakKeyDictionary()
+        self._refreshing = set()
+
+    @staticmethod
+    def _key(apikey):
+        # Never keep the raw API key around, in memory or on disk
+        return hashlib.sha256(apikey.encode('utf-8')).hexdigest()
+
+    def _key_lock(self, key):
+        with self._lock:
+            return self._key_locks.setdefault(key, threading.Lock())
+
+    def _lookup(self, key, min_validity):
+        entry = self._tokens.get(key)
+        if entry and time.time() < entry[1] - min_validity:
+            return entry
+        return None
+
+    def get(self, apikey):
+        """Return a valid token, fetching or refreshing it as needed."""
+        key = self._key(apikey)
+        entry = self._lookup(key, self._refresh_margin)
+        if entry:
+            return entry[0]
+        entry = self._lookup(key, TOKEN_MIN_VALIDITY)
+        if entry:
+            # Still usable: serve it and refresh ahead of expiry in the background
+            self._refresh_in_background(key, apikey)
+            return entry[0]
+        return self._refresh(key, apikey)
+
+    async def aget(self, apikey, afetch=None):
+        """Asyncio-friendly ``get``: cache hits never block the event loop.
+
+        ``afetch`` (or the cache's own ``afetch``) is an optional coroutine
+        function used for misses instead of running the blocking fetch in a
+        worker thread.
+        """
+        import asyncio
+
+        afetch = afetch or self.afetch
+        key = self._key(apikey)
+        entry = self._lookup(key, self._refresh_margin)
+        if entry:
+            return entry[0]
+        entry = self._lookup(key, TOKEN_MIN_VALIDITY)
+        if entry:
+            self._refresh_in_background(key, apikey)
+            return entry[0]
+        loop = asyncio.get_running_loop()
+        if afetch is None or self._path:
+            # The on-disk cache needs blocking file locks
+            return await loop.run_in_executor(None, self.get, apikey)
+        locks = self._async_locks.setdefault(loop, {})
+        lock = locks.setdefault(key, asyncio.Lock())
+        async with lock:
+            entry = self._lookup(key, self._refresh_margin)
+            if not entry:
+                entry = await afetch(apikey)
+                self._tokens[key] = entry
+            return entry[0]
+
+    async def arefresh(self, apikey, afetch=None):
+        """Fetch a new token unless the cached one is outside the refresh margin.
+
+        Returns the token's expiry time. Used by background refreshers, so
+        request handlers find a valid token and never wait for IAM.
+        """
+        import asyncio
+
+        afetch = afetch or self.afetch
+        key = self._key(apikey)
+        if not self._lookup(key, self._refresh_margin):
+            if afetch is None or self._path:
+                await asyncio.get_running_loop().run_in_executor(None, self._refresh, key, apikey)
+            else:
+                self._tokens[key] = await afetch(apikey)
+        return self._tokens[key][1]
+
+    def invalidate(self, apikey):
+        """Drop a token the server rejected so the next call fetches a new one."""
+        key = self._key(apikey)
+        with self._key_lock(key):
+            self._tokens.pop(key, None)
+            if self._path:
+                with self._file_lock():
+                    stored = self._read_file()
+                    if stored.pop(key, None) is not None:
+                        self._write_file(stored)
+
+    def clear(self):
+        """Forget all in-memory tokens."""
+        with self._lock:
+            self._tokens.clear()
+
+    def _refresh_in_background(self, key, apikey):
+        with self._lock:
+            if key in self._refreshing:
+                return
+            self._refreshing.add(key)
+
+        def refresh():
+            try:
+                self._refresh(key, apikey)
+            except Exception:
+                # The current token is still valid; the next caller will retry
+                pass
+            finally:
+                with self._lock:
+                    self._refreshing.discard(key)
+
+        threading.Thread(target=refresh, name="wca-token-refresh", daemon=True).start()
+
+    def _refresh(self, key, apikey):
+        with self._key_lock(key):
+            # Another thread may have refreshed while we waited for the lock
+            entry = self._lookup(key, self._refresh_margin)
+            if entry:
+                return entry[0]
+            if not self._path:
+                entry = self._fetch(apikey)
+                self._tokens[key] = entry
+                return entry[0]
+            with self._file_lock():
+                stored = self._read_file().get(key)
+                if stored and time.time() < stored[1] - self._refresh_margin:
+                    entry = tuple(stored)
+                else:
+                    entry = self._fetch(apikey)
+                    tokens = self._read_file()
+                    tokens[key] = list(entry)
+                    self._write_file(tokens)
+            self._tokens[key] = entry
+            return entry[0]
+
+    def _file_lock(self):
+        return _FileLock(self._path + ".lock")
+
+    def _read_file(self):
+        try:
+            with open(self._path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _write_file(self, tokens):
+        directory = os.path.dirname(self._path) or "."
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".tokens-")
+        try:
+            os.chmod(tmp_path, 0o600)
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump(tokens, f)
+            os.replace(tmp_path, self._path)
+        except OSError:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+class _FileLock:
+    """Exclusive advisory lock on a sidecar file (no-op where fcntl is unavailable)."""
+
+    def __init__(self, path):
+        self._path = path
+        self._fd = None
+
+    def __enter__(self):
+        if fcntl is not None:
+            os.makedirs(os.path.dirname(self._path) or ".", exist_ok=True)
+            self._fd = os.open(self._path, os.O_RDWR | os.O_CREAT, 0o600)
+            fcntl.flock(self._fd, fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *exc):
+        if self._fd is not None:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+            os.close(self._fd)
+            self._fd = None
+
+def _token_cache_path():
+    value = os.getenv(TOKEN_CACHE_ENV, "")
+    if not value or value.lower() in ("0", "false", "no"):
+        return None
+    if value.lower() in ("1", "true", "yes"):
+        return DEFAULT_TOKEN_CACHE_FILE
+    return os.path.expanduser(value)
+
+_token_cache = TokenCache(path=_token_cache_path())
+
+def _resolve_apikey(apikey=None):
+    if not apikey:
+        apikey = os.getenv(IAM_APIKEY)
+        if not apikey:
+            raise ValueError(f"No API key provided. Set the {IAM_APIKEY} environment variable.")
+    return apikey
+
+def get_bearer_token(apikey=None):
+    """Get IBM Cloud bearer token for authentication."""
+    return _token_cache.get(_resolve_apikey(apikey))
+
+async def aget_bearer_token(apikey=None):
+    """Get IBM Cloud bearer token without blocking the event loop."""
+    from .async_client import get_async_client
+
+    return await get_async_client()._token(apikey)
+
+async def akeep_token_fresh(apikey=None):
+    """Keep the bearer token refreshed ahead of expiry until cancelled (see AsyncWCAClient.keep_token_fresh)."""
+    from .async_client import get_async_client
+
+    await get_async_client().keep_token_fresh(apikey)
+
+def invalidate_bearer_token(apikey=None):
+    """Forget the cached bearer token, e.g. after the API rejected it."""
+    _token_cache.invalidate(_resolve_apikey(apikey))
@@ -0,0 +1,215 @@
+"""Running many WCA requests at once, optionally packing several files per request."""
+import re
+
+from .config import PACK_MAX_FILES, PACK_TOKEN_BUDGET
+from .budget import estimate_tokens, is_dry_run
+from .client import get_client
+from .journal import content_hash
+from .limiter import _limiter
+
+class CallResult:
+    """Outcome of one item in a ``call_many`` batch."""
+
+    __slots__ = ('index', 'text', 'error')
+
+    def __init__(self, index, text=None, error=None):
+        self.index = index
+        self.text = text
+        self.error = error
+
+    @property
+    def ok(self):
+        return self.error is None
+
+    def __repr__(self):
+        state = 'ok' if self.ok else f'error={self.error!r}'
+        return f"CallResult(index={self.index}, {state})"
+
+def call_many(payloads, max_concurrency=None, on_progress=None, client=None, stop=None):
+    """Send many chat requests concurrently and return results in input order.
+
+    Each item is a payload dict or a ``(payload, file_dict)`` tuple. Failures
+    are reported per item as ``CallResult.error`` instead of aborting the
+    batch. ``on_progress(done, total, result)`` is called as items finish.
+    ``stop`` is a stop condition applied to every item (see StopCondition).
+    Without ``max_concurrency`` the adaptive limiter decides how many run at once.
+    """
+    client = client or get_client()
+    items = [item if isinstance(item, tuple) else (item, ()) for item in payloads]
+    options = {} if stop is None else {'stop': stop}
+
+    def job(index, payload, files):
+        return lambda: [_complete(client, index, payload, files, options)]
+
+    jobs = [job(index, payload, files) for index, (payload, files) in enumerate(items)]
+    return _run_jobs(jobs, len(items), max_concurrency, on_progress)
+
+def _complete(client, index, payload, files=(), options=None):
+    try:
+        return CallResult(index, text=client.complete(payload, files, **(options or {})))
+    except Exception as e:
+        return CallResult(index, error=e)
+
+def _run_jobs(jobs, total, max_concurrency, on_progress):
+    """Run jobs (each returning a list of CallResults) on a thread pool."""
+    results = [None] * total
+    if not jobs:
+        return results
+    workers = max(1, min(max_concurrency or _limiter.max_limit, len(jobs)))
+    from concurrent.futures import ThreadPoolExecutor, as_completed
+
+    done = 0
+    pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="wca-call")
+    futures = [pool.submit(job) for job in jobs]
+    try:
+        for future in as_completed(futures):
+            for result in future.result():
+                results[result.index] = result
+                done += 1
+                if on_progress:
+                    on_progress(done, total, result)
+    except BaseException:
+        # On Ctrl-C (or a failing callback) drop the queued jobs instead of
+        # waiting for them; shutdown(cancel_futures=True) does this from 3.9 on
+        for future in futures:
+            future.cancel()
+        pool.shutdown(wait=False)
+        raise
+    pool.shutdown()
+    return results
+
+PACK_HEADER = "--- file: {} ---"
+_PACK_HEADER_RE = re.compile(r"^[ \t>#*`]*-{3} file: (.+?) -{3}[ \t*`]*$", re.MULTILINE)
+PACK_INSTRUCTIONS = """
+
+The input above contains {count} separate files, each starting with a line `--- file: <path> ---`.
+Handle each file on its own. Reply with one section per file, in the same order, each starting
+with its `--- file: <path> ---` line on a line by itself, followed by the result for that file only."""
+
+def pack_files(files, budget=PACK_TOKEN_BUDGET, max_files=PACK_MAX_FILES):
+    """Group ``(name, content)`` files, in order, into lists of indexes that fit a prompt.
+
+    A file larger than ``budget`` gets a group of its own.
+    """
+    groups = []
+    group, used = [], 0
+    for index, (name, content) in enumerate(files):
+        tokens = estimate_tokens(content)
+        if group and (used + tokens > budget or len(group) >= max_files):
+            groups.append(group)
+            group, used = [], 0
+        group.append(index)
+        used += tokens
+    if group:
+        groups.append(group)
+    return groups
+
+def format_packed(files):
+    """Join ``(name, content)`` files into delimited ``--- file: name ---`` sections."""
+    return "\n\n".join(f"{PACK_HEADER.format(name)}\n{content.strip()}" for name, content in files)
+
+def split_packed(text, names):
+    """Split a packed reply into ``{name: section}``.
+
+    Sections for names not asked for, repeated or empty sections are dropped,
+    so the caller can retry the files that are missing.
+    """
+    sections = {}
+    matches = list(_PACK_HEADER_RE.finditer(text))
+    for match, following in zip(matches, matches[1:] + [None]):
+        name = match.group(1).strip()
+        body = text[match.end():following.start() if following else len(text)].strip()
+        if name in names and name not in sections and body:
+            sections[name] = body
+    return sections
+
+def call_packed(files, prompt_for, budget=PACK_TOKEN_BUDGET, max_files=PACK_MAX_FILES,
+                max_concurrency=None, on_progress=None, client=None, stop=None):
+    """Like ``call_many`` for one prompt per file, packing small files into shared requests.
+
+    ``files`` is a list of ``(name, content)`` with unique names, and
+    ``prompt_for(content, packed=False)`` builds the prompt around one file's
+    content; for a pack it receives the delimited sections and ``packed=True``
+    instead, and should leave out instructions that assume a single reply (the
+    pack is asked to answer per section). Returns one CallResult per file, in
+    order, whose text is the file's own section. Files whose section is missing
+    from a packed reply are retried in single-file requests, which use
+    ``stop``; if the packed request fails, each of its files gets that error.
+    """
+    client = client or get_client()
+    options = {} if stop is None else {'stop': stop}
+
+    def payload(content):
+        return {"message_payload": {"messages": [{"content": content, "role": "USER"}]}}
+
+    def single(index):
+        return _complete(client, index, payload(prompt_for(files[index][1])), options=options)
+
+    def packed(group):
+        names = {files[index][0] for index in group}
+        prompt = prompt_for(format_packed([files[index] for index in group]), packed=True)
+        prompt += PACK_INSTRUCTIONS.format(count=len(group))
+        try:
+            text = client.complete(payload(prompt))
+        except Exception as e:
+            return [CallResult(index, error=e) for index in group]
+        if is_dry_run():
+            # Nothing was sent, so there is nothing to split or retry
+            return [CallResult(index, text="") for index in group]
+        sections = split_packed(text, names)
+        return [
+            CallResult(index, text=sections[files[index][0]]) if files[index][0] in sections else single(index)
+            for index in group
+        ]
+
+    def job(group):
+        if len(group) == 1:
+            return lambda: [single(group[0])]
+        return lambda: packed(group)
+
+    jobs = [job(group) for group in pack_files(files, budget, max_files)]
+    return _run_jobs(jobs, len(files), max_concurrency, on_progress)
+
+def call_units(units, prompt_for, save, journal=None, pack=False, on_progress=None, client=None, stop=None,
+               scope=None):
+    """Run one prompt per ``(name, content)`` unit and save each result as it arrives.
+
+    ``save(index, text)`` writes a unit's output and returns its path; it runs
+    as soon as that unit's reply is complete, so an interrupted batch keeps
+    what it finished. With a ``journal``, units completed by an earlier run
+    from the same input and prompt are skipped (their result is None) and
+    every outcome is journaled, under ``scope:name`` when a ``scope`` (e.g.
+    the batch's action) is given. ``pack`` groups small units with
+    call_packed, which shows the model each unit's name as its section
+    header, so names should be plain file paths, and calls
+    ``prompt_for(content, packed=True)`` for the packs.
+    Returns CallResults in input order; a failing ``save`` is the unit's error.
+    """
+    journal_keys = [name if scope is None else f"{scope}:{name}" for name, content in units]
+    prompts = [prompt_for(content) for name, content in units]
+    hashes = [(content_hash(content), content_hash(prompt)) for (name, content), prompt in zip(units, prompts)]
+    todo = [index for index in range(len(units))
+            if not (journal and journal.completed(journal_keys[index], *hashes[index]))]
+    results = [None] * len(units)
+
+    def finished(done, total, result):
+        index = result.index = todo[result.index]
+        if not is_dry_run():
+            output = None
+            if result.ok:
+                try:
+                    output = save(index, result.text)
+                except Exception as e:
+                    result.error = e
+            if journal:
+                journal.record(journal_keys[index], *hashes[index], 'done' if result.ok else 'failed', output, result.error)
+        results[index] = result
+        if on_progress:
+            on_progress(done, total, result)
+
+    if pack:
+        call_packed([units[index] for index in todo], prompt_for, on_progress=finished, client=client, stop=stop)
+    else:
+        payloads = [{"message_payload": {"messages": [{"content": prompts[index], "role": "USER"}]}} for index in todo]
+        call_many(payloads, on_progress=finished, client=client, stop=stop)
+    return results
@@ -0,0 +1,174 @@
+"""Prompt token budgets, dry runs and token usage accounting."""
+import os
+import math
+import threading
+
+from .console import console
+from .config import (
+    CHARS_PER_TOKEN, COST_PER_1K_TOKENS, DRY_RUN_ENV, PROMPT_TOKEN_LIMIT, TOKENIZER_ENV,
+)
+from .metrics import add_metrics_sink
+
+_tokenizer = None  # False once loading failed or no tokenizer is configured
+
+def _exact_tokenizer():
+    """Return the ``encode`` of the WCA_TOKENIZER tokenizer, or None."""
+    global _tokenizer
+    if _tokenizer is None:
+        _tokenizer = False
+        name = os.getenv(TOKENIZER_ENV)
+        if name:
+            try:
+                from tokenizers import Tokenizer
+                tokenizer = Tokenizer.from_file(name) if os.path.exists(name) else Tokenizer.from_pretrained(name)
+                _tokenizer = tokenizer.encode
+            except Exception as e:
+                console.print(f"[yellow]Could not load tokenizer {name!r} ({e}); estimating tokens instead[/yellow]")
+    return _tokenizer or None
+
+def estimate_tokens(text):
+    """Token count of ``text``: exact with WCA_TOKENIZER, otherwise a fast estimate.
+
+    The estimate counts CHARS_PER_TOKEN ASCII characters (code, English) per
+    token and one token per other character (accents, CJK, Devanagari, ...).
+    """
+    if not text:
+        return 0
+    encode = _exact_tokenizer()
+    if encode:
+        return len(encode(text).ids)
+    if text.isascii():
+        return math.ceil(len(text) / CHARS_PER_TOKEN)
+    other = len(text) - len(text.encode('ascii', 'ignore'))
+    return math.ceil((len(text) - other) / CHARS_PER_TOKEN) + other
+
+def estimate_payload_tokens(payload, files=()):
+    """Estimated prompt tokens of a chat payload and its attached files."""
+    messages = payload.get('message_payload', {}).get('messages', [])
+    tokens = sum(estimate_tokens(message.get('content') or '') for message in messages)
+    for a_file in files:
+        tokens += math.ceil(os.path.getsize(a_file) / CHARS_PER_TOKEN)
+    return tokens
+
+class PromptTooLarge(ValueError):
+    """A prompt would exceed the prompt token budget; raised before anything is sent."""
+
+def prompt_budget(template="", limit=None):
+    """Tokens left for inputs in a prompt whose fixed text is ``template``."""
+    return (limit or PROMPT_TOKEN_LIMIT) - estimate_tokens(template)
+
+TRIM_MARKER = "\n... [{lines} more lines trimmed to fit the prompt budget]\n"
+
+def trim_to_budget(text, max_tokens):
+    """Return ``text`` cut at a line boundary to at most ``max_tokens`` tokens, marking the cut."""
+    if estimate_tokens(text) <= max_tokens:
+        return text
+    lines = text.splitlines(keepends=True)
+    kept = []
+    used = estimate_tokens(TRIM_MARKER)
+    for line in lines:
+        used += estimate_tokens(line)
+        if used > max_tokens:
+            break
+        kept.append(line)
+    return "".join(kept) + TRIM_MARKER.format(lines=len(lines) - len(kept))
+
+def _split_line(line, max_tokens):
+    """Cut a line longer than ``max_tokens`` into pieces that fit."""
+    pieces = []
+    while line:
+        size = min(len(line), max(1, int(max_tokens * CHARS_PER_TOKEN)))
+        while size > 1 and estimate_tokens(line[:size]) > max_tokens:
+            size //= 2
+        pieces.append(line[:size])
+        line = line[size:]
+    return pieces
+
+def chunk_to_budget(text, max_tokens):
+    """Split ``text`` at line boundaries into pieces of at most ``max_tokens`` tokens.
+
+    A single line longer than the budget is cut into pieces of its own.
+    """
+    chunks = []
+    chunk, used = [], 0
+    for line in text.splitlines(keepends=True):
+        tokens = estimate_tokens(line)
+        pieces = [(line, tokens)]
+        if tokens > max_tokens:
+            pieces = [(piece, estimate_tokens(piece)) for piece in _split_line(line, max_tokens)]
+        for piece, tokens in pieces:
+            if chunk and used + tokens > max_tokens:
+                chunks.append("".join(chunk))
+                chunk, used = [], 0
+            chunk.append(piece)
+            used += tokens
+    if chunk:
+        chunks.append("".join(chunk))
+    return chunks or [text]
+
+def check_prompt(prompt, what="prompt", limit=None):
+    """Return ``prompt``, or raise PromptTooLarge if it is over the budget."""
+    limit = limit or PROMPT_TOKEN_LIMIT
+    tokens = estimate_tokens(prompt)
+    if tokens > limit:
+        raise PromptTooLarge(
+            f"The {what} is about {tokens} tokens, over the {limit}-token prompt budget; "
+            f"split the input or raise WCA_PROMPT_TOKENS"
+        )
+    return prompt
+
+class TokenUsage:
+    """Estimated WCA token usage of this process.
+
+    Prompt tokens are counted as requests are sent (or skipped in dry-run
+    mode); as a metrics sink it adds the output of network calls, where each
+    streamed delta is about one token.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.prompt_tokens = 0
+        self.output_tokens = 0
+
+    def add_request(self, payload, files=()):
+        tokens = estimate_payload_tokens(payload, files)
+        with self._lock:
+            self.requests += 1
+            self.prompt_tokens += tokens
+        return tokens
+
+    def __call__(self, metrics):
+        if metrics.source == 'network':
+            with self._lock:
+                self.output_tokens += metrics.deltas
+
+    @property
+    def cost(self):
+        return (self.prompt_tokens + self.output_tokens) / 1000 * COST_PER_1K_TOKENS
+
+token_usage = add_metrics_sink(TokenUsage())
+_dry_run = os.getenv(DRY_RUN_ENV, "").lower() in ("1", "true", "yes")
+
+def configure_budget(dry_run=None):
+    """Turn dry-run mode on or off; None leaves the WCA_DRY_RUN setting."""
+    global _dry_run
+    if dry_run is not None:
+        _dry_run = dry_run
+
+def is_dry_run():
+    """True when requests are only estimated, never sent to WCA."""
+    return _dry_run
+
+def print_token_usage():
+    """Print the estimated token usage (and cost) of the requests made so far."""
+    if not token_usage.requests:
+        return
+    summary = f"{token_usage.requests} request(s), ~{token_usage.prompt_tokens} prompt tokens"
+    if _dry_run:
+        summary = f"Dry run, nothing sent: {summary}"
+    else:
+        summary += f", ~{token_usage.output_tokens} output tokens"
+    if COST_PER_1K_TOKENS:
+        summary += f", estimated cost {token_usage.cost:.4f}"
+    console.print(f"[dim]WCA usage: {summary}[/dim]")
@@ -0,0 +1,166 @@
+"""Content-addressed cache of completed WCA responses."""
+import os
+import json
+import time
+import hashlib
+import threading
+import sqlite3
+
+from .console import console
+from .config import (
+    DEFAULT_RESPONSE_CACHE_FILE, RESPONSE_CACHE_ENV, RESPONSE_CACHE_MAX_BYTES,
+    RESPONSE_CACHE_TTL,
+)
+
+def response_cache_key(url, payload, file_dict=()):
+    """Content-address a chat request: endpoint, normalized payload and file bytes."""
+    digest = hashlib.sha256()
+    digest.update(url.encode('utf-8'))
+    digest.update(b'\0')
+    digest.update(json.dumps(payload, sort_keys=True, separators=(',', ':'), ensure_ascii=False).encode('utf-8'))
+    for a_file in file_dict:
+        digest.update(b'\0')
+        digest.update(a_file.split("/")[-1].encode('utf-8'))
+        with open(a_file, 'rb') as file:
+            for block in iter(lambda: file.read(1024 * 1024), b''):
+                digest.update(block)
+    return digest.hexdigest()
+
+class ResponseCache:
+    """SQLite-backed cache of complete WCA responses with TTL and LRU eviction.
+
+    Entries expire ``ttl`` seconds after they were written; when the stored
+    text exceeds ``max_bytes`` the least recently used entries are evicted.
+    Safe to share between threads, and between processes via SQLite locking.
+    """
+
+    def __init__(self, path, ttl=RESPONSE_CACHE_TTL, max_bytes=RESPONSE_CACHE_MAX_BYTES):
+        self.path = path
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.refresh = False
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._db = sqlite3.connect(path, timeout=30, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            "key TEXT PRIMARY KEY, value TEXT NOT NULL, size INTEGER NOT NULL, "
+            "created REAL NOT NULL, accessed REAL NOT NULL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed)")
+
+    def get(self, key):
+        """Return the cached text for ``key``, or None on a miss."""
+        now = time.time()
+        with self._lock:
+            row = self._db.execute("SELECT value, created FROM responses WHERE key = ?", (key,)).fetchone()
+            if row and now - row[1] <= self.ttl:
+                self._db.execute("UPDATE responses SET accessed = ? WHERE key = ?", (now, key))
+                self.hits += 1
+                return row[0]
+            if row:
+                self._db.execute("DELETE FROM responses WHERE key = ?", (key,))
+            self.misses += 1
+            return None
+
+    def put(self, key, value):
+        """Store a complete response and evict old entries beyond the size cap."""
+        now = time.time()
+        size = len(value.encode('utf-8'))
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO responses (key, value, size, created, accessed) VALUES (?, ?, ?, ?, ?)",
+                (key, value, size, now, now)
+            )
+            self.writes += 1
+            self._evict()
+
+    def _evict(self):
+        self._db.execute("DELETE FROM responses WHERE created < ?", (time.time() - self.ttl,))
+        total = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        for key, size in self._db.execute("SELECT key, size FROM responses ORDER BY accessed").fetchall():
+            self._db.execute("DELETE FROM responses WHERE key = ?", (key,))
+            self.evictions += 1
+            total -= size
+            if total <= self.max_bytes:
+                break
+
+    def clear(self):
+        """Drop every entry."""
+        with self._lock:
+            self._db.execute("DELETE FROM responses")
+
+    def stats(self):
+        """Return hit/miss counters for this process."""
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'writes': self.writes,
+            'evictions': self.evictions,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+        }
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+_response_cache = None
+_response_cache_enabled = None
+_response_cache_lock = threading.Lock()
+
+def _response_cache_path():
+    value = os.getenv(RESPONSE_CACHE_ENV, "")
+    if not value or value.lower() in ("0", "false", "no"):
+        return None
+    if value.lower() in ("1", "true", "yes"):
+        return DEFAULT_RESPONSE_CACHE_FILE
+    return os.path.expanduser(value)
+
+def configure_response_cache(enabled=None, refresh=False, path=None):
+    """Override the response cache for this process.
+
+    ``enabled=False`` disables it (``--no-cache``), ``refresh=True`` skips
+    cached reads but stores fresh responses (``--refresh``), and ``path``
+    enables it at a specific location regardless of the environment.
+    """
+    global _response_cache, _response_cache_enabled
+    with _response_cache_lock:
+        if path and (_response_cache is None or _response_cache.path != path):
+            _response_cache = ResponseCache(path)
+        _response_cache_enabled = True if path else enabled
+    cache = get_response_cache()
+    if cache is not None:
+        cache.refresh = refresh
+
+def get_response_cache():
+    """Return the process-wide ResponseCache, or None when caching is off."""
+    global _response_cache
+    if _response_cache_enabled is False:
+        return None
+    if _response_cache is None:
+        path = _response_cache_path()
+        if not path:
+            return None
+        with _response_cache_lock:
+            if _response_cache is None:
+                _response_cache = ResponseCache(path)
+    return _response_cache
+
+def print_cache_stats():
+    """Print response cache hit/miss counts for this run, if caching is on."""
+    cache = get_response_cache()
+    if cache is None or not (cache.hits or cache.misses):
+        return
+    stats = cache.stats()
+    console.print(
+        f"[dim]Response cache: {stats['hits']} hits, {stats['misses']} misses "
+        f"({stats['hit_rate']:.0%} hit rate), {stats['evictions']} evictions[/dim]"
+    )
@@ -0,0 +1,198 @@
+"""Record/replay of WCA responses for offline runs and tests (WCA_CASSETTE)."""
+import os
+import json
+import base64
+import time
+import threading
+import gzip
+
+from .config import CASSETTE_ENV, CASSETTE_PATH_ENV, CASSETTE_SPEED_ENV, DEFAULT_CASSETTE_FILE
+
+class CassetteMiss(LookupError):
+    """Replay mode found no recording for a request."""
+
+class Cassette:
+    """Recorded WCA chat streams, keyed by request hash, in a gzipped JSON-lines file.
+
+    In ``record`` mode every stream read to its end is appended (one gzip member per
+    entry, so an interrupted run keeps what it finished) with the offset of
+    each chunk from the start of the request. In ``replay`` mode requests are
+    answered from the file: repeated requests get their recordings in order.
+    ``speed`` is None for as fast as possible, or a multiple of recorded speed.
+    """
+
+    def __init__(self, path, mode, speed=None):
+        if mode not in ('record', 'replay'):
+            raise ValueError(f"Unknown cassette mode {mode!r}; use 'record' or 'replay'")
+        self.path = path
+        self.mode = mode
+        self.speed = speed
+        self.recorded = 0
+        self.replayed = 0
+        self._entries = {}
+        self._positions = {}
+        self._lock = threading.Lock()
+        if mode == 'replay':
+            self._load()
+
+    def _load(self):
+        with gzip.open(self.path, 'rt', encoding='utf-8') as file:
+            for line in file:
+                if line.strip():
+                    entry = json.loads(line)
+                    self._entries.setdefault(entry['key'], []).append(entry)
+
+    def replay(self, key):
+        """Return a CassetteResponse for the next recording of ``key``."""
+        with self._lock:
+            entries = self._entries.get(key)
+            if not entries:
+                raise CassetteMiss(f"No recording for request {key[:12]} in {self.path}")
+            position = self._positions.get(key, 0)
+            self._positions[key] = position + 1
+            self.replayed += 1
+        return CassetteResponse(entries[position % len(entries)], self.speed)
+
+    def recorder(self, response, key, url, start):
+        """Wrap a live response so its stream is recorded once fully read."""
+        return CassetteRecorder(response, self, key, url, start)
+
+    def add(self, key, url, status, chunks):
+        entry = {
+            'key': key,
+            'url': url,
+            'status': status,
+            'recorded_at': round(time.time(), 3),
+            'chunks': [[round(offset, 6), base64.b64encode(chunk).decode('ascii')] for offset, chunk in chunks],
+        }
+        line = json.dumps(entry) + '\n'
+        with self._lock:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            with gzip.open(self.path, 'at', encoding='utf-8') as file:
+                file.write(line)
+            self.recorded += 1
+
+class CassetteResponse:
+    """Recorded stream standing in for a ``requests``/``httpx`` response."""
+
+    ok = True
+    headers = {}
+
+    def __init__(self, entry, speed=None):
+        self.status_code = entry.get('status', 200)
+        self._chunks = [(offset, base64.b64decode(data)) for offset, data in entry['chunks']]
+        self._speed = speed
+
+    @property
+    def text(self):
+        return b''.join(chunk for _, chunk in self._chunks).decode('utf-8', 'replace')
+
+    def _delay(self, started, offset):
+        return 0 if not self._speed else offset / self._speed - (time.monotonic() - started)
+
+    def iter_content(self, *args, **kwargs):
+        started = time.monotonic()
+        for offset, chunk in self._chunks:
+            delay = self._delay(started, offset)
+            if delay > 0:
+                time.sleep(delay)
+            yield chunk
+
+    async def aiter_bytes(self):
+        import asyncio
+
+        started = time.monotonic()
+        for offset, chunk in self._chunks:
+            delay = self._delay(started, offset)
+            if delay > 0:
+                await asyncio.sleep(delay)
+            yield chunk
+
+    def raise_for_status(self):
+        pass
+
+    def close(self):
+        pass
+
+    async def aclose(self):
+        pass
+
+class CassetteRecorder:
+    """Tees a live response's byte chunks, with timing, into a Cassette."""
+
+    def __init__(self, response, cassette, key, url, start):
+        self._response = response
+        self._cassette = cassette
+        self._key = key
+        self._url = url
+        self._start = start
+        self._chunks = []
+        self._eof = False
+        self._saved = False
+
+    def __getattr__(self, name):
+        return getattr(self._response, name)
+
+    def _tee(self, chunk):
+        self._chunks.append((time.monotonic() - self._start, chunk))
+
+    def _save(self):
+        # Only complete streams are recorded: one closed early (a stop condition,
+        # a dropped client) would replay as a truncated answer
+        if self._eof and self._chunks and not self._saved:
+            self._saved = True
+            self._cassette.add(self._key, self._url, self._response.status_code, self._chunks)
+
+    def iter_content(self, *args, **kwargs):
+        for chunk in self._response.iter_content(*args, **kwargs):
+            if chunk:
+                self._tee(chunk)
+            yield chunk
+        self._eof = True
+        self._save()
+
+    async def aiter_bytes(self):
+        async for chunk in self._response.aiter_bytes():
+            if chunk:
+                self._tee(chunk)
+            yield chunk
+        self._eof = True
+        self._save()
+
+    def close(self):
+        self._save()
+        self._response.close()
+
+    async def aclose(self):
+        self._save()
+        await self._response.aclose()
+
+_cassette = None
+_cassette_lock = threading.Lock()
+
+def get_cassette():
+    """Return the process-wide Cassette selected by WCA_CASSETTE, or None."""
+    global _cassette
+    mode = os.getenv(CASSETTE_ENV, "").lower()
+    if mode in ("", "0", "off", "false", "no"):
+        return None
+    if _cassette is None:
+        with _cassette_lock:
+            if _cassette is None:
+                speed = os.getenv(CASSETTE_SPEED_ENV, "fast").lower()
+                _cassette = Cassette(
+                    os.getenv(CASSETTE_PATH_ENV) or DEFAULT_CASSETTE_FILE,
+                    mode,
+                    speed=None if speed == "fast" else float(speed),
+                )
+    return _cassette
+
+def _replay_cassette(cassette, key, metrics):
+    """Answer a call from the cassette instead of the network."""
+    response = cassette.replay(key)
+    metrics.source = 'cassette'
+    metrics.status = response.status_code
+    metrics.headers = metrics.elapsed()
+    return response
@@ -0,0 +1,24 @@
+"""Typer commands shared by the WCA tools."""
+import typer
+
+from .console import console
+from .config import DEFAULT_DAEMON_SOCKET
+from .daemon import daemon_socket, daemon_stats, serve_daemon
+
+def daemon(
+    socket_path: str = typer.Option(None, "--socket", help="Unix socket to listen on (default: WCA_DAEMON, or ~/.cache/wca/daemon.sock)"),
+    status: bool = typer.Option(False, "--status", help="Print the running daemon's stats and exit")
+):
+    """Serve the WCA requests of other runs of these tools from one warm client (see WCA_DAEMON)."""
+    if not status:
+        try:
+            serve_daemon(socket_path)
+        except (RuntimeError, OSError) as e:
+            console.print(f"[red]{e}[/red]")
+            raise typer.Exit(1)
+        return
+    stats = daemon_stats(socket_path)
+    if stats is None:
+        console.print(f"[yellow]No WCA daemon answering on {socket_path or daemon_socket() or DEFAULT_DAEMON_SOCKET}[/yellow]")
+        raise typer.Exit(1)
+    console.print_json(data=stats)
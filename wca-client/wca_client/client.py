@@ -0,0 +1,282 @@
+"""The synchronous WCA chat client."""
+import os
+import time
+import threading
+
+from .console import console
+from .config import (
+    COALESCE, DEFAULT_BASE_URL, DEFAULT_CONNECT_TIMEOUT, DEFAULT_READ_TIMEOUT,
+    THROTTLE_RETRIES, THROTTLE_STATUSES,
+)
+from .auth import _resolve_apikey, _token_cache
+from .budget import is_dry_run, token_usage
+from .cache import get_response_cache, response_cache_key
+from .cassette import _replay_cassette, get_cassette
+from .limiter import _limiter
+from .metrics import CallMetrics, _record_replay
+from .pool import _failover, get_endpoint_pool
+from .responses import FlightResponse, RecordingResponse, ReplayResponse, _flights
+from .stream import _iter_content, as_stop_condition
+from .transport import (
+    MultipartBody, _call_context, _chat_headers, _retry_after, create_session, get_session,
+)
+
+def _sharing(flights, url, payload, files, stop):
+    """Return the response cache, SingleFlight and key a request may use."""
+    cache = get_response_cache()
+    if stop is not None and stop.name is None:
+        # An anonymous predicate's truncated text cannot be reused
+        cache = flights = None
+    key = None
+    if cache is not None or flights is not None:
+        key = response_cache_key(url, payload, files)
+        if stop is not None:
+            key = f"{key}:{stop.name}"
+    return cache, flights, key
+
+class WCAClient:
+    """Watson Code Assistant client that reuses pooled keep-alive connections.
+
+    The client owns a ``requests.Session`` (so TCP/TLS connections are reused
+    across calls) and a token cache. Create one per endpoint/credential, or use
+    ``get_client()`` for the process-wide default. With an EndpointPool (by
+    default the WCA_ENDPOINTS one, unless ``url`` or ``apikey`` is given),
+    requests to ``self.url`` are spread over the pool's endpoints, and retried
+    on another endpoint when one fails or is throttled.
+    """
+
+    def __init__(self, url=None, apikey=None, session=None, token_cache=None,
+                 timeout=(DEFAULT_CONNECT_TIMEOUT, DEFAULT_READ_TIMEOUT), limiter=None,
+                 max_retries=THROTTLE_RETRIES, coalesce=COALESCE, cassette=None, pool=None):
+        if pool is None and url is None and apikey is None:
+            pool = get_endpoint_pool()
+        self.pool = pool
+        # With a pool, self.url names the pool in cache keys and metrics
+        self.url = url or (pool.endpoints[0].url if pool else os.getenv("BASE_URL", DEFAULT_BASE_URL))
+        self.apikey = apikey
+        self.session = session or create_session()
+        self.token_cache = token_cache or _token_cache
+        self.timeout = timeout
+        self.limiter = limiter or _limiter
+        self.max_retries = max_retries
+        self.flights = _flights if coalesce else None
+        self.cassette = cassette or get_cassette()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        """Close all pooled connections."""
+        self.session.close()
+
+    def _token(self, apikey):
+        return self.token_cache.get(_resolve_apikey(apikey or self.apikey))
+
+    def _timed_token(self, apikey, metrics):
+        start = time.perf_counter()
+        try:
+            return self._token(apikey)
+        finally:
+            metrics.token += time.perf_counter() - start
+
+    def _post(self, url, headers, body):
+        body.seek(0)
+        return self.session.post(url=url, headers=headers, data=body, timeout=self.timeout, stream=True)
+
+    def chat(self, payload, files=(), url=None, request_id=None, apikey=None, stop=None):
+        """Send a chat request and return the streaming ``requests.Response``.
+
+        With the response cache on, a hit returns a ReplayResponse without any
+        network call and a miss is recorded once the stream has been read.
+        A request identical to one already in flight returns a FlightResponse
+        that replays the other request's stream instead of calling WCA again.
+        With a ``stop`` condition the stream ends (and the connection is
+        dropped) after the chunk in which it matched. In dry-run mode a miss
+        only counts the request's tokens and returns an empty response.
+        """
+        url = url or self.url
+        stop = as_stop_condition(stop)
+        metrics = CallMetrics(url, request_id)
+        cache, flights, key = _sharing(self.flights, url, payload, files, stop)
+        if cache is not None and not cache.refresh:
+            text = cache.get(key)
+            if text is not None:
+                _record_replay(metrics, text)
+                return ReplayResponse(text)
+        if is_dry_run():
+            token_usage.add_request(payload, files)
+            return ReplayResponse("")
+
+        flight = None
+        if flights is not None:
+            flight, leader = flights.join(key)
+            if not leader:
+                metrics.source = 'coalesced'
+                return FlightResponse(flight, metrics)
+        token_usage.add_request(payload, files)
+        try:
+            response = self._send(url, payload, files, request_id, apikey, metrics)
+        except BaseException as e:
+            if flight:
+                flight.finish(e)
+            metrics.finish(e)
+            raise
+        return RecordingResponse(response, cache, key, flight, metrics, stop)
+
+    def _send(self, url, payload, files, request_id, apikey, metrics=None):
+        import requests
+
+        metrics = metrics or CallMetrics(url, request_id)
+        if self.cassette is not None:
+            key = response_cache_key(url, payload, files)
+            if self.cassette.mode == 'replay':
+                return _replay_cassette(self.cassette, key, metrics)
+        pooled = self.pool is not None and url == self.url
+        target, credential = url, apikey
+        headers = _chat_headers(self._timed_token(apikey, metrics), request_id) if not pooled else {}
+        body = MultipartBody(payload, files)
+        metrics.bytes_up = len(body)
+        refreshed = False
+        attempt = 0
+        lease = None
+        tried = set()
+
+        while True:
+            pause = self.limiter.pause_remaining()
+            if pause:
+                time.sleep(pause)
+            if pooled:
+                lease = self.pool.acquire(exclude=tried)
+                target, credential = lease.endpoint.url, lease.endpoint.apikey or apikey
+                metrics.endpoint = lease.endpoint.name
+                try:
+                    headers = _chat_headers(self._timed_token(credential, metrics), request_id)
+                except BaseException:
+                    lease.release()
+                    raise
+            headers['Content-Type'] = body.content_type
+            start = time.monotonic()
+            _call_context.metrics = metrics
+            try:
+                response = self._post(target, headers, body)
+            except requests.exceptions.Timeout:
+                if _failover(lease, tried) and attempt < self.max_retries:
+                    console.print(f"[yellow]{lease.endpoint.name} timed out; retrying on another endpoint[/yellow]")
+                    attempt += 1
+                    metrics.retries += 1
+                    continue
+                self.limiter.on_throttle(timeout=True)
+                if attempt >= self.max_retries:
+                    console.print("[red]Request timed out. Please try again.[/red]")
+                    raise
+                delay = self.limiter.retry_delay(attempt)
+                console.print(f"[yellow]Request timed out; retrying in {delay:.1f}s[/yellow]")
+                time.sleep(delay)
+                attempt += 1
+                metrics.retries += 1
+                continue
+            except requests.exceptions.RequestException as e:
+                if _failover(lease, tried) and attempt < self.max_retries:
+                    console.print(f"[yellow]Error connecting to {lease.endpoint.name}: {str(e)}; retrying on another endpoint[/yellow]")
+                    attempt += 1
+                    metrics.retries += 1
+                    continue
+                console.print(f"[red]Error connecting to the API: {str(e)}[/red]")
+                raise
+            except BaseException:
+                if lease:
+                    lease.release()
+                raise
+            finally:
+                _call_context.metrics = None
+
+            metrics.status = response.status_code
+            if response.status_code == 401 and not refreshed:
+                # The cached token may have been revoked; retry once with a fresh one
+                response.close()
+                if lease:
+                    lease.release()
+                self.token_cache.invalidate(_resolve_apikey(credential or self.apikey))
+                if not pooled:
+                    headers['Authorization'] = f'Bearer {self._timed_token(apikey, metrics)}'
+                refreshed = True
+                continue
+
+            if response.status_code in THROTTLE_STATUSES and attempt < self.max_retries:
+                retry_after = _retry_after(response.headers)
+                response.close()
+                if _failover(lease, tried, throttled=True, retry_after=retry_after):
+                    console.print(f"[yellow]{lease.endpoint.name} returned {response.status_code}; retrying on another endpoint[/yellow]")
+                    attempt += 1
+                    metrics.retries += 1
+                    continue
+                self.limiter.on_throttle(retry_after)
+                delay = self.limiter.retry_delay(attempt, retry_after)
+                console.print(f"[yellow]WCA returned {response.status_code}; retrying in {delay:.1f}s[/yellow]")
+                time.sleep(delay)
+                attempt += 1
+                metrics.retries += 1
+                continue
+
+            if not response.ok:
+                if response.status_code in THROTTLE_STATUSES:
+                    self.limiter.on_throttle(_retry_after(response.headers))
+                if lease:
+                    lease.rejected(response.status_code)
+                error_msg = f"Error {response.status_code}: {response.text}"
+                console.print(f"[red]{error_msg}[/red]")
+                response.raise_for_status()
+
+            self.limiter.on_success(time.monotonic() - start)
+            metrics.headers = metrics.elapsed()
+            if lease:
+                # Released when the call's metrics finish, after the stream
+                lease.succeeded(time.monotonic() - start)
+                metrics.lease = lease
+            if self.cassette is not None:
+                return self.cassette.recorder(response, key, url, start)
+            return response
+
+    def stream(self, payload, files=(), **kwargs):
+        """Send a chat request and yield content deltas as they arrive."""
+        response = self.chat(payload, files, **kwargs)
+        with response:
+            yield from _iter_content(response)
+
+    def complete(self, payload, files=(), **kwargs):
+        """Send a chat request and return the complete response text.
+
+        Holds a slot of the adaptive concurrency limit for the whole request,
+        including reading the stream.
+        """
+        with self.limiter:
+            return "".join(self.stream(payload, files, **kwargs)).strip()
+
+_default_client = None
+_default_client_lock = threading.Lock()
+
+def get_client():
+    """Return the process-wide default client.
+
+    That is a DaemonClient when WCA_DAEMON is set and a daemon answers on its
+    socket (outside dry-run and cassette modes), otherwise a WCAClient. The
+    DaemonClient switches to a WCAClient if the daemon stops answering.
+    """
+    global _default_client
+    from .daemon import _daemon_client
+
+    if _default_client is None:
+        with _default_client_lock:
+            if _default_client is None:
+                _default_client = _daemon_client() or _direct_client()
+    return _default_client
+
+def _direct_client():
+    return WCAClient(session=get_session())
+
+def call_wca_api(payload, file_dict=[], url=None, request_id=None, apikey=None, stop=None):
+    """Call the Watson Code Assistant API with streaming support."""
+    return get_client().chat(payload, file_dict, url=url, request_id=request_id, apikey=apikey, stop=stop)
@@ -0,0 +1,122 @@
+"""Settings shared by the WCA client modules, most of them overridable from the environment."""
+import os
+
+# Default WCA API endpoints
+DEFAULT_BASE_URL = "https://api.dataplatform.cloud.ibm.com/v2/wca/core/chat/text/generation"
+DEFAULT_IBM_IAM_URL = "https://iam.cloud.ibm.com/identity/token"
+IAM_APIKEY = "IAM_APIKEY"
+# Point BASE_URL and IAM_URL at a local server (see wca_stub.py) to run offline
+IAM_URL_ENV = "IAM_URL"
+
+# IAM token caching: refresh this many seconds before expiry, and never hand out
+# a token with less than TOKEN_MIN_VALIDITY seconds left
+TOKEN_REFRESH_MARGIN = 300
+TOKEN_MIN_VALIDITY = 60
+# Set to a file path (or "1" for the default location) to share tokens between processes
+TOKEN_CACHE_ENV = "WCA_TOKEN_CACHE"
+DEFAULT_TOKEN_CACHE_FILE = os.path.join(os.path.expanduser("~"), ".cache", "wca", "tokens.json")
+
+# HTTP connection pooling: keep-alive connections per host, and retries for
+# connection failures and gateway errors before a response is streamed
+DEFAULT_POOL_SIZE = 32
+DEFAULT_MAX_RETRIES = int(os.getenv("WCA_CONNECT_RETRIES", "3"))
+DEFAULT_CONNECT_TIMEOUT = 10
+DEFAULT_READ_TIMEOUT = 180
+
+# Concurrency: the adaptive limit starts at WCA_CONCURRENCY and moves between
+# 1 and WCA_MAX_IN_FLIGHT requests in flight across all batches and threads
+DEFAULT_CONCURRENCY = int(os.getenv("WCA_CONCURRENCY", "4"))
+MAX_IN_FLIGHT = int(os.getenv("WCA_MAX_IN_FLIGHT", "16"))
+
+# Throttling: statuses and timeouts that cut the limit and are retried with
+# jittered exponential backoff (or after Retry-After, when the server sends it)
+THROTTLE_STATUSES = (429, 503)
+THROTTLE_RETRIES = int(os.getenv("WCA_THROTTLE_RETRIES", "5"))
+BACKOFF_BASE = 0.5
+BACKOFF_CAP = 30.0
+
+# Endpoint pool: WCA_ENDPOINTS lists several chat endpoints as comma-separated
+# `URL|APIKEY_VAR` entries, where APIKEY_VAR names the variable holding that
+# endpoint's API key (default IAM_APIKEY). Each request goes to the endpoint
+# with the fewest outstanding requests (WCA_BALANCE=least) or the lowest
+# latency EWMA scaled by its load (WCA_BALANCE=ewma). An endpoint failing
+# WCA_EJECT_AFTER times in a row is ejected for WCA_EJECT_SECONDS (doubling on
+# each repeat) and then let back in by a single probe request
+ENDPOINTS_ENV = "WCA_ENDPOINTS"
+BALANCE = os.getenv("WCA_BALANCE", "least")
+EJECT_AFTER = int(os.getenv("WCA_EJECT_AFTER", "3"))
+EJECT_SECONDS = float(os.getenv("WCA_EJECT_SECONDS", "30"))
+LATENCY_EWMA_ALPHA = 0.3
+
+# Concurrent identical requests (same endpoint, payload and files) share one
+# upstream call; set WCA_COALESCE=0 to send each one separately
+COALESCE = os.getenv("WCA_COALESCE", "1").lower() not in ("0", "false", "no")
+
+# Opt-in hedging: when time-to-first-token passes the given percentile of recent
+# ones, send a duplicate request and keep whichever stream starts first
+HEDGE_ENV = "WCA_HEDGE"
+HEDGE_PERCENTILE = float(os.getenv("WCA_HEDGE_PERCENTILE", "95"))
+HEDGE_BUDGET = float(os.getenv("WCA_HEDGE_BUDGET", "5")) / 100
+HEDGE_DEFAULT_DELAY = 10.0  # until enough samples; same as stream_response's slow notice
+
+# Instrumentation: per-call metrics go to every registered sink. Set WCA_METRICS
+# to a JSON-lines file and/or WCA_METRICS_PROM to a Prometheus textfile path
+METRICS_ENV = "WCA_METRICS"
+METRICS_PROM_ENV = "WCA_METRICS_PROM"
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+GAP_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+RATE_BUCKETS = (1, 5, 10, 25, 50, 100, 250, 500)
+
+# Opt-in response cache: set to a SQLite file path (or "1" for the default location)
+RESPONSE_CACHE_ENV = "WCA_RESPONSE_CACHE"
+DEFAULT_RESPONSE_CACHE_FILE = os.path.join(os.path.expanduser("~"), ".cache", "wca", "responses.sqlite3")
+RESPONSE_CACHE_TTL = float(os.getenv("WCA_RESPONSE_CACHE_TTL", str(7 * 24 * 3600)))
+RESPONSE_CACHE_MAX_BYTES = int(float(os.getenv("WCA_RESPONSE_CACHE_MAX_MB", "512")) * 1024 * 1024)
+
+# Cassettes: WCA_CASSETTE=record captures every chat stream with its timing to
+# WCA_CASSETTE_PATH; WCA_CASSETTE=replay serves them back without the network,
+# as fast as possible or at WCA_CASSETTE_SPEED times the recorded speed
+CASSETTE_ENV = "WCA_CASSETTE"
+CASSETTE_PATH_ENV = "WCA_CASSETTE_PATH"
+DEFAULT_CASSETTE_FILE = "wca-cassette.jsonl.gz"
+CASSETTE_SPEED_ENV = "WCA_CASSETTE_SPEED"
+
+# Request packing: call_packed groups small files into one prompt of up to
+# WCA_PACK_TOKENS (estimated) source tokens and WCA_PACK_MAX_FILES files
+PACK_TOKEN_BUDGET = int(os.getenv("WCA_PACK_TOKENS", "3000"))
+PACK_MAX_FILES = int(os.getenv("WCA_PACK_MAX_FILES", "8"))
+
+# Prompt budget: prompt builders trim, chunk or refuse their inputs so a prompt
+# stays within WCA_PROMPT_TOKENS tokens. Tokens are estimated locally unless
+# WCA_TOKENIZER names a tokenizer.json (or Hugging Face model) for exact counts,
+# which needs the optional `tokenizers` package. --dry-run (WCA_DRY_RUN=1)
+# reports the estimated usage, priced at WCA_COST_PER_1K_TOKENS, without sending
+PROMPT_TOKEN_LIMIT = int(os.getenv("WCA_PROMPT_TOKENS", "16000"))
+TOKENIZER_ENV = "WCA_TOKENIZER"
+CHARS_PER_TOKEN = 3.5
+COST_PER_1K_TOKENS = float(os.getenv("WCA_COST_PER_1K_TOKENS", "0"))
+DRY_RUN_ENV = "WCA_DRY_RUN"
+
+# Job journal: batch commands record each unit of work in JOURNAL_FILE in the
+# output directory, so --resume can skip what an interrupted run finished.
+# Records are written as they happen and fsynced every JOURNAL_SYNC_EVERY
+# records or JOURNAL_SYNC_INTERVAL seconds
+JOURNAL_FILE = ".wca-journal.jsonl"
+JOURNAL_SYNC_EVERY = 32
+JOURNAL_SYNC_INTERVAL = 1.0
+
+# Shared daemon: the `daemon` command serves chat requests on a Unix socket
+# from one warm client (token, connections, response cache and limiter). With
+# WCA_DAEMON set to its socket path (or "1" for DEFAULT_DAEMON_SOCKET) the CLIs
+# send their requests there, and call WCA themselves when no daemon answers
+DAEMON_ENV = "WCA_DAEMON"
+DEFAULT_DAEMON_SOCKET = os.path.join(os.path.expanduser("~"), ".cache", "wca", "daemon.sock")
+DAEMON_CONNECT_TIMEOUT = 2.0
+
+# Streamed output: deltas are drawn at most RENDER_FPS times a second, files are
+# flushed every FILE_FLUSH_INTERVAL seconds or FILE_FLUSH_BYTES, and quiet mode
+# (WCA_QUIET=1 or --quiet) skips the spinner and the echo entirely
+RENDER_FPS = float(os.getenv("WCA_RENDER_FPS", "10"))
+FILE_FLUSH_INTERVAL = 1.0
+FILE_FLUSH_BYTES = 64 * 1024
+QUIET_ENV = "WCA_QUIET"
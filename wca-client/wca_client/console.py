@@ -0,0 +1,4 @@
+"""The rich console the client prints its warnings and stats to."""
+from rich.console import Console
+
+console = Console()
@@ -0,0 +1,459 @@
+"""The WCA daemon: one warm client serving the requests of other processes."""
+import os
+import json
+import time
+import threading
+import contextlib
+
+from .console import console
+from .config import DAEMON_CONNECT_TIMEOUT, DAEMON_ENV, DEFAULT_BASE_URL, DEFAULT_DAEMON_SOCKET
+from .budget import is_dry_run, token_usage
+from .cache import get_response_cache
+from .cassette import get_cassette
+from .client import WCAClient, _direct_client
+from .metrics import CallMetrics
+from .responses import FlightResponse, ReplayResponse
+from .stream import (
+    StopAtCodeBlock, StopAtJsonObject, StopCondition, _iter_content, as_stop_condition,
+)
+from .transport import get_session
+
+class DaemonError(RuntimeError):
+    """A request sent through the WCA daemon failed; ``status`` is WCA's HTTP status, if any."""
+
+    def __init__(self, message, status=None):
+        super().__init__(message)
+        self.status = status
+
+class DaemonDropped(DaemonError):
+    """The WCA daemon closed the connection before the response ended (it stopped or crashed)."""
+
+def daemon_socket():
+    """Return the WCA_DAEMON socket path, or None when no daemon is configured."""
+    value = os.getenv(DAEMON_ENV, "")
+    if not value or value.lower() in ("0", "false", "no"):
+        return None
+    if value.lower() in ("1", "true", "yes"):
+        return DEFAULT_DAEMON_SOCKET
+    return os.path.expanduser(value)
+
+def _daemon_request(path, request, timeout=None):
+    """Send one request line to the daemon at ``path``; return the socket and a reader."""
+    import socket
+
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.settimeout(DAEMON_CONNECT_TIMEOUT)
+        sock.connect(path)
+        sock.settimeout(timeout)
+        sock.sendall(json.dumps(request).encode('utf-8') + b'\n')
+        return sock, sock.makefile('rb')
+    except BaseException:
+        sock.close()
+        raise
+
+def daemon_stats(path=None):
+    """Return the stats of the daemon listening on ``path``, or None if none answers."""
+    path = path or daemon_socket() or DEFAULT_DAEMON_SOCKET
+    try:
+        sock, reader = _daemon_request(path, {'op': 'stats'}, timeout=DAEMON_CONNECT_TIMEOUT)
+        with sock, reader:
+            line = reader.readline()
+        return json.loads(line) if line else None
+    except (OSError, ValueError):
+        return None
+
+def _daemon_client():
+    path = daemon_socket()
+    if path is None or is_dry_run() or get_cassette() is not None:
+        return None
+    if daemon_stats(path) is None:
+        console.print(f"[dim]No WCA daemon answering on {path}; calling WCA directly[/dim]")
+        return None
+    return DaemonClient(path, fallback=_direct_client)
+
+class _ClientStop(StopCondition):
+    """Daemon side of a stop condition only the client can evaluate.
+
+    Never matches (the client drops the connection when its own condition
+    does), and being anonymous keeps the stream out of the cache and flights.
+    """
+
+    def matcher(self):
+        return lambda delta: False
+
+def _stop_spec(stop):
+    # The built-in conditions are rebuilt in the daemon, so their truncated
+    # responses are cached and shared there; any other runs in the client
+    if stop is None:
+        return None
+    if isinstance(stop, (StopAtCodeBlock, StopAtJsonObject)):
+        return stop.name
+    return 'client'
+
+def _stop_from_spec(spec):
+    if spec is None:
+        return None
+    if spec == StopAtJsonObject.name:
+        return StopAtJsonObject()
+    if spec.startswith('code-block:'):
+        language = spec.split(':', 1)[1]
+        return StopAtCodeBlock(None if language == '*' else language)
+    return _ClientStop()
+
+class DaemonResponse(ReplayResponse):
+    """Streaming response relayed by the WCA daemon, read line by line from its socket."""
+
+    def __init__(self, sock, reader, source, metrics=None, stop=None, retry=None):
+        self._sock = sock
+        self._reader = reader
+        self.source = source
+        self.from_cache = source == 'cache'
+        self._metrics = metrics
+        self._stop = stop.matcher() if stop is not None else None
+        self._retry = retry
+        self.stopped = False
+
+    def _deltas(self):
+        relay = self._relay()
+        relayed = 0
+        try:
+            for content in relay:
+                relayed += 1
+                yield content
+            return
+        except DaemonDropped as e:
+            # Once output has reached the caller the request cannot be sent again
+            if relayed or self._retry is None:
+                raise
+            error = e
+        finally:
+            relay.close()
+        response = self._retry(error)
+        with response:
+            yield from _iter_content(response)
+        self.stopped = getattr(response, 'stopped', False)
+
+    def _lines(self):
+        try:
+            yield from self._reader
+        except ConnectionError as e:
+            raise DaemonDropped(f"The WCA daemon dropped the connection: {e}") from e
+        raise DaemonDropped("The WCA daemon closed the connection before the response ended")
+
+    def _relay(self):
+        try:
+            for line in self._lines():
+                message = json.loads(line)
+                if 'error' in message:
+                    raise DaemonError(message['error'], message.get('status'))
+                if 'delta' not in message:
+                    self.stopped = message.get('stopped', False)
+                    break
+                content = message['delta']
+                if self._metrics:
+                    self._metrics.delta(content)
+                yield content
+                if self._stop is not None and self._stop(content):
+                    # Closing the connection makes the daemon drop the WCA stream
+                    self.stopped = True
+                    break
+        except BaseException as e:
+            if self._metrics:
+                self._metrics.finish(e)
+            self.close()
+            raise
+        if self._metrics:
+            self._metrics.stopped = self.stopped
+            self._metrics.finish()
+        self.close()
+
+    @property
+    def text(self):
+        return "".join(self._deltas())
+
+    def close(self):
+        if self._metrics:
+            self._metrics.finish('closed')
+        self._reader.close()
+        self._sock.close()
+
+class DaemonClient:
+    """Client that sends chat requests to a running WCA daemon.
+
+    Has the ``chat``/``stream``/``complete`` interface of WCAClient. The
+    daemon holds the token, connections, response cache and concurrency
+    limit shared by every process using it; this side only counts prompt
+    tokens and records call metrics. It needs neither requests nor an API key.
+
+    ``fallback`` builds the client to use instead once the daemon stops
+    answering (it was stopped or restarted). A request the daemon drops
+    before any of its output reached the caller is sent again through that
+    client. Without a fallback, those requests raise DaemonError.
+    """
+
+    def __init__(self, path=None, timeout=None, fallback=None):
+        self.path = path or daemon_socket() or DEFAULT_DAEMON_SOCKET
+        self.url = os.getenv("BASE_URL", DEFAULT_BASE_URL)
+        self.timeout = timeout
+        self.fallback = fallback
+        self.direct = None
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        if self.direct is not None:
+            self.direct.close()
+
+    def _fall_back(self, error):
+        with self._lock:
+            if self.direct is None:
+                console.print(f"[dim]The WCA daemon on {self.path} stopped answering ({error}); calling WCA directly[/dim]")
+                self.direct = self.fallback()
+        return self.direct
+
+    def chat(self, payload, files=(), url=None, request_id=None, apikey=None, stop=None):
+        """Send a chat request through the daemon and return a DaemonResponse.
+
+        Errors the daemon reports before the stream starts (such as a
+        rejected request) are raised here as DaemonError.
+        """
+        if self.direct is not None:
+            return self.direct.chat(payload, files, url=url, request_id=request_id, apikey=apikey, stop=stop)
+        stop = as_stop_condition(stop)
+        if is_dry_run():
+            token_usage.add_request(payload, files)
+            return ReplayResponse("")
+        metrics = CallMetrics(url or self.url, request_id)
+        spec = _stop_spec(stop)
+        request = {
+            'payload': payload,
+            'files': [os.path.abspath(a_file) for a_file in files],
+            'url': url,
+            'request_id': request_id,
+            'apikey': apikey,
+            'stop': spec,
+        }
+        retry = None
+        if self.fallback is not None:
+            def retry(error):
+                return self._fall_back(error).chat(payload, files, url=url, request_id=request_id, apikey=apikey, stop=stop)
+        try:
+            sock, reader = _daemon_request(self.path, request, self.timeout)
+        except OSError as e:
+            if retry is not None:
+                return retry(e)
+            metrics.finish(e)
+            raise DaemonError(f"No WCA daemon answering on {self.path}: {e}") from e
+        try:
+            try:
+                line = reader.readline()
+            except ConnectionError as e:
+                raise DaemonDropped(f"The WCA daemon dropped the connection: {e}") from e
+            if not line:
+                raise DaemonDropped("The WCA daemon closed the connection")
+            message = json.loads(line)
+        except BaseException as e:
+            reader.close()
+            sock.close()
+            metrics.finish(e)
+            if retry is not None and isinstance(e, DaemonDropped):
+                return retry(e)
+            raise
+        metrics.status = message.get('status')
+        if 'error' in message:
+            reader.close()
+            sock.close()
+            metrics.finish(message['error'])
+            raise DaemonError(message['error'], metrics.status)
+        metrics.source = message['source']
+        metrics.headers = metrics.elapsed()
+        if metrics.source == 'network':
+            token_usage.add_request(payload, files)
+        return DaemonResponse(sock, reader, metrics.source, metrics, stop if spec == 'client' else None, retry)
+
+    def stream(self, payload, files=(), **kwargs):
+        """Send a chat request and yield content deltas as they arrive."""
+        response = self.chat(payload, files, **kwargs)
+        with response:
+            yield from _iter_content(response)
+
+    def complete(self, payload, files=(), **kwargs):
+        """Send a chat request and return the complete response text.
+
+        The daemon applies the concurrency limit, so this side does not
+        (the fallback client does, once it is in use).
+        """
+        if self.direct is not None:
+            return self.direct.complete(payload, files, **kwargs)
+        return "".join(self.stream(payload, files, **kwargs)).strip()
+
+def _response_source(response):
+    if response.from_cache:
+        return 'cache'
+    return 'coalesced' if isinstance(response, FlightResponse) else 'network'
+
+class WCADaemon:
+    """Serves DaemonClients on a Unix socket from one long-lived WCAClient.
+
+    Each connection carries one JSON request line and gets back a header
+    line, one line per content delta and an end line, or an error line.
+    A request holds a slot of the client's adaptive limiter while it
+    streams, so the limit applies across all the processes using the daemon.
+    """
+
+    def __init__(self, path=None, client=None):
+        import socket
+
+        self.path = path or daemon_socket() or DEFAULT_DAEMON_SOCKET
+        if os.path.exists(self.path):
+            if daemon_stats(self.path) is not None:
+                raise RuntimeError(f"A WCA daemon is already listening on {self.path}")
+            # Left behind by a daemon that did not shut down cleanly
+            os.unlink(self.path)
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        self.client = client or WCAClient(session=get_session())
+        self.started = time.time()
+        self.requests = 0
+        self.active = 0
+        self._lock = threading.Lock()
+        self._closed = threading.Event()
+        self._socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        umask = os.umask(0o077)  # only this user may connect
+        try:
+            self._socket.bind(self.path)
+        finally:
+            os.umask(umask)
+        self._socket.listen(128)
+        # accept() wakes up regularly to notice shutdown()
+        self._socket.settimeout(0.5)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.shutdown()
+
+    def warm(self):
+        """Fetch the IAM tokens up front so the first requests do not wait for them."""
+        pool = self.client.pool
+        for apikey in [endpoint.apikey for endpoint in pool.endpoints] if pool else [None]:
+            self.client._token(apikey)
+
+    def serve_forever(self):
+        """Accept connections until shutdown(), each served on its own thread."""
+        import socket
+
+        while not self._closed.is_set():
+            try:
+                conn, _ = self._socket.accept()
+            except socket.timeout:
+                continue
+            except OSError:
+                if self._closed.is_set():
+                    break
+                raise
+            threading.Thread(target=self._handle, args=(conn,), name="wca-daemon", daemon=True).start()
+
+    def shutdown(self):
+        """Stop accepting connections and remove the socket."""
+        if self._closed.is_set():
+            return
+        self._closed.set()
+        self._socket.close()
+        with contextlib.suppress(FileNotFoundError):
+            os.unlink(self.path)
+
+    def stats(self):
+        cache = get_response_cache()
+        pool = self.client.pool
+        with self._lock:
+            stats = {
+                'socket': self.path,
+                'pid': os.getpid(),
+                'uptime': round(time.time() - self.started, 1),
+                'requests': self.requests,
+                'active': self.active,
+            }
+        stats['limiter'] = self.client.limiter.stats()
+        stats['cache'] = cache.stats() if cache is not None else None
+        stats['endpoints'] = pool.stats()['endpoints'] if pool else None
+        return stats
+
+    def _handle(self, conn):
+        with conn, conn.makefile('rb') as reader:
+            try:
+                request = json.loads(reader.readline() or 'null')
+            except ValueError:
+                request = None
+            if not isinstance(request, dict):
+                return
+            if request.get('op') == 'stats':
+                with contextlib.suppress(OSError):
+                    self._send(conn, self.stats())
+                return
+            with self._lock:
+                self.requests += 1
+                self.active += 1
+            try:
+                self._chat(conn, request)
+            finally:
+                with self._lock:
+                    self.active -= 1
+
+    def _chat(self, conn, request):
+        client = self.client
+        try:
+            with client.limiter:
+                response = client.chat(
+                    request['payload'], request.get('files') or (), url=request.get('url'),
+                    request_id=request.get('request_id'), apikey=request.get('apikey'),
+                    stop=_stop_from_spec(request.get('stop')),
+                )
+                with response:
+                    self._send(conn, {'status': 200, 'source': _response_source(response)})
+                    for content in _iter_content(response):
+                        self._send(conn, {'delta': content})
+            self._send(conn, {'end': True, 'stopped': getattr(response, 'stopped', False)})
+        except (BrokenPipeError, ConnectionResetError):
+            # The client went away (or its stop condition matched); leaving
+            # the with block has already dropped the WCA stream, unless
+            # coalesced callers are still reading it
+            pass
+        except Exception as e:
+            status = getattr(getattr(e, 'response', None), 'status_code', None)
+            with contextlib.suppress(OSError):
+                self._send(conn, {'error': str(e) or type(e).__name__, 'status': status})
+
+    @staticmethod
+    def _send(conn, message):
+        conn.sendall(json.dumps(message).encode('utf-8') + b'\n')
+
+def serve_daemon(path=None):
+    """Run the WCA daemon in the foreground until interrupted.
+
+    Raises RuntimeError or OSError if the socket cannot be bound (e.g. another
+    daemon is already listening on it).
+    """
+    server = WCADaemon(path)
+    try:
+        server.warm()
+    except Exception as e:
+        console.print(f"[yellow]Could not fetch an IAM token yet: {e}[/yellow]")
+    console.print(f"[green]WCA daemon listening on {server.path}[/green]")
+    console.print(f"  export {DAEMON_ENV}={server.path}")
+    import signal
+
+    # Shut down cleanly (removing the socket) on SIGTERM as well as Ctrl+C
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.shutdown()
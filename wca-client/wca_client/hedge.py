@@ -0,0 +1,68 @@
+"""Hedged requests: when a slow WCA request gets a duplicate."""
+import os
+import threading
+from collections import deque
+
+from .config import HEDGE_BUDGET, HEDGE_DEFAULT_DELAY, HEDGE_ENV, HEDGE_PERCENTILE
+
+class HedgePolicy:
+    """Decides when a slow WCA request gets a duplicate ("hedge").
+
+    Keeps a window of recent time-to-first-token samples; a request that has
+    not produced content after ``percentile`` of them is hedged, as long as
+    hedges stay within ``budget`` (a fraction) of all requests.
+    """
+
+    def __init__(self, percentile=HEDGE_PERCENTILE, budget=HEDGE_BUDGET, window=200,
+                 min_samples=20, default_delay=HEDGE_DEFAULT_DELAY):
+        self.percentile = percentile
+        self.budget = budget
+        self.min_samples = min_samples
+        self.default_delay = default_delay
+        self.requests = 0
+        self.hedges = 0
+        self.wins = 0
+        self._samples = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def begin(self):
+        """Count a new request and return how long to wait before hedging it."""
+        with self._lock:
+            self.requests += 1
+            if len(self._samples) < self.min_samples:
+                return self.default_delay
+            ordered = sorted(self._samples)
+            return ordered[min(len(ordered) - 1, int(len(ordered) * self.percentile / 100))]
+
+    def try_hedge(self):
+        """Claim a hedge if the budget allows one."""
+        with self._lock:
+            if self.hedges + 1 > self.budget * self.requests:
+                return False
+            self.hedges += 1
+            return True
+
+    def observe(self, ttft, hedged_won=False):
+        """Record the winning stream's time to first token."""
+        with self._lock:
+            self._samples.append(ttft)
+            if hedged_won:
+                self.wins += 1
+
+    def stats(self):
+        with self._lock:
+            return {'requests': self.requests, 'hedges': self.hedges, 'wins': self.wins}
+
+_hedge_policy = None
+_hedge_policy_lock = threading.Lock()
+
+def get_hedge_policy():
+    """Return the process-wide HedgePolicy, or None unless WCA_HEDGE is set."""
+    global _hedge_policy
+    if os.getenv(HEDGE_ENV, "").lower() not in ("1", "true", "yes", "on"):
+        return None
+    if _hedge_policy is None:
+        with _hedge_policy_lock:
+            if _hedge_policy is None:
+                _hedge_policy = HedgePolicy()
+    return _hedge_policy
@@ -0,0 +1,99 @@
+"""The job journal that lets an interrupted run resume where it stopped."""
+import os
+import json
+import time
+import hashlib
+import tempfile
+import threading
+
+from .config import JOURNAL_FILE, JOURNAL_SYNC_EVERY, JOURNAL_SYNC_INTERVAL
+from .budget import is_dry_run
+
+def content_hash(text):
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+class JobJournal:
+    """Append-only journal of the units of work of a batch command.
+
+    Each line records a unit's name, the hashes of its input and prompt, its
+    status ('done' or 'failed') and output path. A torn last line from a crash
+    is ignored on load, and ``close`` compacts the file to the latest record
+    per unit through an atomic rename. Nothing is recorded in dry-run mode.
+    """
+
+    def __init__(self, directory, resume=False, sync_every=JOURNAL_SYNC_EVERY, sync_interval=JOURNAL_SYNC_INTERVAL):
+        self.path = os.path.join(directory, JOURNAL_FILE)
+        self.sync_every = sync_every
+        self.sync_interval = sync_interval
+        self.entries = {}
+        self.skipped = 0
+        self._lock = threading.Lock()
+        self._unsynced = 0
+        self._synced_at = time.monotonic()
+        if resume:
+            self._load()
+        os.makedirs(directory, exist_ok=True)
+        self._file = open(self.path, 'a', encoding='utf-8')
+
+    def _load(self):
+        try:
+            with open(self.path, encoding='utf-8') as file:
+                for line in file:
+                    try:
+                        entry = json.loads(line)
+                        self.entries[entry['unit']] = entry
+                    except (ValueError, KeyError, TypeError):
+                        continue
+        except FileNotFoundError:
+            pass
+
+    def completed(self, unit, input_hash, prompt_hash):
+        """True if ``unit`` finished in an earlier run from the same input and prompt."""
+        entry = self.entries.get(unit)
+        if not entry or entry['status'] != 'done' or (entry['input'], entry['prompt']) != (input_hash, prompt_hash):
+            return False
+        output = entry.get('output')
+        if output and not (os.path.exists(output) and os.path.getsize(output)):
+            return False
+        self.skipped += 1
+        return True
+
+    def record(self, unit, input_hash, prompt_hash, status, output=None, error=None):
+        if is_dry_run():
+            return
+        entry = {'unit': unit, 'input': input_hash, 'prompt': prompt_hash, 'status': status,
+                 'output': None if output is None else str(output), 'time': time.time()}
+        if error is not None:
+            entry['error'] = str(error)
+        with self._lock:
+            self.entries[unit] = entry
+            self._file.write(json.dumps(entry, ensure_ascii=False) + '\n')
+            self._file.flush()
+            self._unsynced += 1
+            if self._unsynced >= self.sync_every or time.monotonic() - self._synced_at >= self.sync_interval:
+                self._sync()
+
+    def _sync(self):
+        os.fsync(self._file.fileno())
+        self._unsynced = 0
+        self._synced_at = time.monotonic()
+
+    def close(self):
+        with self._lock:
+            if self._file.closed:
+                return
+            self._sync()
+            self._file.close()
+            fd, tmp = tempfile.mkstemp(dir=os.path.dirname(self.path), suffix='.tmp')
+            with os.fdopen(fd, 'w', encoding='utf-8') as file:
+                for entry in self.entries.values():
+                    file.write(json.dumps(entry, ensure_ascii=False) + '\n')
+                file.flush()
+                os.fsync(file.fileno())
+            os.replace(tmp, self.path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,171 @@
+"""Adaptive limit on concurrent WCA requests."""
+import time
+import random
+import threading
+import contextlib
+
+from .console import console
+from .config import BACKOFF_BASE, BACKOFF_CAP, DEFAULT_CONCURRENCY, MAX_IN_FLIGHT
+from .pool import _endpoint_pool
+
+class AdaptiveLimiter:
+    """AIMD limit on concurrent WCA requests.
+
+    Use as a context manager around a request (``async with`` on an event
+    loop; one limiter can serve threads and event loops at once). The limit grows by about one
+    slot per round trip while latency stays within ``latency_tolerance`` of the
+    best seen, and is multiplied by ``backoff_ratio`` on a 429/503 or timeout.
+    A Retry-After from the server holds back new requests until it has passed.
+    """
+
+    def __init__(self, initial=DEFAULT_CONCURRENCY, min_limit=1, max_limit=MAX_IN_FLIGHT,
+                 backoff_ratio=0.5, latency_tolerance=2.0):
+        self.min_limit = min_limit
+        self.max_limit = max(min_limit, max_limit)
+        self.limit = float(min(max(initial, min_limit), self.max_limit))
+        self.backoff_ratio = backoff_ratio
+        self.latency_tolerance = latency_tolerance
+        self.in_flight = 0
+        self.successes = 0
+        self.throttled = 0
+        self.timeouts = 0
+        self.retries = 0
+        self._baseline = None
+        self._last_cut = 0.0
+        self._paused_until = 0.0
+        self._cond = threading.Condition()
+        self._async_waiters = []  # (loop, future) of coroutines waiting in aacquire
+
+    def __enter__(self):
+        with self._cond:
+            while True:
+                pause = self._paused_until - time.monotonic()
+                if pause > 0:
+                    self._cond.wait(pause)
+                elif self.in_flight >= int(self.limit):
+                    self._cond.wait()
+                else:
+                    break
+            self.in_flight += 1
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+    async def __aenter__(self):
+        await self.aacquire()
+        return self
+
+    async def __aexit__(self, *exc):
+        self.release()
+
+    async def aacquire(self):
+        """Take a slot without blocking the event loop; pair with ``release``."""
+        import asyncio
+
+        loop = asyncio.get_running_loop()
+        while True:
+            with self._cond:
+                pause = self._paused_until - time.monotonic()
+                if pause <= 0 and self.in_flight < int(self.limit):
+                    self.in_flight += 1
+                    return
+                waiter = (loop, loop.create_future())
+                self._async_waiters.append(waiter)
+            try:
+                await asyncio.wait({waiter[1]}, timeout=pause if pause > 0 else None)
+            finally:
+                with self._cond:
+                    if waiter in self._async_waiters:
+                        self._async_waiters.remove(waiter)
+
+    def release(self):
+        """Give back a slot taken with ``aacquire`` or ``with``."""
+        with self._cond:
+            self.in_flight -= 1
+            self._notify()
+
+    def _notify(self, everyone=False):
+        # Called with self._cond held. Waiting coroutines all recheck: the
+        # ones that find no free slot simply wait again
+        if everyone:
+            self._cond.notify_all()
+        else:
+            self._cond.notify()
+        for loop, future in self._async_waiters:
+            with contextlib.suppress(RuntimeError):  # the waiter's loop is closed
+                loop.call_soon_threadsafe(_wake, future)
+        self._async_waiters.clear()
+
+    def pause_remaining(self):
+        """Seconds left before the server's Retry-After allows new requests."""
+        return max(0.0, self._paused_until - time.monotonic())
+
+    def on_success(self, latency):
+        """Record a successful round trip; grow the limit if latency is stable."""
+        with self._cond:
+            self.successes += 1
+            # Slowly forget the best latency so a permanent shift is relearned
+            self._baseline = latency if self._baseline is None else min(latency, self._baseline * 1.01)
+            saturated = self.in_flight >= int(self.limit)
+            if saturated and latency <= self._baseline * self.latency_tolerance and self.limit < self.max_limit:
+                self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+                self._notify(everyone=True)
+
+    def on_throttle(self, retry_after=None, timeout=False):
+        """Record a 429/503 or timeout and cut the limit."""
+        with self._cond:
+            now = time.monotonic()
+            if timeout:
+                self.timeouts += 1
+            else:
+                self.throttled += 1
+            if retry_after:
+                self._paused_until = max(self._paused_until, now + retry_after)
+            # Requests already in flight when the limit was cut report the same
+            # overload; cut at most once per round trip
+            if now - self._last_cut >= (self._baseline or 0):
+                self.limit = max(self.min_limit, self.limit * self.backoff_ratio)
+                self._last_cut = now
+
+    def retry_delay(self, attempt, retry_after=None):
+        """Count a retry and return how long to wait before it."""
+        with self._cond:
+            self.retries += 1
+        if retry_after is not None:
+            # Spread out the callers that were all told the same Retry-After
+            return retry_after + random.uniform(0, BACKOFF_BASE)
+        return random.uniform(0, min(BACKOFF_CAP, BACKOFF_BASE * 2 ** attempt))
+
+    def stats(self):
+        """Return the current limit and throttling counters."""
+        with self._cond:
+            return {
+                'limit': int(self.limit),
+                'in_flight': self.in_flight,
+                'successes': self.successes,
+                'throttled': self.throttled,
+                'timeouts': self.timeouts,
+                'retries': self.retries,
+            }
+
+def _wake(future):
+    if not future.done():
+        future.set_result(None)
+
+# Each pooled endpoint brings its own quota
+_limiter = AdaptiveLimiter(max_limit=MAX_IN_FLIGHT * (len(_endpoint_pool) if _endpoint_pool else 1))
+
+def get_limiter():
+    """Return the process-wide AdaptiveLimiter shared by all clients."""
+    return _limiter
+
+def print_limiter_stats():
+    """Print the concurrency limit and throttling counts, if WCA pushed back."""
+    stats = _limiter.stats()
+    if not (stats['throttled'] or stats['timeouts']):
+        return
+    console.print(
+        f"[dim]WCA throttling: {stats['throttled']} rate-limited, {stats['timeouts']} timed out, "
+        f"{stats['retries']} retries; concurrency limit settled at {stats['limit']}[/dim]"
+    )
@@ -0,0 +1,272 @@
+"""Per-call metrics and the sinks they are reported to."""
+import os
+import json
+import time
+import bisect
+import tempfile
+import threading
+
+from .console import console
+from .config import GAP_BUCKETS, LATENCY_BUCKETS, METRICS_ENV, METRICS_PROM_ENV, RATE_BUCKETS
+
+class Histogram:
+    """Fixed-bucket histogram (Prometheus ``le`` semantics)."""
+
+    def __init__(self, buckets):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)  # last one is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def merge(self, other):
+        for index, count in enumerate(other.counts):
+            self.counts[index] += count
+        self.sum += other.sum
+        self.count += other.count
+
+    def quantile(self, q):
+        """Upper bound of the bucket holding the q-th quantile, or None if empty."""
+        if not self.count:
+            return None
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float('inf'),), self.counts):
+            cumulative += count
+            if cumulative >= q * self.count:
+                return bound
+        return float('inf')
+
+    def to_dict(self):
+        labels = [str(bound) for bound in self.buckets] + ['+Inf']
+        return dict(zip(labels, self.counts))
+
+class CallMetrics:
+    """Timings and sizes of one WCA call, filled in as the call progresses.
+
+    All times are seconds from the start of the call. ``source`` is
+    ``network``, ``cache``, ``coalesced``, ``cassette`` or ``hedge`` (the
+    duplicate request of a hedged call). Sinks receive the object once
+    ``finish()`` has been called.
+    """
+
+    def __init__(self, url, request_id=None, source='network'):
+        self.url = url
+        self.request_id = request_id
+        self.source = source
+        self.started = time.time()
+        self.token = 0.0
+        self.connect = 0.0
+        self.headers = None
+        self.ttft = None
+        self.total = None
+        self.status = None
+        self.error = None
+        self.retries = 0
+        self.hedged = False
+        self.stopped = False
+        self.endpoint = None
+        self.lease = None
+        self.bytes_up = 0
+        self.deltas = 0
+        self.chars = 0
+        self.gaps = Histogram(GAP_BUCKETS)
+        self._start = time.perf_counter()
+        self._last = None
+        self._connect_start = None
+
+    def elapsed(self):
+        return time.perf_counter() - self._start
+
+    def delta(self, content):
+        """Record a content delta arriving now."""
+        now = self.elapsed()
+        if self.ttft is None:
+            self.ttft = now
+        else:
+            self.gaps.observe(now - self._last)
+        self._last = now
+        self.deltas += 1
+        self.chars += len(content)
+
+    @property
+    def tokens_per_sec(self):
+        # Each streamed delta is roughly one generated token
+        if self.deltas < 2 or not self.total or self.total <= self.ttft:
+            return None
+        return (self.deltas - 1) / (self.total - self.ttft)
+
+    async def atrace(self, event_name, info):
+        """httpx/httpcore trace hook: accumulate TCP connect and TLS time."""
+        if not event_name.startswith(('connection.connect_tcp.', 'connection.start_tls.')):
+            return
+        if event_name.endswith('.started'):
+            self._connect_start = time.perf_counter()
+        elif self._connect_start is not None:
+            self.connect += time.perf_counter() - self._connect_start
+            self._connect_start = None
+
+    def finish(self, error=None):
+        """Stamp the total time and hand the record to the sinks (once)."""
+        if self.total is not None:
+            return
+        self.total = self.elapsed()
+        if error is not None:
+            self.error = error if isinstance(error, str) else type(error).__name__
+        if self.lease is not None:
+            self.lease.release(self.deltas)
+        _emit_metrics(self)
+
+    def to_dict(self):
+        def seconds(value):
+            return None if value is None else round(value, 6)
+        return {
+            'started': round(self.started, 3),
+            'request_id': self.request_id,
+            'url': self.url,
+            'endpoint': self.endpoint,
+            'source': self.source,
+            'status': self.status,
+            'error': self.error,
+            'retries': self.retries,
+            'hedged': self.hedged,
+            'stopped': self.stopped,
+            'token_s': seconds(self.token),
+            'connect_s': seconds(self.connect),
+            'headers_s': seconds(self.headers),
+            'ttft_s': seconds(self.ttft),
+            'total_s': seconds(self.total),
+            'deltas': self.deltas,
+            'chars': self.chars,
+            'tokens_per_sec': seconds(self.tokens_per_sec),
+            'bytes_up': self.bytes_up,
+            'gaps': self.gaps.to_dict(),
+        }
+
+def _record_replay(metrics, text):
+    """Record a call answered from the response cache."""
+    metrics.source = 'cache'
+    metrics.status = 200
+    metrics.delta(text)
+    metrics.finish()
+
+class MetricsRegistry:
+    """In-process sink aggregating calls into histograms and counters."""
+
+    HISTOGRAMS = {
+        'token_seconds': ('Time spent obtaining the IAM bearer token', LATENCY_BUCKETS, 'token'),
+        'connect_seconds': ('DNS, TCP connect and TLS time for new connections', LATENCY_BUCKETS, 'connect'),
+        'headers_seconds': ('Time until WCA response headers', LATENCY_BUCKETS, 'headers'),
+        'ttft_seconds': ('Time to first content token', LATENCY_BUCKETS, 'ttft'),
+        'duration_seconds': ('Total call duration', LATENCY_BUCKETS, 'total'),
+        'tokens_per_second': ('Generation rate after the first token', RATE_BUCKETS, 'tokens_per_sec'),
+    }
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.histograms = {name: Histogram(spec[1]) for name, spec in self.HISTOGRAMS.items()}
+            self.histograms['inter_token_gap_seconds'] = Histogram(GAP_BUCKETS)
+            self.calls = {}
+            self.totals = {'output_tokens': 0, 'output_chars': 0, 'upload_bytes': 0, 'retries': 0}
+
+    def __call__(self, metrics):
+        with self._lock:
+            for name, (_, _, attribute) in self.HISTOGRAMS.items():
+                value = getattr(metrics, attribute)
+                if value is not None:
+                    self.histograms[name].observe(value)
+            self.histograms['inter_token_gap_seconds'].merge(metrics.gaps)
+            outcome = metrics.error or 'ok'
+            labels = (metrics.source, str(metrics.status or ''), outcome)
+            self.calls[labels] = self.calls.get(labels, 0) + 1
+            self.totals['output_tokens'] += metrics.deltas
+            self.totals['output_chars'] += metrics.chars
+            self.totals['upload_bytes'] += metrics.bytes_up
+            self.totals['retries'] += metrics.retries
+
+    def render_prometheus(self, prefix='wca'):
+        """Render everything in the Prometheus text exposition format."""
+        lines = []
+        with self._lock:
+            lines += [f'# HELP {prefix}_calls_total WCA chat calls',
+                      f'# TYPE {prefix}_calls_total counter']
+            for (source, status, outcome), count in sorted(self.calls.items()):
+                lines.append(f'{prefix}_calls_total{{source="{source}",status="{status}",outcome="{outcome}"}} {count}')
+            for name, value in self.totals.items():
+                lines += [f'# TYPE {prefix}_{name}_total counter', f'{prefix}_{name}_total {value}']
+            for name, histogram in self.histograms.items():
+                help_text = self.HISTOGRAMS.get(name, ('Gap between consecutive content tokens',))[0]
+                lines += [f'# HELP {prefix}_{name} {help_text}', f'# TYPE {prefix}_{name} histogram']
+                cumulative = 0
+                for label, count in histogram.to_dict().items():
+                    cumulative += count
+                    lines.append(f'{prefix}_{name}_bucket{{le="{label}"}} {cumulative}')
+                lines += [f'{prefix}_{name}_sum {histogram.sum}', f'{prefix}_{name}_count {histogram.count}']
+        return '\n'.join(lines) + '\n'
+
+class JsonlSink:
+    """Sink appending one JSON object per call to a file."""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def __call__(self, metrics):
+        line = json.dumps(metrics.to_dict()) + '\n'
+        with self._lock, open(self.path, 'a') as file:
+            file.write(line)
+
+class PrometheusTextfileSink:
+    """Sink rewriting a registry's Prometheus text to a file after every call.
+
+    Point node_exporter's textfile collector at the directory to scrape it.
+    """
+
+    def __init__(self, path, registry=None):
+        self.path = path
+        self.registry = registry or metrics_registry
+        self._lock = threading.Lock()
+
+    def __call__(self, metrics):
+        text = self.registry.render_prometheus()
+        with self._lock:
+            # Write then rename, so a scrape never sees a partial file
+            directory = os.path.dirname(os.path.abspath(self.path))
+            fd, tmp = tempfile.mkstemp(dir=directory, suffix='.tmp')
+            with os.fdopen(fd, 'w') as file:
+                file.write(text)
+            os.replace(tmp, self.path)
+
+metrics_registry = MetricsRegistry()
+_metrics_sinks = [metrics_registry]
+
+def add_metrics_sink(sink):
+    """Register a callable that receives each finished CallMetrics."""
+    _metrics_sinks.append(sink)
+    return sink
+
+def remove_metrics_sink(sink):
+    if sink in _metrics_sinks:
+        _metrics_sinks.remove(sink)
+
+def _emit_metrics(metrics):
+    for sink in list(_metrics_sinks):
+        try:
+            sink(metrics)
+        except Exception as e:
+            console.print(f"[yellow]Metrics sink {sink!r} failed: {e}[/yellow]")
+
+if os.getenv(METRICS_ENV):
+    add_metrics_sink(JsonlSink(os.getenv(METRICS_ENV)))
+if os.getenv(METRICS_PROM_ENV):
+    add_metrics_sink(PrometheusTextfileSink(os.getenv(METRICS_PROM_ENV)))
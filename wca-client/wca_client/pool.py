@@ -0,0 +1,258 @@
+"""Pools of WCA endpoints and credentials with load balancing and failover."""
+import os
+import time
+import threading
+
+from .console import console
+from .config import (
+    BACKOFF_BASE, BALANCE, EJECT_AFTER, EJECT_SECONDS, ENDPOINTS_ENV, IAM_APIKEY,
+    LATENCY_EWMA_ALPHA, THROTTLE_STATUSES,
+)
+
+class Endpoint:
+    """One chat endpoint and credential of an EndpointPool, with its load and health."""
+
+    def __init__(self, url, apikey=None, name=None):
+        from urllib.parse import urlsplit
+
+        self.url = url
+        self.apikey = apikey
+        self.name = name or urlsplit(url).netloc or url
+        self.outstanding = 0
+        self.latency = None  # EWMA of the seconds to response headers
+        self.failures = 0  # consecutive
+        self.ejected_until = 0.0
+        self.ejections = 0
+        self.probing = False
+        self.paused_until = 0.0
+        self.requests = 0
+        self.errors = 0
+        self.tokens = 0
+
+    def __repr__(self):
+        return f"Endpoint({self.name!r})"
+
+class EndpointLease:
+    """An endpoint picked for one request; released once the request is over."""
+
+    __slots__ = ('pool', 'endpoint', 'released')
+
+    def __init__(self, pool, endpoint):
+        self.pool = pool
+        self.endpoint = endpoint
+        self.released = False
+
+    def succeeded(self, latency):
+        """Record that the endpoint answered (response headers after ``latency`` seconds)."""
+        self.pool._succeeded(self.endpoint, latency)
+
+    def failed(self, throttled=False, retry_after=None):
+        """Record a failed attempt and release the endpoint."""
+        self.pool._failed(self.endpoint, throttled, retry_after)
+        self.release()
+
+    def rejected(self, status):
+        """Release after an error response; throttling and server errors count against the endpoint."""
+        if status in THROTTLE_STATUSES or status >= 500:
+            self.failed(throttled=status in THROTTLE_STATUSES)
+        else:
+            self.release()
+
+    def release(self, tokens=0):
+        if not self.released:
+            self.released = True
+            self.pool._release(self.endpoint, tokens)
+
+class EndpointPool:
+    """Routes requests across several WCA endpoints, each with its own quota.
+
+    ``acquire`` picks the endpoint with the fewest outstanding requests
+    (``least``) or the lowest latency EWMA times its load (``ewma``), skipping
+    endpoints that are throttled (until Retry-After) or ejected after
+    ``eject_after`` consecutive failures. When an ejection ends, one probe
+    request decides whether the endpoint is back or ejected for twice as long.
+    """
+
+    def __init__(self, endpoints, strategy=BALANCE, eject_after=EJECT_AFTER, eject_seconds=EJECT_SECONDS,
+                 alpha=LATENCY_EWMA_ALPHA):
+        if not endpoints:
+            raise ValueError("An endpoint pool needs at least one endpoint")
+        if strategy not in ('least', 'ewma'):
+            raise ValueError(f"Unknown balancing strategy {strategy!r}; use 'least' or 'ewma'")
+        self.endpoints = list(endpoints)
+        self.strategy = strategy
+        self.eject_after = eject_after
+        self.eject_seconds = eject_seconds
+        self.alpha = alpha
+        self._lock = threading.Lock()
+        self._first = None
+        self._last = None
+
+    @classmethod
+    def parse(cls, spec, **kwargs):
+        """Build a pool from comma-separated ``URL|APIKEY_VAR`` entries."""
+        endpoints = []
+        for entry in spec.split(','):
+            url, _, keyvar = (part.strip() for part in entry.partition('|'))
+            if not url:
+                continue
+            endpoint = Endpoint(url)
+            if keyvar:
+                endpoint.name += f" ({keyvar})"
+                endpoint.apikey = os.getenv(keyvar)
+                if not endpoint.apikey:
+                    console.print(f"[yellow]{keyvar} is not set; {url} uses {IAM_APIKEY}[/yellow]")
+            endpoints.append(endpoint)
+        return cls(endpoints, **kwargs)
+
+    def __len__(self):
+        return len(self.endpoints)
+
+    def _ready(self, endpoint, now):
+        # A probing endpoint takes one request at a time
+        return (endpoint.ejected_until <= now and endpoint.paused_until <= now
+                and not (endpoint.probing and endpoint.outstanding))
+
+    def _score(self, endpoint):
+        if self.strategy == 'ewma':
+            # Unmeasured endpoints (latency None) are tried first
+            return ((endpoint.latency or 0.0) * (endpoint.outstanding + 1), endpoint.requests)
+        return (endpoint.outstanding, endpoint.requests)
+
+    def available(self, exclude=()):
+        """True if an endpoint outside ``exclude`` can take a request now."""
+        now = time.monotonic()
+        with self._lock:
+            return any(endpoint not in exclude and self._ready(endpoint, now) for endpoint in self.endpoints)
+
+    def wait_remaining(self, exclude=()):
+        """Seconds until an endpoint outside ``exclude`` leaves its throttle pause or ejection (0 if one is ready)."""
+        now = time.monotonic()
+        with self._lock:
+            others = [endpoint for endpoint in self.endpoints if endpoint not in exclude] or self.endpoints
+            if any(self._ready(endpoint, now) for endpoint in others):
+                return 0.0
+            return max(0.0, min(max(e.ejected_until, e.paused_until) for e in others) - now)
+
+    def acquire(self, exclude=()):
+        """Pick an endpoint for a request and return its EndpointLease.
+
+        Sleeps while every candidate is throttled or ejected rather than
+        sending to one before its Retry-After or ejection is over.
+        """
+        while True:
+            wait = self.wait_remaining(exclude)
+            if not wait:
+                return self._take(exclude)
+            time.sleep(wait)
+
+    async def aacquire(self, exclude=()):
+        """Like acquire, but waits for a throttled or ejected pool without blocking the event loop."""
+        import asyncio
+
+        while True:
+            wait = self.wait_remaining(exclude)
+            if not wait:
+                return self._take(exclude)
+            await asyncio.sleep(wait)
+
+    def _take(self, exclude):
+        now = time.monotonic()
+        with self._lock:
+            ready = [endpoint for endpoint in self.endpoints if endpoint not in exclude and self._ready(endpoint, now)]
+            probes = [endpoint for endpoint in ready if endpoint.probing]
+            if probes:
+                endpoint = probes[0]
+            elif ready:
+                endpoint = min(ready, key=self._score)
+            else:
+                # Only busy probes (or endpoints paused since wait_remaining) are left: use the one ready first
+                others = [endpoint for endpoint in self.endpoints if endpoint not in exclude] or self.endpoints
+                endpoint = min(others, key=lambda e: (max(e.ejected_until, e.paused_until), self._score(e)))
+            endpoint.outstanding += 1
+            endpoint.requests += 1
+            if self._first is None:
+                self._first = now
+        return EndpointLease(self, endpoint)
+
+    def _succeeded(self, endpoint, latency):
+        with self._lock:
+            endpoint.failures = 0
+            endpoint.probing = False
+            if endpoint.latency is None:
+                endpoint.latency = latency
+            else:
+                endpoint.latency += self.alpha * (latency - endpoint.latency)
+
+    def _failed(self, endpoint, throttled, retry_after):
+        now = time.monotonic()
+        with self._lock:
+            endpoint.errors += 1
+            if throttled and not endpoint.probing:
+                # Out of quota for now, not unhealthy
+                endpoint.paused_until = now + (retry_after or BACKOFF_BASE)
+                return
+            endpoint.failures += 1
+            if endpoint.probing or endpoint.failures >= self.eject_after:
+                endpoint.ejections += 1
+                endpoint.failures = 0
+                endpoint.probing = True
+                seconds = self.eject_seconds * 2 ** min(endpoint.ejections - 1, 5)
+                endpoint.ejected_until = now + seconds
+                console.print(f"[yellow]WCA endpoint {endpoint.name} ejected for {seconds:.0f}s[/yellow]")
+
+    def _release(self, endpoint, tokens):
+        with self._lock:
+            endpoint.outstanding -= 1
+            endpoint.tokens += tokens
+            self._last = time.monotonic()
+
+    def stats(self):
+        now = time.monotonic()
+        with self._lock:
+            elapsed = (self._last or now) - (self._first or now)
+            endpoints = [{
+                'name': endpoint.name,
+                'requests': endpoint.requests,
+                'errors': endpoint.errors,
+                'ejections': endpoint.ejections,
+                'ejected': endpoint.ejected_until > now,
+                'outstanding': endpoint.outstanding,
+                'latency': endpoint.latency,
+                'tokens': endpoint.tokens,
+            } for endpoint in self.endpoints]
+        tokens = sum(endpoint['tokens'] for endpoint in endpoints)
+        return {'endpoints': endpoints, 'tokens': tokens,
+                'tokens_per_sec': tokens / elapsed if elapsed > 0 else None}
+
+def _failover(lease, tried, throttled=False, retry_after=None):
+    """Record a failed attempt on a pooled endpoint; True if another one can take the retry now."""
+    if lease is None:
+        return False
+    tried.add(lease.endpoint)
+    lease.failed(throttled, retry_after)
+    return lease.pool.available(exclude=tried)
+
+_endpoint_pool = EndpointPool.parse(os.environ[ENDPOINTS_ENV]) if os.getenv(ENDPOINTS_ENV) else None
+
+def get_endpoint_pool():
+    """Return the WCA_ENDPOINTS pool, or None when a single endpoint is configured."""
+    return _endpoint_pool
+
+def print_pool_stats():
+    """Print per-endpoint requests, errors and latency, and the pool's throughput."""
+    if _endpoint_pool is None:
+        return
+    stats = _endpoint_pool.stats()
+    if not any(endpoint['requests'] for endpoint in stats['endpoints']):
+        return
+    for endpoint in stats['endpoints']:
+        latency = "-" if endpoint['latency'] is None else f"{endpoint['latency']:.2f}s"
+        state = " (ejected)" if endpoint['ejected'] else ""
+        console.print(
+            f"[dim]WCA endpoint {endpoint['name']}{state}: {endpoint['requests']} requests, "
+            f"{endpoint['errors']} errors, {endpoint['ejections']} ejections, latency {latency}, "
+            f"{endpoint['tokens']} output tokens[/dim]"
+        )
+    if stats['tokens_per_sec']:
+        console.print(f"[dim]WCA pool throughput: {stats['tokens_per_sec']:.1f} output tokens/s[/dim]")
@@ -0,0 +1,160 @@
+"""Terminal and file output for streamed responses."""
+import os
+import time
+import threading
+import contextlib
+
+from .console import console
+from .config import FILE_FLUSH_BYTES, FILE_FLUSH_INTERVAL, QUIET_ENV, RENDER_FPS
+from .stream import DELTA, INVALID, iter_events
+
+_quiet = os.getenv(QUIET_ENV, "").lower() in ("1", "true", "yes")
+
+def configure_output(quiet=None):
+    """Turn quiet mode (no spinner, no streamed echo) on or off for this process."""
+    global _quiet
+    if quiet is not None:
+        _quiet = quiet
+
+class StreamRenderer:
+    """Batches streamed deltas and draws them at most ``fps`` times a second.
+
+    Printing every delta makes rich re-render the spinner and the terminal (or
+    an SSH session) redraw once per token; batching keeps the output the same
+    with a fraction of the writes. Once started, a refresh thread also draws
+    on a timer, so text is never held back while the stream stalls; ``close``
+    stops it and draws what is left.
+    """
+
+    def __init__(self, target=None, fps=RENDER_FPS):
+        self.console = target or console
+        self.interval = 1 / fps if fps > 0 else 0
+        self.frames = 0
+        self._pending = []
+        self._next_frame = 0.0
+        self._lock = threading.RLock()
+        self._closed = threading.Event()
+        self._thread = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def start(self):
+        if self.interval and self._thread is None:
+            self._thread = threading.Thread(target=self._refresh, name="wca-render", daemon=True)
+            self._thread.start()
+
+    def _refresh(self):
+        while not self._closed.wait(self.interval):
+            self._tick()
+
+    def write(self, text):
+        with self._lock:
+            self._pending.append(text)
+            self._tick()
+
+    def _tick(self):
+        with self._lock:
+            now = time.monotonic()
+            if self._pending and now >= self._next_frame:
+                self._next_frame = now + self.interval
+                self.flush()
+
+    def flush(self):
+        with self._lock:
+            if self._pending:
+                text, self._pending = "".join(self._pending), []
+                self.console.print(text, end='', markup=False, highlight=False, soft_wrap=True)
+                self.frames += 1
+
+    def close(self):
+        self._closed.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.flush()
+
+class BufferedFileWriter:
+    """Writes deltas to ``file``, flushing on a timer or size threshold instead of per delta."""
+
+    def __init__(self, file, interval=FILE_FLUSH_INTERVAL, max_bytes=FILE_FLUSH_BYTES):
+        self.file = file
+        self.interval = interval
+        self.max_bytes = max_bytes
+        self.flushes = 0
+        self._unflushed = 0
+        self._last_flush = time.monotonic()
+
+    def write(self, text):
+        self.file.write(text)
+        self._unflushed += len(text)
+        if self._unflushed >= self.max_bytes or time.monotonic() - self._last_flush >= self.interval:
+            self.flush()
+
+    def flush(self):
+        if self._unflushed:
+            self.file.flush()
+            self.flushes += 1
+            self._unflushed = 0
+        self._last_flush = time.monotonic()
+
+def stream_response(response, to_file=None, action="Processing", quiet=None, echo=True):
+    """Stream API response and return the complete response text.
+
+    ``echo=False`` keeps the spinner but does not draw the streamed text.
+    """
+    quiet = _quiet if quiet is None else quiet
+    parts = []
+    invalid = 0
+    first_chunk = True
+    start_time = time.time()
+    writer = BufferedFileWriter(to_file) if to_file else None
+    renderer = None if quiet or to_file or not echo else StreamRenderer()
+    status = None if quiet else console.status(f"[bold blue]{action}...", spinner="dots")
+    
+    with status or contextlib.nullcontext(), renderer or contextlib.nullcontext():
+        try:
+            for event in iter_events(response):
+                if first_chunk and status is not None and time.time() - start_time > 10:
+                    status.update(f"[bold yellow]{action} (taking longer than usual)...")
+                if event.type == INVALID:
+                    invalid += 1
+                if event.type != DELTA:
+                    continue
+                
+                content = event.content
+                first_chunk = False
+                parts.append(content)
+                if writer:
+                    writer.write(content)
+                elif renderer:
+                    renderer.write(content)
+                        
+        except Exception as e:
+            console.print(f"\n[red]Error processing response: {str(e)}[/red]")
+            raise
+        finally:
+            if writer:
+                writer.flush()
+    
+    if invalid:
+        console.print(f"\n[yellow]Warning: skipped {invalid} malformed response frame(s)[/yellow]")
+    return "".join(parts).strip()
+
+def format_as_markdown(content, language=None):
+    """Format content as markdown with optional code blocks."""
+    # If the content looks like code (has indentation or common code characters)
+    if any(char in content for char in '{([;=+-%*/') or '\n ' in content:
+        # Wrap it in a code block with the specified language
+        lang_spec = language if language else 'python'
+        formatted = f"```{lang_spec}\n{content}\n```"
+    else:
+        # Otherwise, treat it as regular markdown
+        formatted = content
+    
+    from rich.markdown import Markdown
+    return Markdown(formatted)
@@ -0,0 +1,400 @@
+"""Response objects that replay, record or share a WCA stream, and the single-flight registry."""
+import json
+import threading
+
+from .config import DEFAULT_READ_TIMEOUT
+from .stream import DELTA, STREAM_CHUNK_SIZE, StreamDecoder
+
+def _delta_line(content):
+    """Encode one content delta as a WCA NDJSON stream line (without the newline)."""
+    return json.dumps({"response": {"message": {"content": content}}}).encode('utf-8')
+
+class ReplayResponse:
+    """Minimal stand-in for a streaming ``requests.Response`` serving cached text."""
+
+    status_code = 200
+    ok = True
+    from_cache = True
+
+    def __init__(self, text):
+        self.text = text
+
+    def _deltas(self):
+        yield self.text
+
+    def iter_content(self, *args, **kwargs):
+        for content in self._deltas():
+            yield _delta_line(content) + b'\n'
+
+    def iter_lines(self, *args, **kwargs):
+        for content in self._deltas():
+            yield _delta_line(content)
+
+    def raise_for_status(self):
+        pass
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+class FlightResponse(ReplayResponse):
+    """Response for a caller coalesced onto another caller's in-flight request.
+
+    Replays the leader's deltas as they arrive, then raises its error, if any.
+    """
+
+    from_cache = False
+
+    def __init__(self, flight, metrics=None):
+        self.flight = flight
+        self.metrics = metrics
+        self._left = False
+
+    def _deltas(self):
+        try:
+            if self.metrics is None:
+                yield from self.flight.replay()
+                return
+            try:
+                for content in self.flight.replay():
+                    self.metrics.delta(content)
+                    yield content
+            except BaseException as e:
+                self.metrics.finish(e)
+                raise
+            self.metrics.status = 200
+            self.metrics.finish()
+        finally:
+            self.close()
+
+    @property
+    def text(self):
+        try:
+            return "".join(self.flight.replay())
+        finally:
+            self.close()
+
+    def close(self):
+        # Once every caller has left, the shared request is dropped
+        if not self._left:
+            self._left = True
+            self.flight.unsubscribe()
+
+class RecordingResponse:
+    """Wraps a live streaming response; caches its text once fully read,
+    shares its deltas with coalesced callers and records call metrics.
+
+    If the reader stops early while coalesced callers are still reading, the
+    rest of the stream is read for them on a background thread.
+    """
+
+    from_cache = False
+
+    def __init__(self, response, cache, key, flight=None, metrics=None, stop=None):
+        self._response = response
+        self._cache = cache
+        self._key = key
+        self._flight = flight
+        self._metrics = metrics
+        self._stop = stop.matcher() if stop is not None else None
+        self._decoder = StreamDecoder()
+        self._parts = []
+        self._chunks = None
+        self._draining = False
+        self.stopped = False
+
+    def __getattr__(self, name):
+        return getattr(self._response, name)
+
+    def iter_content(self, *args, **kwargs):
+        self._chunks = self._response.iter_content(*args, **kwargs)
+        at_yield = False
+        try:
+            for chunk in self._chunks:
+                kept = self._record(self._decoder.feed(chunk)) if chunk else []
+                if self._stop is not None:
+                    # Re-encoded, so the reader also ends exactly at the delta
+                    # where the stop condition matched, as async callers do
+                    chunk = b''.join(_delta_line(content) + b'\n' for content in kept)
+                at_yield = True
+                yield chunk
+                at_yield = False
+                if self.stopped:
+                    break
+            else:
+                self._record(self._decoder.flush())
+        except Exception as e:
+            self._fail(e)
+            raise
+        except BaseException:
+            if at_yield:
+                # The reader left between chunks (generator closed): the
+                # stream is intact and may still be wanted by others
+                self._abandon()
+            else:
+                self._fail(FlightAbandoned("The shared WCA request was interrupted"))
+            raise
+        self._complete()
+
+    def _record(self, events):
+        """Record the deltas of ``events`` up to the stop point; return them."""
+        kept = []
+        for event in events:
+            if event.type == DELTA and not self.stopped:
+                kept.append(event.content)
+                self._parts.append(event.content)
+                if self._flight:
+                    self._flight.publish(event.content)
+                if self._metrics:
+                    self._metrics.delta(event.content)
+                if self._stop is not None:
+                    self.stopped = self._stop(event.content)
+        return kept
+
+    def _fail(self, error):
+        if self._flight:
+            self._flight.finish(error)
+        if self._metrics:
+            self._metrics.finish(error)
+
+    def _complete(self):
+        if self.stopped:
+            # The stop condition matched: drop the connection instead of
+            # reading (and paying for) the rest of the generation
+            self._response.close()
+            if self._metrics:
+                self._metrics.stopped = True
+        if self._flight:
+            self._flight.finish()
+        if self._metrics:
+            self._metrics.finish()
+        # Only complete streams are cached; an interrupted read stores nothing
+        if self._cache is not None and self._parts:
+            self._cache.put(self._key, "".join(self._parts))
+
+    def _abandon(self):
+        if self._draining:
+            return
+        if self._flight is not None and self._flight.abandon():
+            self._draining = True
+            threading.Thread(target=self._drain, name="wca-flight-drain", daemon=True).start()
+            return
+        if self._metrics:
+            self._metrics.finish('closed')
+        self._response.close()
+
+    def _drain(self):
+        """Read the rest of the stream for the coalesced callers still waiting."""
+        try:
+            if self._chunks is None:
+                self._chunks = self._response.iter_content(chunk_size=STREAM_CHUNK_SIZE)
+            for chunk in self._chunks:
+                if chunk:
+                    self._record(self._decoder.feed(chunk))
+                if self.stopped:
+                    break
+                if not self._flight.subscribers:
+                    self._fail(FlightAbandoned("Every caller of the shared WCA request left"))
+                    return
+            else:
+                self._record(self._decoder.flush())
+            self._complete()
+        except Exception as e:
+            self._fail(e)
+        finally:
+            self._response.close()
+
+    def close(self):
+        if self._draining:
+            return
+        if self._flight is not None and not self._flight.done:
+            self._abandon()
+            return
+        if self._metrics:
+            self._metrics.finish('closed')
+        self._response.close()
+
+    def __del__(self):
+        # Dropped unread: close it, so coalesced callers are not left waiting
+        if self.__dict__.get('_flight') is not None and not self._flight.done:
+            self.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+class FlightAbandoned(RuntimeError):
+    """Every caller of a coalesced request left, or it stopped making progress."""
+
+class Flight:
+    """One upstream WCA request shared by concurrent identical callers.
+
+    The caller that started it publishes deltas; every other caller gets its
+    own ``replay()`` of them, from the start and then live as they arrive.
+    ``subscribers`` counts the callers still reading through replay. A replay
+    that sees no new delta for ``timeout`` seconds gives up.
+    """
+
+    def __init__(self, release=None, timeout=DEFAULT_READ_TIMEOUT):
+        self.deltas = []
+        self.done = False
+        self.error = None
+        self.subscribers = 0
+        self.timeout = timeout
+        self._release = release
+        self._cond = threading.Condition()
+
+    def subscribe(self):
+        with self._cond:
+            self.subscribers += 1
+
+    def unsubscribe(self):
+        with self._cond:
+            self.subscribers -= 1
+
+    def abandon(self):
+        """The leader stopped reading early; return True if subscribers still want the stream.
+
+        Otherwise the flight is finished with FlightAbandoned. Either way no
+        new caller joins it.
+        """
+        if self._release:
+            self._release()
+        with self._cond:
+            wanted = not self.done and self.subscribers > 0
+        if not wanted:
+            self.finish(FlightAbandoned("The shared WCA request was closed before it finished"))
+        return wanted
+
+    def publish(self, content):
+        with self._cond:
+            self.deltas.append(content)
+            self._cond.notify_all()
+
+    def finish(self, error=None):
+        """Mark the stream complete (or failed); later calls are ignored."""
+        if error is not None and not isinstance(error, Exception):
+            # Cancellation or generator close, not a WCA failure
+            error = FlightAbandoned("The shared WCA request was cancelled")
+        with self._cond:
+            if self.done:
+                return
+            self.done = True
+            self.error = error
+            self._cond.notify_all()
+        if self._release:
+            self._release()
+
+    def _stalled(self):
+        return FlightAbandoned(f"The shared WCA request sent nothing for {self.timeout:.0f}s")
+
+    def replay(self):
+        index = 0
+        while True:
+            with self._cond:
+                if index >= len(self.deltas) and not self.done:
+                    if not self._cond.wait_for(lambda: index < len(self.deltas) or self.done, self.timeout):
+                        raise self._stalled()
+                new = self.deltas[index:]
+                finished = self.done
+            index += len(new)
+            yield from new
+            if finished:
+                if self.error is not None:
+                    raise self.error
+                return
+
+class AsyncFlight(Flight):
+    """Flight whose subscribers, leader included, are coroutines on one event loop.
+
+    ``pump`` is the task reading the upstream stream (see
+    AsyncWCAClient._pump); it is cancelled when the last subscriber leaves.
+    """
+
+    def __init__(self, release=None, timeout=DEFAULT_READ_TIMEOUT):
+        import asyncio
+
+        super().__init__(release, timeout)
+        self.pump = None
+        self._changed = asyncio.Event()
+
+    def unsubscribe(self):
+        super().unsubscribe()
+        if not self.subscribers and not self.done and self.pump is not None:
+            self.pump.cancel()
+
+    def publish(self, content):
+        self.deltas.append(content)
+        self._wake()
+
+    def finish(self, error=None):
+        if error is not None and not isinstance(error, Exception):
+            error = FlightAbandoned("The shared WCA request was cancelled")
+        if self.done:
+            return
+        self.done = True
+        self.error = error
+        self._wake()
+        if self._release:
+            self._release()
+
+    def _wake(self):
+        import asyncio
+
+        changed, self._changed = self._changed, asyncio.Event()
+        changed.set()
+
+    async def areplay(self):
+        import asyncio
+
+        index = 0
+        while True:
+            while index >= len(self.deltas) and not self.done:
+                try:
+                    await asyncio.wait_for(self._changed.wait(), self.timeout)
+                except asyncio.TimeoutError:
+                    raise self._stalled() from None
+            new = self.deltas[index:]
+            finished = self.done
+            index += len(new)
+            for content in new:
+                yield content
+            if finished:
+                if self.error is not None:
+                    raise self.error
+                return
+
+class SingleFlight:
+    """Registry of in-flight requests by key; the first caller for a key leads."""
+
+    def __init__(self, flight_class=Flight):
+        self.flight_class = flight_class
+        self.coalesced = 0
+        self._flights = {}
+        self._lock = threading.Lock()
+
+    def join(self, key):
+        """Return ``(flight, leader)``; only the leader sends the request."""
+        with self._lock:
+            flight = self._flights.get(key)
+            if flight is not None:
+                self.coalesced += 1
+                flight.subscribe()
+                return flight, False
+            flight = self.flight_class(release=lambda: self._leave(key, flight))
+            self._flights[key] = flight
+            return flight, True
+
+    def _leave(self, key, flight):
+        with self._lock:
+            if self._flights.get(key) is flight:
+                del self._flights[key]
+
+_flights = SingleFlight()
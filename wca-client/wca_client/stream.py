@@ -0,0 +1,210 @@
+"""Incremental decoding of WCA chat streams and the conditions that stop them early."""
+import json
+from collections import namedtuple
+
+# Typed events produced by StreamDecoder
+StreamEvent = namedtuple('StreamEvent', ['type', 'content', 'data'])
+DELTA = 'delta'      # a message carrying new content
+MESSAGE = 'message'  # a well-formed message without content (metadata, stop reason)
+DONE = 'done'        # SSE "[DONE]" sentinel
+INVALID = 'invalid'  # a frame that is not valid JSON; ``data`` holds the raw text
+
+# Upper bound per read; chunked (SSE) responses are still yielded chunk by chunk
+STREAM_CHUNK_SIZE = 4096
+_json_raw_decode = json.JSONDecoder().raw_decode
+
+class StreamDecoder:
+    """Incremental decoder for WCA chat streams.
+
+    Feed it raw byte chunks as they arrive from the socket; it frames both
+    newline-delimited JSON and Server-Sent Events (``data:`` lines terminated
+    by a blank line, ``:`` comments, ``event:``/``id:``/``retry:`` fields) and
+    returns typed StreamEvents. Partial lines are carried over between chunks
+    without re-copying the data already seen.
+    """
+
+    def __init__(self):
+        self._pending = bytearray()
+        self._data = []
+        self.invalid = 0
+
+    def feed(self, chunk):
+        """Consume a chunk of bytes and return the events it completed."""
+        end = chunk.rfind(b'\n')
+        if end < 0:
+            self._pending += chunk
+            return []
+        # Complete lines are decoded in one pass; '\n' never occurs inside a
+        # multi-byte UTF-8 sequence, so this cannot split a character
+        if self._pending:
+            self._pending += chunk[:end]
+            block = self._pending.decode('utf-8', 'replace')
+            self._pending = bytearray(chunk[end + 1:])
+        else:
+            block = chunk[:end].decode('utf-8', 'replace')
+            self._pending += chunk[end + 1:]
+        events = []
+        for line in block.split('\n'):
+            self._line(line, events)
+        return events
+
+    def flush(self):
+        """Decode whatever is left once the stream has ended."""
+        events = []
+        if self._pending:
+            line = self._pending.decode('utf-8', 'replace')
+            self._pending = bytearray()
+            self._line(line, events)
+        self._dispatch_data(events)
+        return events
+
+    def _line(self, line, events):
+        if line.endswith('\r'):
+            line = line[:-1]
+        if not line:
+            # Blank line terminates an SSE event
+            self._dispatch_data(events)
+        elif line[0] == '{':
+            # Newline-delimited JSON: one message per line
+            self._decode(line, events)
+        elif line.startswith('data:'):
+            value = line[5:]
+            self._data.append(value[1:] if value.startswith(' ') else value)
+        elif line.startswith((':', 'event:', 'id:', 'retry:')):
+            pass
+        else:
+            self._decode(line, events)
+
+    def _dispatch_data(self, events):
+        if self._data:
+            data = '\n'.join(self._data)
+            self._data = []
+            self._decode(data, events)
+
+    def _decode(self, raw, events):
+        if raw == '[DONE]':
+            events.append(StreamEvent(DONE, '', None))
+            return
+        try:
+            data = _json_raw_decode(raw.strip())[0]
+        except ValueError:
+            self.invalid += 1
+            events.append(StreamEvent(INVALID, '', raw))
+            return
+        try:
+            content = data['response']['message'].get('content')
+        except (KeyError, TypeError, AttributeError):
+            content = None
+        if content:
+            events.append(StreamEvent(DELTA, content, data))
+        else:
+            events.append(StreamEvent(MESSAGE, '', data))
+
+def iter_events(response):
+    """Yield StreamEvents from a streaming ``requests.Response`` as bytes arrive."""
+    decoder = StreamDecoder()
+    for chunk in response.iter_content(chunk_size=STREAM_CHUNK_SIZE):
+        if chunk:
+            yield from decoder.feed(chunk)
+    yield from decoder.flush()
+
+def _iter_content(response):
+    """Yield the content deltas of a streamed WCA chat response."""
+    for event in iter_events(response):
+        if event.type == DELTA:
+            yield event.content
+
+class StopCondition:
+    """Ends a streamed response early once the caller has what it asked for.
+
+    ``matcher()`` returns a fresh ``feed(delta) -> bool`` for one stream, so one
+    condition can be shared by concurrent calls. A named condition becomes part
+    of the response cache and coalescing key (the truncated text is what gets
+    cached and shared); anonymous ones bypass both.
+    """
+
+    name = None
+
+    def matcher(self):
+        raise NotImplementedError
+
+class StopAtCodeBlock(StopCondition):
+    """Stop at the closing fence of the first fenced code block (of ``language``, if given)."""
+
+    def __init__(self, language=None):
+        self.language = language.lower() if language else None
+        self.name = f"code-block:{self.language or '*'}"
+
+    def _opens(self, line):
+        return self.language is None or line.strip()[3:].lower().startswith(self.language)
+
+    def matcher(self):
+        line = ''
+        opened = False
+
+        def feed(delta):
+            nonlocal line, opened
+            *complete, line = (line + delta).split('\n')
+            for text in complete:
+                if text.lstrip().startswith('```'):
+                    if opened:
+                        return True
+                    opened = self._opens(text)
+            # A closing fence needs no newline after it
+            return opened and line.lstrip().startswith('```')
+        return feed
+
+class StopAtJsonObject(StopCondition):
+    """Stop once the braces of the first JSON object balance."""
+
+    name = 'json-object'
+
+    def matcher(self):
+        depth = 0
+        in_string = escaped = False
+
+        def feed(delta):
+            nonlocal depth, in_string, escaped
+            for char in delta:
+                if in_string:
+                    if escaped:
+                        escaped = False
+                    elif char == '\\':
+                        escaped = True
+                    elif char == '"':
+                        in_string = False
+                elif char == '"' and depth:
+                    in_string = True
+                elif char == '{':
+                    depth += 1
+                elif char == '}' and depth:
+                    depth -= 1
+                    if not depth:
+                        return True
+            return False
+        return feed
+
+class StopWhen(StopCondition):
+    """Stop once ``predicate(text_so_far)`` is true.
+
+    Give it a ``name`` to let the truncated response be cached and shared by
+    identical requests using the same condition.
+    """
+
+    def __init__(self, predicate, name=None):
+        self.predicate = predicate
+        self.name = name
+
+    def matcher(self):
+        parts = []
+
+        def feed(delta):
+            parts.append(delta)
+            return self.predicate("".join(parts))
+        return feed
+
+def as_stop_condition(stop):
+    """Accept a StopCondition, a plain ``predicate(text)`` or None."""
+    if stop is None or isinstance(stop, StopCondition):
+        return stop
+    return StopWhen(stop)
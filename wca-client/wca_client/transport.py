@@ -0,0 +1,198 @@
+"""HTTP plumbing for chat requests: the pooled requests session, multipart bodies and headers."""
+import os
+import json
+import base64
+import uuid
+import time
+import mmap
+import threading
+
+from .config import DEFAULT_MAX_RETRIES, DEFAULT_POOL_SIZE
+
+def create_session(pool_size=DEFAULT_POOL_SIZE, max_retries=DEFAULT_MAX_RETRIES):
+    """Create a requests.Session with a keep-alive connection pool and retries."""
+    import requests
+    from requests.adapters import HTTPAdapter
+    from urllib3.util.retry import Retry
+
+    retry = Retry(
+        total=max_retries,
+        connect=max_retries,
+        read=0,
+        status=max_retries,
+        backoff_factor=0.5,
+        status_forcelist=(502, 504),
+        allowed_methods=frozenset(['GET', 'POST']),
+        respect_retry_after_header=False,  # 429/503 are left to AdaptiveLimiter
+        raise_on_status=False,
+    )
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+    # Pools whose connections report DNS/connect/TLS time to the current call's metrics
+    adapter.poolmanager.pool_classes_by_scheme = _timed_pool_classes()
+    session = requests.Session()
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+_shared_session = None
+_shared_session_lock = threading.Lock()
+
+def get_session():
+    """Return the process-wide pooled session shared by IAM and WCA calls."""
+    global _shared_session
+    if _shared_session is None:
+        with _shared_session_lock:
+            if _shared_session is None:
+                _shared_session = create_session()
+    return _shared_session
+
+# Attachments are base64-encoded in blocks of this many bytes (a multiple of 3,
+# so blocks encode independently without padding)
+UPLOAD_BLOCK_SIZE = 3 * 16 * 1024
+
+def _quote_field(value):
+    # Same escaping urllib3 applies to multipart names and filenames
+    return value.translate({ord('"'): '%22', ord('\r'): '%0D', ord('\n'): '%0A'})
+
+class MultipartBody:
+    """Streaming multipart/form-data body for a chat request.
+
+    Produces the same form as ``requests`` would for the ``message`` field and
+    base64-encoded ``files``, but reads each attachment through mmap and encodes
+    it block by block as the body is sent, so memory stays flat regardless of
+    file size. The length is known up front (sent as Content-Length), and the
+    body can be re-read from the start for retries.
+    """
+
+    def __init__(self, payload, file_dict=()):
+        self.boundary = uuid.uuid4().hex
+        self.content_type = f'multipart/form-data; boundary={self.boundary}'
+        self._message = self._part_header('message') + json.dumps(payload).encode('utf-8') + b'\r\n'
+        self._files = []
+        for a_file in file_dict:
+            header = self._part_header('files', a_file.split("/")[-1], 'text/plain')
+            self._files.append((a_file, header, os.path.getsize(a_file)))
+        self._closing = f'--{self.boundary}--\r\n'.encode('utf-8')
+        self.seek(0)
+
+    def _part_header(self, name, filename=None, content_type=None):
+        header = f'--{self.boundary}\r\nContent-Disposition: form-data; name="{_quote_field(name)}"'
+        if filename is not None:
+            header += f'; filename="{_quote_field(filename)}"'
+        if content_type:
+            header += f'\r\nContent-Type: {content_type}'
+        return (header + '\r\n\r\n').encode('utf-8')
+
+    def __len__(self):
+        length = len(self._message) + len(self._closing)
+        for _, header, size in self._files:
+            length += len(header) + 4 * ((size + 2) // 3) + 2
+        return length
+
+    def __iter__(self):
+        yield self._message
+        for a_file, header, size in self._files:
+            yield header
+            if size:
+                with open(a_file, 'rb') as file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as view:
+                    for start in range(0, size, UPLOAD_BLOCK_SIZE):
+                        yield base64.b64encode(view[start:start + UPLOAD_BLOCK_SIZE])
+            yield b'\r\n'
+        yield self._closing
+
+    async def aiter(self):
+        """Async iterator over the body, for httpx."""
+        for chunk in self:
+            yield chunk
+
+    # File-like interface used by requests/http.client to stream the body
+    def read(self, size=-1):
+        while self._buffer_pos >= len(self._buffer):
+            self._buffer = next(self._chunks, b'')
+            self._buffer_pos = 0
+            if not self._buffer:
+                return b''
+        if size is None or size < 0:
+            size = len(self._buffer) - self._buffer_pos
+        chunk = self._buffer[self._buffer_pos:self._buffer_pos + size]
+        self._buffer_pos += len(chunk)
+        self._position += len(chunk)
+        return chunk
+
+    def tell(self):
+        return self._position
+
+    def seek(self, offset, whence=0):
+        # Only rewinding is needed (urllib3 rewinds the body before a retry)
+        if offset != 0 or whence != 0:
+            raise OSError("MultipartBody can only seek to the start")
+        self._chunks = iter(self)
+        self._buffer = b''
+        self._buffer_pos = 0
+        self._position = 0
+        return 0
+
+def _chat_headers(token, request_id=None):
+    return {
+        'Authorization': f'Bearer {token}',
+        'Request-Id': request_id or str(uuid.uuid4()),
+        'Origin': 'vscode',
+        'Accept': 'text/event-stream'
+    }
+
+# The call whose request is being sent on this thread, for connection timing
+_call_context = threading.local()
+
+def _record_connect(seconds):
+    metrics = getattr(_call_context, 'metrics', None)
+    if metrics is not None:
+        metrics.connect += seconds
+
+_timed_pools = None
+
+def _timed_pool_classes():
+    """Return urllib3 pool classes (by scheme) whose connections time connect/TLS."""
+    global _timed_pools
+    if _timed_pools is None:
+        from urllib3.connection import HTTPConnection, HTTPSConnection
+        from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+        class _TimedHTTPConnection(HTTPConnection):
+            def connect(self):
+                start = time.perf_counter()
+                try:
+                    super().connect()
+                finally:
+                    _record_connect(time.perf_counter() - start)
+
+        class _TimedHTTPSConnection(HTTPSConnection):
+            def connect(self):
+                start = time.perf_counter()
+                try:
+                    super().connect()
+                finally:
+                    _record_connect(time.perf_counter() - start)
+
+        class _TimedHTTPConnectionPool(HTTPConnectionPool):
+            ConnectionCls = _TimedHTTPConnection
+
+        class _TimedHTTPSConnectionPool(HTTPSConnectionPool):
+            ConnectionCls = _TimedHTTPSConnection
+
+        _timed_pools = {'http': _TimedHTTPConnectionPool, 'https': _TimedHTTPSConnectionPool}
+    return _timed_pools
+
+def _retry_after(headers):
+    """Parse a Retry-After header (seconds or HTTP date) into seconds, or None."""
+    value = headers.get('Retry-After')
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        from email.utils import parsedate_to_datetime
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
@@ -0,0 +1,259 @@
+"""Local stand-in for the IBM IAM and Watson Code Assistant endpoints.
+
+Implements ``POST /identity/token`` and the streaming
+``POST /v2/wca/core/chat/text/generation`` contract so the tools, tests and
+benchmarks can run offline with reproducible timings:
+
+    python wca_stub.py --port 8080 --ttft 0.5 --tokens-per-sec 40 --error-rate 0.05
+
+    export BASE_URL=http://127.0.0.1:8080/v2/wca/core/chat/text/generation
+    export IAM_URL=http://127.0.0.1:8080/identity/token
+
+From Python, ``start_stub(...)`` runs it on a background thread and returns the
+server, whose ``chat_url``/``iam_url`` can be passed to WCAClient.
+"""
+import json
+import random
+import re
+import threading
+import time
+import uuid
+from email.parser import BytesParser
+from email.policy import HTTP
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional
+
+import typer
+
+CHAT_PATH = "/v2/wca/core/chat/text/generation"
+IAM_PATH = "/identity/token"
+DEFAULT_RESPONSE = (
+    "This code defines a class with a constructor and two methods. "
+    "The constructor initializes the fields, and each method validates its input "
+    "before delegating to the service layer."
+)
+
+def tokenize(text):
+    """Split text into word-sized pieces, roughly one generated token each."""
+    return re.findall(r"\s*\S+", text) or [text]
+
+def parse_message(body, content_type):
+    """Return the ``message`` payload of a multipart chat request, or None."""
+    message = BytesParser(policy=HTTP).parsebytes(
+        f"Content-Type: {content_type}\r\n\r\n".encode("latin-1") + body
+    )
+    if not message.is_multipart():
+        return None
+    for part in message.iter_parts():
+        if part.get_param("name", header="content-disposition") == "message":
+            try:
+                return json.loads(part.get_payload(decode=True))
+            except ValueError:
+                return None
+    return None
+
+class StubServer(ThreadingHTTPServer):
+    """Stub WCA/IAM server; options are plain attributes and may be changed live.
+
+    ttft: seconds before the first token; tokens_per_sec: 0 sends all at once;
+    response: canned text (ignored with echo=True, which returns the last user
+    message); error_rate: fraction of chat requests answered with one of
+    ``errors`` (HTTP status codes or "timeout", which stalls for ``stall``
+    seconds); max_concurrency: chat requests beyond it get 429.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, address=("127.0.0.1", 0), ttft=0.2, tokens_per_sec=50.0, response=DEFAULT_RESPONSE,
+                 echo=False, sse=False, error_rate=0.0, errors=(429, 503), retry_after=1.0, stall=300.0,
+                 max_concurrency=0, token_lifetime=3600, seed=None):
+        super().__init__(address, StubHandler)
+        self.ttft = ttft
+        self.tokens_per_sec = tokens_per_sec
+        self.response = response
+        self.echo = echo
+        self.sse = sse
+        self.error_rate = error_rate
+        self.errors = tuple(errors)
+        self.retry_after = retry_after
+        self.stall = stall
+        self.max_concurrency = max_concurrency
+        self.token_lifetime = token_lifetime
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.active = 0
+        self.stats = {"token_requests": 0, "chat_requests": 0, "errors": 0, "throttled": 0, "tokens": 0,
+                      "disconnects": 0}
+
+    @property
+    def base_url(self):
+        return f"http://{self.server_address[0]}:{self.server_address[1]}"
+
+    @property
+    def chat_url(self):
+        return self.base_url + CHAT_PATH
+
+    @property
+    def iam_url(self):
+        return self.base_url + IAM_PATH
+
+    def count(self, name, amount=1):
+        with self.lock:
+            self.stats[name] += amount
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        if self.path == "/stats":
+            with self.server.lock:
+                self.send_json(200, dict(self.server.stats, active=self.server.active))
+        else:
+            self.send_json(404, {"error": "not found"})
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        if self.path == IAM_PATH:
+            self.server.count("token_requests")
+            self.send_json(200, {
+                "access_token": f"stub-{uuid.uuid4().hex}",
+                "token_type": "Bearer",
+                "expires_in": self.server.token_lifetime,
+                "expiration": int(time.time() + self.server.token_lifetime),
+            })
+        elif self.path == CHAT_PATH or self.path == "/chat":
+            self.chat(body)
+        else:
+            self.send_json(404, {"error": "not found"})
+
+    def chat(self, body):
+        server = self.server
+        server.count("chat_requests")
+        if not self.headers.get("Authorization", "").startswith("Bearer "):
+            self.send_json(401, {"error": "missing bearer token"})
+            return
+
+        with server.lock:
+            admitted = not server.max_concurrency or server.active < server.max_concurrency
+            if admitted:
+                server.active += 1
+            error = server.errors and server.random.random() < server.error_rate and server.random.choice(server.errors)
+        if not admitted:
+            server.count("throttled")
+            self.send_json(429, {"error": "rate limited"}, {"Retry-After": str(server.retry_after)})
+            return
+        try:
+            if error:
+                server.count("errors")
+                self.send_error_response(error)
+            else:
+                self.stream(self.response_text(body))
+        except (BrokenPipeError, ConnectionResetError):
+            # The client stopped reading, e.g. a stop condition matched
+            server.count("disconnects")
+            self.close_connection = True
+        finally:
+            with server.lock:
+                server.active -= 1
+
+    def response_text(self, body):
+        if not self.server.echo:
+            return self.server.response
+        message = parse_message(body, self.headers.get("Content-Type", ""))
+        try:
+            return message["message_payload"]["messages"][-1]["content"]
+        except (TypeError, KeyError, IndexError):
+            return ""
+
+    def send_error_response(self, error):
+        if error == "timeout":
+            time.sleep(self.server.stall)
+            self.close_connection = True
+            return
+        headers = {"Retry-After": str(self.server.retry_after)} if error in (429, 503) else {}
+        self.send_json(int(error), {"error": f"injected {error}"}, headers)
+
+    def stream(self, text):
+        server = self.server
+        time.sleep(server.ttft)
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream" if server.sse else "application/x-ndjson")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        interval = 1 / server.tokens_per_sec if server.tokens_per_sec else 0
+        for index, token in enumerate(tokenize(text)):
+            if index and interval:
+                time.sleep(interval)
+            message = json.dumps({"response": {"message": {"role": "ASSISTANT", "content": token}}})
+            self.write_chunk(f"data: {message}\n\n" if server.sse else message + "\n")
+            server.count("tokens")
+        if server.sse:
+            self.write_chunk("data: [DONE]\n\n")
+        self.wfile.write(b"0\r\n\r\n")
+
+    def write_chunk(self, text):
+        data = text.encode("utf-8")
+        self.wfile.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+
+    def send_json(self, status, payload, headers=None):
+        data = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+def start_stub(host="127.0.0.1", port=0, **options):
+    """Start a StubServer on a background thread and return it."""
+    server = StubServer((host, port), **options)
+    # Poll often so shutdown() returns promptly
+    threading.Thread(target=server.serve_forever, kwargs={"poll_interval": 0.05}, daemon=True).start()
+    return server
+
+def parse_errors(value):
+    return tuple(error if error == "timeout" else int(error) for error in value.split(",") if error)
+
+def main(
+    host: str = typer.Option("127.0.0.1", help="Interface to bind"),
+    port: int = typer.Option(8080, help="Port to listen on"),
+    ttft: float = typer.Option(0.2, help="Seconds before the first token"),
+    tokens_per_sec: float = typer.Option(50.0, help="Token rate after the first token (0 = no delay)"),
+    response_file: Optional[str] = typer.Option(None, help="File with the canned response text"),
+    echo: bool = typer.Option(False, help="Answer with the last user message instead of canned text"),
+    sse: bool = typer.Option(False, help="Use SSE data: framing instead of NDJSON"),
+    error_rate: float = typer.Option(0.0, help="Fraction of chat requests that fail"),
+    errors: str = typer.Option("429,503", help="Comma-separated injected failures: status codes or 'timeout'"),
+    retry_after: float = typer.Option(1.0, help="Retry-After seconds sent with 429/503"),
+    stall: float = typer.Option(300.0, help="Seconds an injected timeout stalls before closing"),
+    max_concurrency: int = typer.Option(0, help="Concurrent chat requests admitted before 429 (0 = unlimited)"),
+    token_lifetime: int = typer.Option(3600, help="expires_in of issued IAM tokens"),
+    seed: Optional[int] = typer.Option(None, help="Random seed for reproducible error injection"),
+):
+    """Serve the stub until interrupted."""
+    response = DEFAULT_RESPONSE
+    if response_file:
+        with open(response_file, encoding="utf-8") as file:
+            response = file.read()
+    server = StubServer(
+        (host, port), ttft=ttft, tokens_per_sec=tokens_per_sec, response=response, echo=echo, sse=sse,
+        error_rate=error_rate, errors=parse_errors(errors), retry_after=retry_after, stall=stall,
+        max_concurrency=max_concurrency, token_lifetime=token_lifetime, seed=seed,
+    )
+    typer.echo(f"WCA stub listening on {server.base_url}")
+    typer.echo(f"  export BASE_URL={server.chat_url}")
+    typer.echo(f"  export IAM_URL={server.iam_url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+if __name__ == "__main__":
+    typer.run(main)
@@ -1,4 +1,5 @@
-from fastapi import APIRouter, Request, HTTPException
+from fastapi import APIRouter, BackgroundTasks, Request, Response, HTTPException
+from starlette.concurrency import run_in_threadpool
 import hmac
 import hashlib
 import os
@@ -107,35 +108,10 @@ def get_file_content(repo_name: str, commit_sha: str, file_path: str) -> str:
         print(f"{Fore.RED}Error fetching file content: {str(e)}{Style.RESET_ALL}")
         return None
 
-@github_webhook.post('/webhook/github')
-async def handle_github_webhook(request: Request):
-    # Get raw body for signature verification
-    body = await request.body()
-    
-    # Verify webhook signature if secret is set
-    signature = request.headers.get('X-Hub-Signature-256')
-    if not verify_github_signature(body, signature):
-        raise HTTPException(status_code=401, detail='Invalid signature')
-
-    event_type = request.headers.get('X-GitHub-Event')
-    if event_type != 'push':
-        return {'message': f'Event {event_type} ignored'}
-
-    try:
-        # Parse the payload
-        if isinstance(body, bytes):
-            body_str = body.decode('utf-8')
-        payload = json.loads(body_str)
-        
-        # Handle nested JSON from smee.io
-        if 'payload' in payload and isinstance(payload['payload'], str):
-            payload = json.loads(payload['payload'])
-
-        repo_name = payload.get('repository', {}).get('full_name')
-        
-        # Process each commit
-        commits = payload.get('commits', [])
-        for commit in commits:
+async def review_commits(repo_name: str, commits: list):
+    """Fetch each pushed commit's changes from GitHub and trigger its code review"""
+    for commit in commits:
+        try:
             # Print commit information with colors
             print(f"\n{Fore.CYAN}{'='*50}{Style.RESET_ALL}")
             print(f"{Fore.WHITE}{Style.BRIGHT}Commit Message:{Style.RESET_ALL} {commit.get('message')}")
@@ -145,13 +121,13 @@ async def handle_github_webhook(request: Request):
             print(f"\n{Fore.MAGENTA}Changes:{Style.RESET_ALL}")
             print(f"  {format_file_changes(commit)}")
             
-            # Get code diff and full file contents
-            diff = get_commit_diff(repo_name, commit.get('id'))
+            # Get code diff and full file contents (blocking GitHub calls, kept off the event loop)
+            diff = await run_in_threadpool(get_commit_diff, repo_name, commit.get('id'))
             
             # Get full content of modified and added files
             file_contents = {}
             for file_path in commit.get('modified', []) + commit.get('added', []):
-                content = get_file_content(repo_name, commit.get('id'), file_path)
+                content = await run_in_threadpool(get_file_content, repo_name, commit.get('id'), file_path)
                 if content:
                     file_contents[file_path] = content
             
@@ -160,7 +136,7 @@ async def handle_github_webhook(request: Request):
             print(f"{Fore.CYAN}{'='*50}{Style.RESET_ALL}")
             
             # Trigger code review with diff and full file contents
-            trigger_code_review({
+            await trigger_code_review({
                 'repository': repo_name,
                 'commit_sha': commit.get('id'),
                 'commit_message': commit.get('message'),
@@ -170,12 +146,43 @@ async def handle_github_webhook(request: Request):
                 'code_diff': diff,
                 'file_contents': file_contents  # Add full file contents
             })
+        except Exception as e:
+            print(f"{Fore.RED}Error reviewing commit {commit.get('id')}: {str(e)}{Style.RESET_ALL}")
+
+@github_webhook.post('/webhook/github')
+async def handle_github_webhook(request: Request, response: Response, background_tasks: BackgroundTasks):
+    # Get raw body for signature verification
+    body = await request.body()
+    
+    # Verify webhook signature if secret is set
+    signature = request.headers.get('X-Hub-Signature-256')
+    if not verify_github_signature(body, signature):
+        raise HTTPException(status_code=401, detail='Invalid signature')
+
+    event_type = request.headers.get('X-GitHub-Event')
+    if event_type != 'push':
+        return {'message': f'Event {event_type} ignored'}
+
+    try:
+        # Parse the payload
+        if isinstance(body, bytes):
+            body_str = body.decode('utf-8')
+        payload = json.loads(body_str)
         
-        return {'message': 'Webhook processed successfully'}
-        
+        # Handle nested JSON from smee.io
+        if 'payload' in payload and isinstance(payload['payload'], str):
+            payload = json.loads(payload['payload'])
+
+        repo_name = payload.get('repository', {}).get('full_name')
+        commits = payload.get('commits', [])
     except json.JSONDecodeError as e:
         print(f"{Fore.RED}Error parsing JSON: {str(e)}{Style.RESET_ALL}")
         raise HTTPException(status_code=400, detail='Invalid JSON payload')
     except Exception as e:
         print(f"{Fore.RED}Error processing webhook: {str(e)}{Style.RESET_ALL}")
-        raise HTTPException(status_code=500, detail='Internal server error')
\ No newline at end of file
+        raise HTTPException(status_code=500, detail='Internal server error')
+
+    # Reviews take as long as the WCA calls; answer GitHub before its webhook timeout
+    background_tasks.add_task(review_commits, repo_name, commits)
+    response.status_code = 202
+    return {'message': f'Webhook accepted; reviewing {len(commits)} commit(s)'}